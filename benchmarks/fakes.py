@@ -0,0 +1,219 @@
+"""Local stand-ins for the Google, Shopify and OpenAI backends.
+
+`ReplayHttp` is an httplib2-compatible transport that answers Gmail, Sheets
+and Analytics Reporting requests from the recorded fixtures in
+`benchmarks/fixtures/`, scaled to any number of messages or report rows.
+Services built on it go through the real googleapiclient request, batch
+and JSON handling, so benchmarks measure client-side costs without network.
+"""
+import copy
+import json
+import os
+import re
+import urllib.parse
+from email.parser import FeedParser
+
+import httplib2
+from langchain_core.language_models.llms import LLM
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixture(name):
+    """Load a recorded response from the fixtures directory."""
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+def _json_response(payload, status=200):
+    response = httplib2.Response({'status': status, 'content-type': 'application/json; charset=UTF-8'})
+    return response, json.dumps(payload).encode('utf-8')
+
+class GmailMailbox:
+    """A mailbox of `size` messages cloned from the recorded Gmail fixtures."""
+
+    def __init__(self, size, page_size=500):
+        """Initialize with the number of messages delivered since historyId 1."""
+        self.templates = load_fixture('gmail_messages.json')
+        self.ids = [f'{i:016x}' for i in range(1, size + 1)]
+        self.page_size = page_size
+        self.history_id = str(size + 1)
+
+    def message(self, message_id):
+        """Get the full message resource for an ID."""
+        template = self.templates[int(message_id, 16) % len(self.templates)]
+        message = copy.deepcopy(template)
+        message['id'] = message_id
+        message['threadId'] = message_id
+        return message
+
+    def page(self, token, key, wrap):
+        """Get one page of IDs, wrapped per item by `wrap`, plus the next page token."""
+        start = int(token or 0)
+        end = start + self.page_size
+        payload = {key: [wrap(message_id) for message_id in self.ids[start:end]]}
+        if end < len(self.ids):
+            payload['nextPageToken'] = str(end)
+        return payload
+
+class ReplayHttp:
+    """httplib2-compatible transport replaying recorded API responses.
+
+    Args:
+        mailbox: GmailMailbox answering Gmail requests
+        report_rows: Number of rows every Analytics report has
+    """
+
+    def __init__(self, mailbox=None, report_rows=0):
+        self.mailbox = mailbox
+        self.report_rows = report_rows
+        self.report = load_fixture('ga_page_report.json')
+        self.append_response = load_fixture('sheets_append.json')
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        """Answer one HTTP request."""
+        self.requests += 1
+        parsed = urllib.parse.urlparse(uri)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        path = parsed.path
+
+        if path == '/batch' or path.startswith('/batch/'):
+            return self._batch(body, headers)
+        if path.startswith('/gmail/v1/users/'):
+            return self._gmail(path, query)
+        if path.startswith('/v4/spreadsheets/') and path.endswith(':append'):
+            return _json_response(self.append_response)
+        if path == '/v4/reports:batchGet':
+            return _json_response(self._reports(json.loads(body)))
+        return _json_response({'error': {'code': 404, 'message': f'No replay for {path}'}}, status=404)
+
+    def _gmail(self, path, query):
+        mailbox = self.mailbox
+        if path.endswith('/profile'):
+            return _json_response({'emailAddress': 'support@example.com', 'historyId': mailbox.history_id})
+        if path.endswith('/history'):
+            payload = mailbox.page(query.get('pageToken'), 'history', lambda message_id: {
+                'id': message_id,
+                'messagesAdded': [{'message': {'id': message_id, 'labelIds': ['UNREAD', 'INBOX']}}]
+            })
+            payload['historyId'] = mailbox.history_id
+            return _json_response(payload)
+        if path.endswith('/messages'):
+            return _json_response(mailbox.page(query.get('pageToken'), 'messages',
+                                               lambda message_id: {'id': message_id, 'threadId': message_id}))
+        if path.endswith('/messages/batchModify'):
+            return httplib2.Response({'status': 204}), b''
+        match = re.search(r'/messages/([0-9a-f]+)$', path)
+        if match:
+            return _json_response(mailbox.message(match.group(1)))
+        return _json_response({'error': {'code': 404}}, status=404)
+
+    def _batch(self, body, headers):
+        """Split a multipart batch request and answer every part."""
+        parser = FeedParser()
+        parser.feed(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        parts = []
+        for part in parser.close().get_payload():
+            request_line = part.get_payload().split('\n', 1)[0]
+            method, uri, _ = request_line.split(' ', 2)
+            response, content = self.request(f'https://replay.local{uri}', method)
+            content_id = ' '.join(part['Content-ID'].split())
+            parts.append(
+                '--replay_batch\r\n'
+                'Content-Type: application/http\r\n'
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f'HTTP/1.1 {response.status} OK\r\n'
+                'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+                f"{content.decode('utf-8')}\r\n"
+            )
+        content = ''.join(parts) + '--replay_batch--\r\n'
+        response = httplib2.Response({'status': 200, 'content-type': 'multipart/mixed; boundary=replay_batch'})
+        return response, content.encode('utf-8')
+
+    def _reports(self, body):
+        """Answer a batchGet with `report_rows` rows per report, in pages."""
+        reports = []
+        for report_request in body['reportRequests']:
+            page_size = report_request.get('pageSize', 1000)
+            start = int(report_request.get('pageToken', 0))
+            end = min(start + page_size, self.report_rows)
+            templates = self.report['data']['rows']
+            range_count = len(report_request['dateRanges'])
+            rows = []
+            for i in range(start, end):
+                template = templates[i % len(templates)]
+                rows.append({
+                    'dimensions': [f"{template['dimensions'][0].rstrip('/')}/{i}"],
+                    'metrics': [template['metrics'][0]] * range_count
+                })
+
+            report = {
+                'columnHeader': self.report['columnHeader'],
+                'data': {'rows': rows, 'rowCount': self.report_rows}
+            }
+            if end < self.report_rows:
+                report['nextPageToken'] = str(end)
+            reports.append(report)
+        return {'reports': reports}
+
+# Answer the fake LLM gives for every email
+FAKE_EMAIL_RESULT = {
+    'customer_name': 'Jane Smith',
+    'product': 'Widget X',
+    'sentiment': 'negative',
+    'main_issue': 'Damaged on arrival',
+    'priority': 'high'
+}
+
+class FakeEmailLLM(LLM):
+    """Deterministic LLM answering the email extraction prompts instantly.
+
+    Batched prompts get one object per "### EMAIL <index> ###" section.
+    """
+
+    @property
+    def _llm_type(self):
+        return 'fake-email'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        indices = re.findall(r'### EMAIL (\d+) ###', prompt)
+        if indices:
+            return json.dumps([dict(FAKE_EMAIL_RESULT, index=int(index)) for index in indices])
+        return json.dumps(FAKE_EMAIL_RESULT)
+
+class FakePage(list):
+    """Stand-in for a Shopify PaginatedCollection."""
+
+    def __init__(self, items, next_page=None):
+        super().__init__(items)
+        self._next_page = next_page
+
+    def has_next_page(self):
+        return self._next_page is not None
+
+    def next_page(self, no_cache=False):
+        return self._next_page()
+
+class FakeOrderResource:
+    """Shopify Order resource serving `size` orders cloned from the recorded fixtures."""
+
+    def __init__(self, size):
+        import shopify
+
+        # Resources need a site to be instantiated, even though nothing is requested
+        shopify.ShopifyResource.set_site('https://bench.myshopify.com/admin/api/2024-01')
+        self.size = size
+        self.templates = load_fixture('shopify_orders.json')
+        self._order_class = shopify.Order
+
+    def find(self, limit=50, **params):
+        """Get the first page of orders."""
+        return self._page(0, limit)
+
+    def _page(self, start, limit):
+        end = min(start + limit, self.size)
+        orders = []
+        for i in range(start, end):
+            attributes = dict(self.templates[i % len(self.templates)], id=i + 1)
+            orders.append(self._order_class(attributes))
+        next_page = (lambda: self._page(end, limit)) if end < self.size else None
+        return FakePage(orders, next_page)
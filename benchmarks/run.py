@@ -0,0 +1,245 @@
+"""Offline benchmarks for the connectors and processors.
+
+Every benchmark replays recorded API responses through local stand-in
+transports (see `benchmarks/fakes.py`) and a deterministic fake LLM, so runs
+need no credentials or network and are comparable between commits.
+
+Usage:
+    python -m benchmarks.run [--scales 10 100 1000] [--repeat 3]
+                             [--only NAME ...] [--output PATH] [--compare PATH]
+
+Results are written as JSON to `benchmarks/results/` (or `--output`);
+`--compare` prints the change in median time against an earlier results file.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'src'))
+
+from benchmarks.fakes import GmailMailbox, ReplayHttp, FakeEmailLLM, FakeOrderResource
+
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+DEFAULT_SCALES = [10, 100, 1000]
+
+# Name -> (setup function, items per unit of scale)
+BENCHMARKS = {}
+
+def benchmark(name, base_size):
+    """Register a benchmark setup function.
+
+    The setup function receives the number of items and an ExitStack for
+    patches, and returns the callable that is timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, base_size)
+        return setup
+    return register
+
+def replay_service(api, version, http):
+    """Build a real googleapiclient service on a replay transport."""
+    from googleapiclient.discovery import build
+    from connectors.services import InstrumentedHttp
+
+    return build(api, version, http=InstrumentedHttp(http, api), cache_discovery=False, static_discovery=True)
+
+def page_metrics(rows):
+    """Get a page metrics DataFrame of `rows` pages through the replayed Analytics API."""
+    from connectors.analytics import get_page_metrics
+
+    service = replay_service('analyticsreporting', 'v4', ReplayHttp(report_rows=rows))
+    return get_page_metrics(service, 'bench-view', '2024-03-01', '2024-03-31')
+
+@benchmark('process_emails', 10)
+def bench_process_emails(size, stack):
+    import main
+    from connectors.gmail import save_history_checkpoint
+    from storage.parquet_store import ParquetStore
+    from work_queue import EmailWorkQueue
+
+    mailbox = GmailMailbox(size)
+    gmail = replay_service('gmail', 'v1', ReplayHttp(mailbox))
+    sheets = replay_service('sheets', 'v4', ReplayHttp())
+    store_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+    stack.enter_context(patch('main.get_gmail_credentials', return_value=object()))
+    stack.enter_context(patch('connectors.gmail.GMAIL_USER', 'me'))
+    stack.enter_context(patch('connectors.gmail.build_service', return_value=gmail))
+    stack.enter_context(patch('main.SPREADSHEET_ID', 'bench-spreadsheet'))
+    stack.enter_context(patch('work_queue.get_sheets_service', return_value=sheets))
+    stack.enter_context(patch('main.get_store', return_value=ParquetStore(store_dir)))
+    stack.enter_context(patch('processors.email_parser.get_result_cache', return_value=None))
+    stack.enter_context(patch('processors.email_parser._llm', FakeEmailLLM()))
+    queue_patch = stack.enter_context(patch('main.get_work_queue'))
+
+    def run():
+        save_history_checkpoint('1')
+        # A fresh queue per run, so every repeat processes the whole mailbox
+        queue_patch.return_value = EmailWorkQueue(os.path.join(store_dir, f'queue_{time.monotonic_ns()}.sqlite3'))
+        main.process_emails()
+        # process_emails logs and swallows errors, so check it got to the end
+        if queue_patch.return_value.counts()['acked'] != size:
+            raise RuntimeError("process_emails did not complete")
+    return run
+
+@benchmark('get_unread_emails', 10)
+def bench_get_unread_emails(size, stack):
+    from connectors.gmail import get_unread_emails
+
+    gmail = replay_service('gmail', 'v1', ReplayHttp(GmailMailbox(size)))
+    stack.enter_context(patch('connectors.gmail.GMAIL_USER', 'me'))
+    stack.enter_context(patch('connectors.gmail.build_service', return_value=gmail))
+
+    def run():
+        emails = get_unread_emails(object(), max_results=None)
+        assert len(emails) == size
+    return run
+
+@benchmark('get_page_metrics', 100)
+def bench_get_page_metrics(size, stack):
+    def run():
+        assert len(page_metrics(size)) == size
+    return run
+
+@benchmark('calculate_conversion_funnel', 100)
+def bench_calculate_conversion_funnel(size, stack):
+    from processors.analytics import calculate_conversion_funnel
+
+    df = page_metrics(size)
+    steps = list(df['ga:pagePath'][:4])
+
+    def run():
+        calculate_conversion_funnel(df, steps)
+    return run
+
+@benchmark('identify_underperforming_pages', 100)
+def bench_identify_underperforming_pages(size, stack):
+    from processors.analytics import identify_underperforming_pages
+
+    df = page_metrics(size)
+
+    def run():
+        identify_underperforming_pages(df, threshold=0.6)
+    return run
+
+@benchmark('iter_orders', 25)
+def bench_iter_orders(size, stack):
+    from connectors.shopify import iter_orders
+
+    resource = FakeOrderResource(size)
+    stack.enter_context(patch('connectors.shopify.initialize_shopify',
+                              return_value=SimpleNamespace(Order=resource)))
+
+    def run():
+        assert sum(len(chunk) for chunk in iter_orders()) == size
+    return run
+
+def run_benchmark(name, scale, repeat):
+    """Set up one benchmark at one scale and time `repeat` runs of it."""
+    setup, base_size = BENCHMARKS[name]
+    size = base_size * scale
+    with ExitStack() as stack:
+        run = setup(size, stack)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+
+    median = statistics.median(timings)
+    return {
+        'name': name,
+        'scale': scale,
+        'items': size,
+        'repeat': repeat,
+        'min_seconds': min(timings),
+        'median_seconds': median,
+        'items_per_second': size / median if median > 0 else None
+    }
+
+def git_commit():
+    """Get the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Print the change in median time of every benchmark against a baseline file."""
+    with open(baseline_path) as f:
+        baseline = {(r['name'], r['scale']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result['name'], result['scale']))
+        if before is None:
+            continue
+        change = (result['median_seconds'] / before['median_seconds'] - 1) * 100
+        print(f"  {result['name']:<32} x{result['scale']:<5} {change:+7.1f}%")
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="Data size multipliers")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark and scale")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run the benchmarks and save the results."""
+    args = parse_args(argv)
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json"
+    ))
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    # Run from a scratch directory so logs, checkpoints and caches stay out of the tree
+    workdir = tempfile.mkdtemp(prefix='bi-bench-')
+    os.chdir(workdir)
+    os.makedirs('logs', exist_ok=True)
+    import main as app  # configures logging on import
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for name in args.only or BENCHMARKS:
+        for scale in args.scales:
+            result = run_benchmark(name, scale, args.repeat)
+            results.append(result)
+            print(f"{name:<32} x{scale:<5} {result['items']:>8} items  "
+                  f"{result['median_seconds']:9.4f}s  {result['items_per_second'] or 0:12.1f} items/s")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline:
+        compare(results, baseline)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 from langchain.agents import initialize_agent, AgentType
 from langchain.llms import OpenAI
 from config import OPENAI_API_KEY
+from resilience import call_limited
 
 def create_analysis_agent(tools):
     """Create an agent for analyzing business data and making decisions.
@@ -47,7 +48,7 @@ def generate_recommendation(analysis_result):
         Recommendation string
     """
     # Initialize LLM
-    llm = OpenAI(temperature=0.2, api_key=OPENAI_API_KEY)
+    llm = OpenAI(temperature=0.2, api_key=OPENAI_API_KEY, max_retries=0)
     
     prompt = f"""
     Based on the following analysis result, provide a concise recommendation
@@ -59,4 +60,4 @@ def generate_recommendation(analysis_result):
     Recommendation:
     """
     
-    return llm.generate([prompt]).generations[0][0].text.strip()
\ No newline at end of file
+    return call_limited('openai', llm.generate, [prompt]).generations[0][0].text.strip()
\ No newline at end of file
@@ -1,7 +1,40 @@
 """Custom tools for LangChain agents."""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain.tools import BaseTool
-from typing import Optional, Type
+from typing import Any, Optional, Type
 from pydantic import BaseModel, Field
+from config import AGENT_TOOL_WORKERS
+
+_executor = None
+_executor_lock = threading.Lock()
+_service_locks = {}
+
+def get_tool_executor():
+    """Get the thread pool shared by all tools for blocking Google client calls."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix='agent-tool')
+        return _executor
+
+def _service_lock(service):
+    """Get the lock serializing calls on one Google API service object.
+
+    googleapiclient services are not thread-safe, so concurrent tool calls
+    may only overlap when they use different services.
+    """
+    with _executor_lock:
+        return _service_locks.setdefault(id(service), threading.Lock())
+
+async def _run_blocking(service, func, *args):
+    """Run a blocking call on the shared executor, one call per service at a time."""
+    def call():
+        with _service_lock(service):
+            return func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_executor(), call)
 
 class GoogleSheetsInput(BaseModel):
     """Input for Google Sheets tool."""
@@ -12,6 +45,7 @@ class GoogleSheetsTool(BaseTool):
     name = "google_sheets_reader"
     description = "Use this tool to read data from a Google Sheets spreadsheet"
     args_schema: Type[BaseModel] = GoogleSheetsInput
+    sheets_service: Any = None
     
     def __init__(self, sheets_service):
         """Initialize with sheets service."""
@@ -28,9 +62,9 @@ class GoogleSheetsTool(BaseTool):
         except Exception as e:
             return f"Error reading from Google Sheets: {str(e)}"
             
-    def _arun(self, sheet_range: str):
+    async def _arun(self, sheet_range: str) -> str:
         """Run the tool asynchronously."""
-        raise NotImplementedError("GoogleSheetsTool does not support async")
+        return await _run_blocking(self.sheets_service, self._run, sheet_range)
 
 class EmailAnalysisInput(BaseModel):
     """Input for email analysis tool."""
@@ -52,9 +86,15 @@ class EmailAnalysisTool(BaseTool):
         except Exception as e:
             return f"Error analyzing email: {str(e)}"
             
-    def _arun(self, email_body: str):
+    async def _arun(self, email_body: str) -> str:
         """Run the tool asynchronously."""
-        raise NotImplementedError("EmailAnalysisTool does not support async")
+        from src.processors.email_parser import aparse_email_content
+        
+        try:
+            result = await aparse_email_content(email_body)
+            return str(result)
+        except Exception as e:
+            return f"Error analyzing email: {str(e)}"
 
 class PagePerformanceInput(BaseModel):
     """Input for page performance analysis tool."""
@@ -65,6 +105,8 @@ class PagePerformanceTool(BaseTool):
     name = "page_performance_analyzer"
     description = "Use this tool to identify underperforming pages on the website"
     args_schema: Type[BaseModel] = PagePerformanceInput
+    analytics_service: Any = None
+    view_id: Optional[str] = None
     
     def __init__(self, analytics_service, view_id):
         """Initialize with analytics service."""
@@ -72,24 +114,33 @@ class PagePerformanceTool(BaseTool):
         self.analytics_service = analytics_service
         self.view_id = view_id
     
-    def _run(self, days: int = 30) -> str:
+    def _run(self, days: int = 30, top_k: int = 20) -> str:
         """Run the tool."""
         from datetime import datetime, timedelta
-        from src.connectors.analytics import get_page_metrics
-        from src.processors.analytics import identify_underperforming_pages
+        from src.processors.analytics import identify_underperforming_pages, rolling_page_metrics
+        from src.storage.ingest import ingest_daily_page_metrics
+        from src.storage.parquet_store import get_store
         
         try:
-            end_date = datetime.now().strftime('%Y-%m-%d')
+            # Window of the last `days` complete days, answered from daily
+            # partitions; only days not stored yet are fetched
+            end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
             start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
             
-            metrics = get_page_metrics(
+            store = get_store()
+            ingest_daily_page_metrics(
+                store,
                 self.analytics_service,
                 self.view_id,
                 start_date,
                 end_date
             )
+            daily = store.read('page_daily', start_date=start_date, end_date=end_date)
+            if daily.empty:
+                return "No underperforming pages identified."
+            metrics = rolling_page_metrics(daily)
             
-            underperforming = identify_underperforming_pages(metrics)
+            underperforming = identify_underperforming_pages(metrics, top_k=top_k)
             
             if underperforming.empty:
                 return "No underperforming pages identified."
@@ -98,6 +149,6 @@ class PagePerformanceTool(BaseTool):
         except Exception as e:
             return f"Error analyzing page performance: {str(e)}"
             
-    def _arun(self, days: int = 30):
+    async def _arun(self, days: int = 30, top_k: int = 20) -> str:
         """Run the tool asynchronously."""
-        raise NotImplementedError("PagePerformanceTool does not support async")
\ No newline at end of file
+        return await _run_blocking(self.analytics_service, self._run, days, top_k)
\ No newline at end of file
@@ -7,17 +7,112 @@ load_dotenv()
 
 # Google API settings
 GOOGLE_CREDENTIALS_PATH = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+GOOGLE_HTTP_TIMEOUT = int(os.getenv('GOOGLE_HTTP_TIMEOUT', '60'))  # seconds
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+SHEETS_BATCH_MAX_ROWS = int(os.getenv('SHEETS_BATCH_MAX_ROWS', '500'))
+SHEETS_BATCH_MAX_INTERVAL = float(os.getenv('SHEETS_BATCH_MAX_INTERVAL', '30'))  # seconds
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '5'))
+SHEETS_MIRROR_ENABLED = os.getenv('SHEETS_MIRROR_ENABLED', 'true').lower() == 'true'
+GA_VIEW_ID = os.getenv('GA_VIEW_ID')
 GMAIL_USER = os.getenv('GMAIL_USER')
+GMAIL_CHECKPOINT_PATH = os.getenv('GMAIL_CHECKPOINT_PATH', 'data/gmail_checkpoint.json')
+GMAIL_SYNC_LABEL = os.getenv('GMAIL_SYNC_LABEL', 'INBOX')
+GMAIL_FULL_SCAN_LIMIT = int(os.getenv('GMAIL_FULL_SCAN_LIMIT', '500'))  # messages
 
 # OpenAI settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo-instruct')
+
+# Agent settings
+AGENT_TOOL_WORKERS = int(os.getenv('AGENT_TOOL_WORKERS', '8'))  # threads for blocking tool calls
 
 # Shopify settings
 SHOPIFY_API_KEY = os.getenv('SHOPIFY_API_KEY')
 SHOPIFY_API_SECRET = os.getenv('SHOPIFY_API_SECRET')
 SHOPIFY_STORE_URL = os.getenv('SHOPIFY_STORE_URL')
+SHOPIFY_SYNC_OVERLAP = int(os.getenv('SHOPIFY_SYNC_OVERLAP', '300'))  # seconds re-fetched before the last sync
 
 # Application settings
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-DATA_REFRESH_INTERVAL = int(os.getenv('DATA_REFRESH_INTERVAL', '3600'))  # seconds
\ No newline at end of file
+DATA_REFRESH_INTERVAL = int(os.getenv('DATA_REFRESH_INTERVAL', '3600'))  # seconds
+
+# Scheduler settings: cron expressions (minute hour day month weekday) per job
+JOB_SCHEDULES = {
+    'process_emails': os.getenv('EMAIL_JOB_SCHEDULE', '0 * * * *'),
+    'sync_shop_data': os.getenv('SHOP_SYNC_SCHEDULE', '0 * * * *'),
+    'sync_analytics_data': os.getenv('ANALYTICS_SYNC_SCHEDULE', '0 6 * * *'),
+    'run_analysis': os.getenv('ANALYSIS_SCHEDULE', '0 7 * * *'),
+    'write_metrics_snapshot': os.getenv('METRICS_SNAPSHOT_SCHEDULE', '* * * * *')
+}
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '4'))  # jobs that may run at once
+
+# Metrics settings
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Prometheus endpoint; 0 disables it
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH', 'data/metrics.json')
+
+# Email parsing settings
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '20'))  # emails per LLM prompt
+EMAIL_BODY_MAX_TOKENS = int(os.getenv('EMAIL_BODY_MAX_TOKENS', '1500'))  # per email; exact with tiktoken installed
+LLM_MAX_REASKS = int(os.getenv('LLM_MAX_REASKS', '1'))  # targeted re-asks for invalid answer fields
+
+# Email pre-classifier settings: trivial emails answered without the LLM
+PRECLASSIFIER_ENABLED = os.getenv('PRECLASSIFIER_ENABLED', 'true').lower() == 'true'
+PRECLASSIFIER_THRESHOLD = float(os.getenv('PRECLASSIFIER_THRESHOLD', '0.9'))  # minimum confidence to skip the LLM
+PRECLASSIFIER_MODEL_PATH = os.getenv('PRECLASSIFIER_MODEL_PATH', 'data/email_classifier.pkl')
+
+# Near-duplicate clustering: one LLM call per cluster of similar emails
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.9'))  # minimum Jaccard similarity of word shingles
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', '128'))  # MinHash permutations
+
+# Parsing result cache settings
+PARSE_CACHE_ENABLED = os.getenv('PARSE_CACHE_ENABLED', 'true').lower() == 'true'
+PARSE_CACHE_PATH = os.getenv('PARSE_CACHE_PATH', 'data/parse_cache.sqlite3')
+PARSE_CACHE_TTL = int(os.getenv('PARSE_CACHE_TTL', str(30 * 24 * 3600)))  # seconds
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '100000'))
+
+# Pipelined ingestion settings
+PIPELINE_FETCH_CONCURRENCY = int(os.getenv('PIPELINE_FETCH_CONCURRENCY', '4'))  # Gmail batch requests
+PIPELINE_PARSE_CONCURRENCY = int(os.getenv('PIPELINE_PARSE_CONCURRENCY', '8'))  # LLM calls
+PIPELINE_WRITE_CONCURRENCY = int(os.getenv('PIPELINE_WRITE_CONCURRENCY', '1'))  # Sheets writers
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '100'))
+
+# External call settings: rate limits, retries and circuit breakers per API
+API_RATE_LIMITS = {  # requests per second; 0 disables the limit
+    'gmail': float(os.getenv('GMAIL_RATE_LIMIT', '0')),
+    'sheets': float(os.getenv('SHEETS_RATE_LIMIT', '0')),
+    'analyticsreporting': float(os.getenv('ANALYTICS_RATE_LIMIT', '0')),
+    'shopify': float(os.getenv('SHOPIFY_RATE_LIMIT', '2')),
+    'openai': float(os.getenv('OPENAI_RATE_LIMIT', '0'))
+}
+RETRY_MAX_RETRIES = int(os.getenv('RETRY_MAX_RETRIES', '5'))
+RETRY_BACKOFF = float(os.getenv('RETRY_BACKOFF', '1'))  # seconds, doubled per retry
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '60'))  # seconds, also caps Retry-After
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))  # consecutive server failures
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '60'))  # seconds before calls resume
+
+# Durable email work queue: each message moves queued -> fetched -> parsed -> written -> acked
+EMAIL_QUEUE_PATH = os.getenv('EMAIL_QUEUE_PATH', 'data/email_queue.sqlite3')
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv('EMAIL_QUEUE_BATCH_SIZE', '100'))  # messages claimed per step
+EMAIL_QUEUE_LEASE = int(os.getenv('EMAIL_QUEUE_LEASE', '600'))  # seconds before a claim can be taken over
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('EMAIL_QUEUE_MAX_ATTEMPTS', '5'))  # claims before a message is parked
+EMAIL_QUEUE_RETRY_DELAY = int(os.getenv('EMAIL_QUEUE_RETRY_DELAY', '60'))  # seconds before a failed step is retried
+# Seconds acked message IDs are kept to ignore Gmail listing them again. Gmail keeps history
+# records for about a week and the full-scan fallback only lists unread (so unacked) mail.
+EMAIL_QUEUE_ACKED_RETENTION = int(os.getenv('EMAIL_QUEUE_ACKED_RETENTION', str(30 * 24 * 3600)))
+
+# Local data store settings
+DATA_STORE_PATH = os.getenv('DATA_STORE_PATH', 'data/store')
+
+# Multi-tenant settings: many mailboxes, stores and views served by one host
+TENANTS_PATH = os.getenv('TENANTS_PATH')  # JSON or YAML tenant registry; unset runs the single tenant above
+TENANT_DATA_PATH = os.getenv('TENANT_DATA_PATH', 'data/tenants')  # per-tenant store and checkpoints
+TENANT_WORKERS = int(os.getenv('TENANT_WORKERS', str(os.cpu_count() or 1)))  # tenant processes
+# Requests per second per tenant, defaulting to the API_RATE_LIMITS settings when those are set
+TENANT_RATE_LIMITS = {
+    'gmail': float(os.getenv('TENANT_GMAIL_RATE_LIMIT', os.getenv('GMAIL_RATE_LIMIT', '20'))),
+    'sheets': float(os.getenv('TENANT_SHEETS_RATE_LIMIT', os.getenv('SHEETS_RATE_LIMIT', '1'))),
+    'analyticsreporting': float(os.getenv('TENANT_ANALYTICS_RATE_LIMIT', os.getenv('ANALYTICS_RATE_LIMIT', '10'))),
+    'shopify': float(os.getenv('TENANT_SHOPIFY_RATE_LIMIT', os.getenv('SHOPIFY_RATE_LIMIT', '2')))
+}
@@ -1,68 +1,242 @@
 """Google Analytics connector for fetching website metrics."""
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import json
+import numpy as np
 import pandas as pd
-from config import GOOGLE_CREDENTIALS_PATH
+from connectors.services import get_service
+from metrics import increment, timed
+from resilience import call
 
-def get_analytics_service():
+ANALYTICS_SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
+
+# Reporting API v4 limits
+MAX_PAGE_SIZE = 100000
+MAX_REPORTS_PER_BATCH = 5
+MAX_DATE_RANGES_PER_REQUEST = 2
+
+PAGE_METRICS = ['ga:sessions', 'ga:pageviews', 'ga:bounceRate', 'ga:avgSessionDuration']
+
+# Additive counterparts of PAGE_METRICS: totals can be summed across days,
+# and bounce rate and average duration derived from the sums
+DAILY_PAGE_METRICS = ['ga:sessions', 'ga:pageviews', 'ga:bounces', 'ga:sessionDuration']
+
+# Metric types reported as whole numbers; every other type is a float
+INTEGER_METRIC_TYPES = {'INTEGER'}
+
+def get_analytics_service(credentials_path=None):
     """Get Google Analytics API service."""
-    credentials = service_account.Credentials.from_service_account_file(
-        GOOGLE_CREDENTIALS_PATH,
-        scopes=['https://www.googleapis.com/auth/analytics.readonly']
-    )
-    return build('analyticsreporting', 'v4', credentials=credentials)
+    return get_service('analyticsreporting', 'v4', ANALYTICS_SCOPES, credentials_path)
+
+def _batch_key(report_request):
+    """Fields that must be identical for report requests sharing one batchGet."""
+    return json.dumps([
+        report_request.get('viewId'),
+        report_request.get('dateRanges'),
+        report_request.get('segments'),
+        report_request.get('samplingLevel'),
+        report_request.get('cohortGroup')
+    ], sort_keys=True)
+
+def _page_to_frames(column_header, rows, range_count):
+    """Convert one page of report rows into a typed DataFrame per date range.
+
+    Columns are built from arrays: dimension values are gathered per column
+    and all metric values are converted in a single pass, then cast to int64
+    or float64 according to the metric type reported by the API.
+    """
+    dimensions = column_header.get('dimensions', [])
+    entries = column_header['metricHeader']['metricHeaderEntries']
+
+    dimension_values = [row['dimensions'] for row in rows]
+    dimension_columns = {
+        name: np.array([values[i] for values in dimension_values], dtype=object)
+        for i, name in enumerate(dimensions)
+    }
+
+    frames = []
+    for range_index in range(range_count):
+        values = np.array(
+            [row['metrics'][range_index]['values'] for row in rows],
+            dtype=np.float64
+        ).reshape(len(rows), len(entries))
+
+        columns = dict(dimension_columns)
+        for i, entry in enumerate(entries):
+            if entry.get('type') in INTEGER_METRIC_TYPES:
+                columns[entry['name']] = values[:, i].astype(np.int64)
+            else:
+                columns[entry['name']] = values[:, i]
+        frames.append(pd.DataFrame(columns, columns=dimensions + [e['name'] for e in entries]))
+    return frames
+
+@timed('connector_seconds', operation='analytics.batch_get_reports')
+def batch_get_reports(service, report_requests):
+    """Run report requests, packing compatible ones into shared batchGet calls.
+
+    Up to five requests that share view, date ranges and sampling go into
+    one batchGet. Each report is paged through with `nextPageToken` until
+    exhausted, and every page is converted to typed columns as it arrives.
+
+    Args:
+        service: Google Analytics API service
+        report_requests: List of Reporting API v4 ReportRequest dictionaries
+
+    Returns:
+        List with, for each request, a list of DataFrames, one per date range
+    """
+    pages = [[] for _ in report_requests]
+    pending = list(enumerate(report_requests))
+
+    while pending:
+        # Take up to five requests that can share a batchGet
+        key = _batch_key(pending[0][1])
+        batch = [item for item in pending if _batch_key(item[1]) == key][:MAX_REPORTS_PER_BATCH]
+        batch_indices = {index for index, _ in batch}
+        pending = [item for item in pending if item[0] not in batch_indices]
+
+        batch_request = service.reports().batchGet(
+            body={'reportRequests': [request for _, request in batch]}
+        )
+        response = call('analyticsreporting', batch_request.execute)
+
+        for (index, request), report in zip(batch, response['reports']):
+            rows = report.get('data', {}).get('rows', [])
+            increment('analytics_rows_total', len(rows))
+            pages[index].append(_page_to_frames(report['columnHeader'], rows, len(request['dateRanges'])))
+
+            page_token = report.get('nextPageToken')
+            if page_token:
+                pending.append((index, dict(request, pageToken=page_token)))
+
+    return [
+        [pd.concat(range_frames, ignore_index=True) for range_frames in zip(*request_pages)]
+        for request_pages in pages
+    ]
+
+def build_report_request(view_id, date_ranges, metrics, dimensions, order_bys=None, page_size=MAX_PAGE_SIZE):
+    """Build a Reporting API v4 ReportRequest.
+
+    Args:
+        view_id: Analytics view ID
+        date_ranges: List of (start_date, end_date) tuples, at most two
+        metrics: List of metric expressions, e.g. ['ga:sessions']
+        dimensions: List of dimension names, e.g. ['ga:pagePath']
+        order_bys: Optional list of Reporting API OrderBy dictionaries
+        page_size: Rows per page
 
-def get_page_metrics(service, view_id, start_date, end_date):
+    Returns:
+        ReportRequest dictionary
+    """
+    request = {
+        'viewId': view_id,
+        'dateRanges': [{'startDate': start, 'endDate': end} for start, end in date_ranges],
+        'metrics': [{'expression': metric} for metric in metrics],
+        'dimensions': [{'name': dimension} for dimension in dimensions],
+        'pageSize': page_size
+    }
+    if order_bys:
+        request['orderBys'] = order_bys
+    return request
+
+def _own_rows(range_frames, group, dimensions):
+    """Keep, in each date range's frame, only the rows belonging to that range.
+
+    A report with two date ranges lists every dimension row found in either
+    range, with zero metrics in the range it does not occur in. Those rows
+    are dropped from a range when they have values in the other one, and a
+    `ga:date` dimension is also limited to the range's own days.
+    """
+    if len(range_frames) < 2:
+        return range_frames
+    nonzero = [frame.drop(columns=dimensions).ne(0).any(axis=1).to_numpy() for frame in range_frames]
+    frames = []
+    for i, (frame, (start_date, end_date)) in enumerate(zip(range_frames, group)):
+        elsewhere = np.logical_or.reduce([mask for j, mask in enumerate(nonzero) if j != i])
+        keep = nonzero[i] | ~elsewhere
+        if 'ga:date' in dimensions:
+            days = frame['ga:date'].to_numpy(dtype=str)
+            keep &= (days >= start_date.replace('-', '')) & (days <= end_date.replace('-', ''))
+        frames.append(frame[keep].reset_index(drop=True))
+    return frames
+
+def get_reports(service, view_id, date_ranges, report_specs, page_size=MAX_PAGE_SIZE):
+    """Fetch several reports over several date ranges with as few calls as possible.
+
+    Date ranges are packed two per request (the API maximum) and report
+    specs sharing those ranges go five per batchGet. Rows the API reports
+    for a range only because they occur in the other range of the same
+    request are dropped, see `_own_rows`.
+
+    Args:
+        service: Google Analytics API service
+        view_id: Analytics view ID
+        date_ranges: List of (start_date, end_date) tuples
+        report_specs: List of dictionaries with 'metrics' and 'dimensions'
+            lists and optional 'order_bys'
+        page_size: Rows per page
+
+    Returns:
+        List with one DataFrame per report spec, holding each date range's
+        rows and 'start_date' / 'end_date' columns identifying the range
+    """
+    range_groups = [
+        date_ranges[i:i + MAX_DATE_RANGES_PER_REQUEST]
+        for i in range(0, len(date_ranges), MAX_DATE_RANGES_PER_REQUEST)
+    ]
+
+    requests = []
+    owners = []
+    for group in range_groups:
+        for spec_index, spec in enumerate(report_specs):
+            requests.append(build_report_request(
+                view_id, group, spec['metrics'], spec['dimensions'], spec.get('order_bys'), page_size
+            ))
+            owners.append((spec_index, group))
+
+    frames = [[] for _ in report_specs]
+    for (spec_index, group), range_frames in zip(owners, batch_get_reports(service, requests)):
+        range_frames = _own_rows(range_frames, group, report_specs[spec_index]['dimensions'])
+        for (start_date, end_date), frame in zip(group, range_frames):
+            frames[spec_index].append(frame.assign(start_date=start_date, end_date=end_date))
+
+    return [pd.concat(spec_frames, ignore_index=True) for spec_frames in frames]
+
+def get_page_metrics(service, view_id, start_date, end_date, page_size=MAX_PAGE_SIZE):
     """Get page metrics from Google Analytics.
-    
+
     Args:
         service: Google Analytics API service
         view_id: Analytics view ID
         start_date: Start date in format 'YYYY-MM-DD'
         end_date: End date in format 'YYYY-MM-DD'
-        
+        page_size: Rows per page; every page is fetched
+
     Returns:
         Pandas DataFrame with page metrics
     """
-    response = service.reports().batchGet(
-        body={
-            'reportRequests': [
-                {
-                    'viewId': view_id,
-                    'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
-                    'metrics': [
-                        {'expression': 'ga:sessions'},
-                        {'expression': 'ga:pageviews'},
-                        {'expression': 'ga:bounceRate'},
-                        {'expression': 'ga:avgSessionDuration'}
-                    ],
-                    'dimensions': [{'name': 'ga:pagePath'}],
-                    'orderBys': [
-                        {'fieldName': 'ga:pageviews', 'sortOrder': 'DESCENDING'}
-                    ],
-                    'pageSize': 100
-                }
-            ]
-        }
-    ).execute()
-    
-    # Process the response
-    report = response['reports'][0]
-    dimensions = report['columnHeader']['dimensions']
-    metrics = [m['name'] for m in report['columnHeader']['metricHeader']['metricHeaderEntries']]
-    
-    all_data = []
-    for row in report['data'].get('rows', []):
-        dimension_values = row['dimensions']
-        metric_values = row['metrics'][0]['values']
-        all_data.append(dimension_values + metric_values)
-    
-    # Create DataFrame
-    columns = dimensions + metrics
-    df = pd.DataFrame(all_data, columns=columns)
-    
-    # Convert numeric columns
-    for metric in metrics:
-        df[metric] = pd.to_numeric(df[metric], errors='ignore')
-    
-    return df
\ No newline at end of file
+    request = build_report_request(
+        view_id,
+        [(start_date, end_date)],
+        PAGE_METRICS,
+        ['ga:pagePath'],
+        order_bys=[{'fieldName': 'ga:pageviews', 'sortOrder': 'DESCENDING'}],
+        page_size=page_size
+    )
+    return batch_get_reports(service, [request])[0][0]
+
+def get_daily_page_metrics(service, view_id, date_ranges, page_size=MAX_PAGE_SIZE):
+    """Get per-page totals for every day in the given date ranges.
+
+    Args:
+        service: Google Analytics API service
+        view_id: Analytics view ID
+        date_ranges: List of (start_date, end_date) tuples
+        page_size: Rows per page; every page is fetched
+
+    Returns:
+        Pandas DataFrame with 'date' (YYYY-MM-DD), 'ga:pagePath' and the
+        DAILY_PAGE_METRICS columns, one row per page and day
+    """
+    spec = {'metrics': DAILY_PAGE_METRICS, 'dimensions': ['ga:date', 'ga:pagePath']}
+    df = get_reports(service, view_id, date_ranges, [spec], page_size)[0]
+    dates = pd.to_datetime(df['ga:date'], format='%Y%m%d').dt.strftime('%Y-%m-%d')
+    return df.assign(date=dates)[['date', 'ga:pagePath'] + DAILY_PAGE_METRICS]
@@ -0,0 +1,251 @@
+"""Plain-text extraction from Gmail message payloads."""
+import base64
+import re
+from html.parser import HTMLParser
+
+# Containers whose text is never shown to the reader
+HTML_SKIPPED_TAGS = {'head', 'script', 'style', 'title', 'template'}
+
+# Tags that start a new line of text
+HTML_BLOCK_TAGS = {
+    'address', 'article', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'h1', 'h2', 'h3', 'h4',
+    'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul'
+}
+
+# Lines introducing the quoted message a reply carries
+QUOTE_HEADER = re.compile(
+    r'^\s*(On\b.{0,200}\bwrote:\s*$'
+    r'|-{2,}\s*Original Message\s*-{2,}'
+    r'|_{10,}\s*$)',
+    re.I
+)
+
+# Lines introducing a forwarded message, which is content rather than a quote
+FORWARD_HEADER = re.compile(r'^\s*(-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)', re.I)
+
+# Outlook quotes a reply under a "From:" line followed by "Sent:" or "Date:"
+OUTLOOK_FROM = re.compile(r'^\s*\*?From:\*?\s.+$', re.I)
+OUTLOOK_DATE = re.compile(r'^\s*\*?(Sent|Date):\*?\s', re.I)
+
+# Footers added by mail clients and legal departments
+CLIENT_FOOTER = re.compile(r'^\s*(Sent from my \w+|Get Outlook for \w+|Sent from Mail for Windows)', re.I)
+DISCLAIMER = re.compile(
+    r'^\s*(CONFIDENTIALITY NOTICE|DISCLAIMER|This (e-?mail|message)( and any attachments)? (is|are|may contain) '
+    r'(confidential|intended))',
+    re.I
+)
+
+# RFC 3676 signature delimiter
+SIGNATURE_DELIMITER = '-- '
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document, one line per block.
+
+    Text inside <blockquote> is prefixed with '> ' so quoted replies look the
+    same as in plain-text mail.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = ['']
+        self.skipping = 0
+        self.quote_depth = 0
+
+    def _new_line(self):
+        if self.lines[-1].strip():
+            self.lines.append('')
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self._new_line()
+            if tag == 'blockquote':
+                self.quote_depth += 1
+            elif tag == 'li':
+                self.lines[-1] = '- '
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in HTML_BLOCK_TAGS:
+            if tag == 'blockquote':
+                self.quote_depth = max(self.quote_depth - 1, 0)
+            self._new_line()
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        text = ' '.join(data.split())
+        if not text:
+            return
+        if not self.lines[-1]:
+            self.lines[-1] = '> ' * self.quote_depth
+        elif not self.lines[-1].endswith(' '):
+            self.lines[-1] += ' '
+        self.lines[-1] += text
+
+def html_to_text(html):
+    """Convert an HTML email body to plain text.
+
+    Args:
+        html: HTML document or fragment
+
+    Returns:
+        Visible text with one line per block element
+    """
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return '\n'.join(line.rstrip() for line in extractor.lines).strip()
+
+def _decode_part(part):
+    """Decode the body data of a MIME part using its declared charset."""
+    content_type = next(
+        (h['value'] for h in part.get('headers', []) if h['name'].lower() == 'content-type'), ''
+    )
+    match = re.search(r'charset="?([\w.:-]+)"?', content_type, re.I)
+    charset = match.group(1) if match else 'utf-8'
+    data = base64.urlsafe_b64decode(part['body']['data'])
+    try:
+        return data.decode(charset, errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+def _walk(part):
+    """Extract the text of a MIME part tree.
+
+    Returns:
+        Tuple of (text, whether it came from HTML), or None for parts
+        without text
+    """
+    if 'parts' in part:
+        texts = [text for text in map(_walk, part['parts']) if text and text[0].strip()]
+        if not texts:
+            return None
+        if part.get('mimeType') == 'multipart/alternative':
+            # Alternatives carry the same content; prefer the plain-text one
+            return next((text for text in texts if not text[1]), texts[0])
+        return '\n\n'.join(text for text, _ in texts), all(from_html for _, from_html in texts)
+
+    if part.get('filename') or 'data' not in part.get('body', {}):
+        return None  # attachment, or content fetched separately
+    mime_type = part.get('mimeType', 'text/plain')
+    if mime_type == 'text/plain':
+        return _decode_part(part), False
+    if mime_type == 'text/html':
+        return html_to_text(_decode_part(part)), True
+    return None
+
+def extract_body(payload):
+    """Get the text of a message payload, walking nested multipart parts.
+
+    Plain-text parts are preferred; HTML-only messages are converted to text.
+    Attachments are skipped.
+
+    Args:
+        payload: 'payload' of a Gmail message resource
+
+    Returns:
+        Body text, or an empty string if the message has none
+    """
+    text = _walk(payload)
+    return text[0] if text else ''
+
+def _is_quoted(line):
+    """Check whether a line is quoted with '>'."""
+    return line.lstrip().startswith('>')
+
+def _is_footer(line):
+    """Check whether a line starts a signature, client footer or disclaimer."""
+    return (line == SIGNATURE_DELIMITER or line.rstrip() == '--'
+            or bool(CLIENT_FOOTER.match(line) or DISCLAIMER.match(line)))
+
+def strip_quoted_text(text):
+    """Remove the quoted message a reply carries below the new text.
+
+    Forwarded messages are content, so the body is never cut at a forward
+    and everything from one on is kept. Quoted lines between new text, as
+    in inline replies, are kept for context; only the quote block after
+    the new text ends is removed. A message that is only a quote keeps its
+    quoted content, since there is nothing else to read.
+
+    Args:
+        text: Plain-text body
+
+    Returns:
+        Body without the trailing quote and reply headers
+    """
+    lines = text.splitlines()
+    has_content = False
+    for i, line in enumerate(lines):
+        if FORWARD_HEADER.match(line):
+            break
+        if QUOTE_HEADER.match(line) or (
+                OUTLOOK_FROM.match(line) and any(OUTLOOK_DATE.match(l) for l in lines[i + 1:i + 4])):
+            if has_content:
+                lines = lines[:i]
+                break
+        elif line.strip() and not _is_quoted(line):
+            has_content = True
+
+    # The new text ends at its last unquoted line before any signature or footer
+    end = 0
+    for i, line in enumerate(lines):
+        if FORWARD_HEADER.match(line):
+            end = len(lines)
+            break
+        if end and _is_footer(line):
+            break
+        if line.strip() and not _is_quoted(line):
+            end = i + 1
+
+    kept = lines[:end] + [line for line in lines[end:] if not _is_quoted(line)]
+    if not any(line.strip() for line in kept):
+        return text.strip()
+    return '\n'.join(kept).strip()
+
+def strip_signature(text):
+    """Remove the signature block, client footers and legal disclaimers.
+
+    Only the first line of a delimited signature is kept, since it usually
+    carries the sender's name. A forwarded message below the signature is
+    kept.
+
+    Args:
+        text: Plain-text body
+
+    Returns:
+        Body without signature details
+    """
+    lines = text.splitlines()
+    kept = []
+    skipping = False
+    for i, line in enumerate(lines):
+        if FORWARD_HEADER.match(line):
+            skipping = False
+        elif skipping:
+            continue
+        elif line == SIGNATURE_DELIMITER or line.rstrip() == '--':
+            name = next((l for l in lines[i + 1:] if l.strip()), None)
+            if name is not None and not FORWARD_HEADER.match(name):
+                kept.append(name)
+            skipping = True
+            continue
+        elif (CLIENT_FOOTER.match(line) or DISCLAIMER.match(line)) and any(l.strip() for l in kept):
+            skipping = True
+            continue
+        kept.append(line)
+    return '\n'.join(kept).strip()
+
+def clean_body(text):
+    """Reduce a body to the text its sender wrote for this message.
+
+    Args:
+        text: Plain-text body
+
+    Returns:
+        Body without quoted replies, signature details and runs of blank lines
+    """
+    text = strip_signature(strip_quoted_text(text))
+    return re.sub(r'\n{3,}', '\n\n', text)
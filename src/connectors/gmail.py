@@ -1,80 +1,324 @@
 """Gmail connector for fetching emails."""
-import base64
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from config import GOOGLE_CREDENTIALS_PATH, GMAIL_USER
-
-def get_gmail_credentials():
-    """Get Google API credentials for Gmail."""
-    return service_account.Credentials.from_service_account_file(
-        GOOGLE_CREDENTIALS_PATH,
-        scopes=['https://www.googleapis.com/auth/gmail.readonly']
-    )
+import json
+import logging
+import os
+import time
+from googleapiclient.errors import HttpError
+from config import GMAIL_USER, GMAIL_CHECKPOINT_PATH, GMAIL_SYNC_LABEL, GMAIL_FULL_SCAN_LIMIT
+from connectors.services import get_credentials, build_service
+from connectors.email_body import extract_body, clean_body
+from metrics import increment, timed
+from resilience import DEFAULT_RETRY_POLICY, call, is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Gmail accepts up to 100 calls per batch HTTP request and up to 1000 ids
+# per batchModify call
+FETCH_BATCH_SIZE = 100
+MODIFY_BATCH_SIZE = 1000
+LIST_PAGE_SIZE = 500
+
+# gmail.modify covers reading and the label change mark_as_read makes;
+# batchModify is refused under gmail.readonly
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+
+def get_gmail_credentials(credentials_path=None, subject=None):
+    """Get Google API credentials for Gmail.
+
+    Args:
+        credentials_path: Service account key file, defaulting to
+            GOOGLE_APPLICATION_CREDENTIALS
+        subject: Mailbox to impersonate through domain-wide delegation, if any
+    """
+    return get_credentials(GMAIL_SCOPES, credentials_path, subject)
+
+def get_gmail_service(credentials):
+    """Get a Gmail API service from the shared service registry."""
+    return build_service('gmail', 'v1', credentials)
+
+@timed('connector_seconds', operation='gmail.list_message_ids')
+def list_message_ids(gmail, query='is:unread', max_results=None, user_id=None):
+    """List message IDs matching a query, following `pageToken` pagination.
+
+    Args:
+        gmail: Gmail API service
+        query: Gmail search query
+        max_results: Maximum number of IDs to return, or None for all pages
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        List of message IDs
+    """
+    message_ids = []
+    page_token = None
+    while True:
+        page_size = LIST_PAGE_SIZE
+        if max_results is not None:
+            page_size = min(page_size, max_results - len(message_ids))
+        request = gmail.users().messages().list(
+            userId=user_id or GMAIL_USER,
+            q=query,
+            maxResults=page_size,
+            pageToken=page_token
+        )
+        results = call('gmail', request.execute)
+
+        message_ids.extend(message['id'] for message in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token or (max_results is not None and len(message_ids) >= max_results):
+            return message_ids
+
+@timed('connector_seconds', operation='gmail.fetch_messages')
+def fetch_messages(gmail, message_ids, batch_size=FETCH_BATCH_SIZE, user_id=None):
+    """Fetch full messages through Gmail batch HTTP requests.
+
+    Args:
+        gmail: Gmail API service
+        message_ids: List of message IDs
+        batch_size: Number of message fetches per batch HTTP request
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        List of raw message resources, in the order of `message_ids`.
+        Messages that still fail after retries are logged and left out.
+    """
+    responses = {}
+    failures = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            failures[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    pending = list(message_ids)
+    attempt = 0
+    while pending:
+        failures.clear()
+        for start in range(0, len(pending), batch_size):
+            batch = gmail.new_batch_http_request(callback=collect)
+            for message_id in pending[start:start + batch_size]:
+                batch.add(
+                    gmail.users().messages().get(userId=user_id or GMAIL_USER, id=message_id),
+                    request_id=message_id
+                )
+            call('gmail', batch.execute)
+
+        # Quota and server errors hit single requests of a batch; fetch those again
+        pending = [
+            message_id for message_id in pending
+            if message_id in failures and is_retryable(failures[message_id])
+        ]
+        for message_id, exception in failures.items():
+            if message_id not in pending or attempt >= DEFAULT_RETRY_POLICY.max_retries:
+                logger.warning(f"Failed to fetch message {message_id}: {exception}")
+        if not pending or attempt >= DEFAULT_RETRY_POLICY.max_retries:
+            break
+        delay = DEFAULT_RETRY_POLICY.delay(attempt, failures[pending[0]])
+        increment('api_retries_total', len(pending), api='gmail', status='batch')
+        logger.warning(f"Fetching {len(pending)} messages again in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+
+    increment('gmail_messages_fetched_total', len(responses))
+    increment('gmail_message_fetch_errors_total', len(message_ids) - len(responses))
+    return [responses[message_id] for message_id in message_ids if message_id in responses]
+
+def parse_message(msg):
+    """Extract id, subject, sender, headers and plain-text body from a message resource.
+
+    The body is taken from the plain-text parts of the whole MIME tree, or
+    from the HTML parts of HTML-only mail, without the quoted messages and
+    signature details that replies carry.
+
+    Args:
+        msg: Gmail message resource
+
+    Returns:
+        Dictionary containing email data; 'headers' maps lower-cased
+        header names to values
+    """
+    payload = msg['payload']
+    headers = payload['headers']
+
+    # Extract subject and sender
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+
+    return {
+        'id': msg['id'],
+        'subject': subject,
+        'sender': sender,
+        'headers': {h['name'].lower(): h['value'] for h in headers},
+        'body': clean_body(extract_body(payload))
+    }
 
 def get_unread_emails(credentials, max_results=10):
     """Fetch unread emails from Gmail.
-    
+
     Args:
         credentials: Google API credentials
-        max_results: Maximum number of emails to fetch
-        
+        max_results: Maximum number of emails to fetch, or None to page
+            through every unread message
+
     Returns:
         List of dictionaries containing email data
     """
-    gmail = build('gmail', 'v1', credentials=credentials)
-    results = gmail.users().messages().list(
-        userId=GMAIL_USER, 
-        q='is:unread',
-        maxResults=max_results
-    ).execute()
-    
-    messages = results.get('messages', [])
-    if not messages:
+    gmail = get_gmail_service(credentials)
+    message_ids = list_message_ids(gmail, query='is:unread', max_results=max_results)
+    if not message_ids:
         return []
-    
-    emails = []
-    for message in messages:
-        msg = gmail.users().messages().get(
-            userId=GMAIL_USER, 
-            id=message['id']
-        ).execute()
-        
-        payload = msg['payload']
-        headers = payload['headers']
-        
-        # Extract subject and sender
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
-        
-        # Extract body
-        body = ""
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    break
-        elif 'body' in payload and 'data' in payload['body']:
-            body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-        
-        emails.append({
-            'id': message['id'],
-            'subject': subject,
-            'sender': sender,
-            'body': body
-        })
-    
-    return emails
-
-def mark_as_read(credentials, message_id):
-    """Mark an email as read.
-    
+
+    return [parse_message(msg) for msg in fetch_messages(gmail, message_ids)]
+
+@timed('connector_seconds', operation='gmail.mark_as_read')
+def mark_as_read(credentials, message_ids, user_id=None):
+    """Mark one or more emails as read.
+
     Args:
         credentials: Google API credentials
-        message_id: Email message ID
+        message_ids: Email message ID or list of IDs
+        user_id: Mailbox the messages belong to, defaulting to GMAIL_USER
     """
-    gmail = build('gmail', 'v1', credentials=credentials)
-    gmail.users().messages().modify(
-        userId=GMAIL_USER,
-        id=message_id,
-        body={'removeLabelIds': ['UNREAD']}
-    ).execute()
\ No newline at end of file
+    if isinstance(message_ids, str):
+        message_ids = [message_ids]
+
+    gmail = get_gmail_service(credentials)
+    for start in range(0, len(message_ids), MODIFY_BATCH_SIZE):
+        request = gmail.users().messages().batchModify(
+            userId=user_id or GMAIL_USER,
+            body={
+                'ids': message_ids[start:start + MODIFY_BATCH_SIZE],
+                'removeLabelIds': ['UNREAD']
+            }
+        )
+        call('gmail', request.execute)
+
+def load_history_checkpoint(path=GMAIL_CHECKPOINT_PATH):
+    """Load the last synced Gmail historyId.
+
+    Args:
+        path: Path of the checkpoint file
+
+    Returns:
+        historyId string, or None if no checkpoint exists yet
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get('historyId')
+
+def save_history_checkpoint(history_id, path=GMAIL_CHECKPOINT_PATH):
+    """Atomically store the last synced Gmail historyId.
+
+    Args:
+        history_id: Gmail historyId to resume from on the next sync
+        path: Path of the checkpoint file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'historyId': str(history_id)}, f)
+    os.replace(tmp_path, path)
+
+@timed('connector_seconds', operation='gmail.list_history_message_ids')
+def list_history_message_ids(gmail, start_history_id, label_id=GMAIL_SYNC_LABEL, user_id=None):
+    """List IDs of messages added since a historyId.
+
+    Args:
+        gmail: Gmail API service
+        start_history_id: historyId to list changes from
+        label_id: Only report messages added with this label
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        Tuple of (list of new message IDs, latest historyId)
+
+    Raises:
+        HttpError: With status 404 when `start_history_id` is too old
+    """
+    message_ids = []
+    seen = set()
+    history_id = start_history_id
+    page_token = None
+    while True:
+        request = gmail.users().history().list(
+            userId=user_id or GMAIL_USER,
+            startHistoryId=start_history_id,
+            historyTypes=['messageAdded'],
+            labelId=label_id,
+            pageToken=page_token
+        )
+        results = call('gmail', request.execute)
+
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message_id = added['message']['id']
+                if message_id not in seen:
+                    seen.add(message_id)
+                    message_ids.append(message_id)
+
+        history_id = results.get('historyId', history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return message_ids, history_id
+
+@timed('connector_seconds', operation='gmail.list_new_message_ids')
+def list_new_message_ids(credentials, checkpoint_path=GMAIL_CHECKPOINT_PATH, full_scan_limit=GMAIL_FULL_SCAN_LIMIT,
+                         user_id=None):
+    """List IDs of messages that arrived since the last checkpointed sync.
+
+    Uses `users.history.list` from the stored historyId, so the cost of a run
+    is proportional to new mail. Without a checkpoint, or when the stored
+    historyId has expired, falls back to a scan of at most `full_scan_limit`
+    unread messages.
+
+    Args:
+        credentials: Google API credentials
+        checkpoint_path: Path of the checkpoint file
+        full_scan_limit: Maximum number of messages read by a full scan
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        Tuple of (list of message IDs, new historyId)
+    """
+    gmail = get_gmail_service(credentials)
+    start_history_id = load_history_checkpoint(checkpoint_path)
+
+    if start_history_id:
+        try:
+            return list_history_message_ids(gmail, start_history_id, user_id=user_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.warning(f"Gmail history checkpoint {start_history_id} expired, falling back to a full scan")
+
+    # Snapshot the historyId before scanning so mail arriving mid-scan is picked up next time
+    history_id = call('gmail', gmail.users().getProfile(userId=user_id or GMAIL_USER).execute)['historyId']
+    return list_message_ids(gmail, query='is:unread', max_results=full_scan_limit, user_id=user_id), history_id
+
+def sync_new_emails(credentials, checkpoint_path=GMAIL_CHECKPOINT_PATH, full_scan_limit=GMAIL_FULL_SCAN_LIMIT,
+                    user_id=None):
+    """Fetch emails that arrived since the last checkpointed sync.
+
+    See `list_new_message_ids` for how new messages are found. The checkpoint
+    is not advanced here. Call `save_history_checkpoint` with the returned
+    historyId once the emails have been processed.
+
+    Args:
+        credentials: Google API credentials
+        checkpoint_path: Path of the checkpoint file
+        full_scan_limit: Maximum number of messages read by a full scan
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        Tuple of (list of dictionaries containing email data, new historyId)
+    """
+    message_ids, history_id = list_new_message_ids(credentials, checkpoint_path, full_scan_limit, user_id)
+    if not message_ids:
+        return [], history_id
+
+    gmail = get_gmail_service(credentials)
+    return [parse_message(msg) for msg in fetch_messages(gmail, message_ids, user_id=user_id)], history_id
@@ -0,0 +1,131 @@
+"""Shared registry of Google API credentials and services.
+
+Credentials are loaded once per set of scopes and shared by every thread;
+they refresh their token lazily, on the first request after expiry. Built
+services are cached per (API, version, credentials) on each thread, since
+the underlying httplib2 connection is keep-alive but not thread-safe.
+"""
+import threading
+import httplib2
+import google_auth_httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from config import GOOGLE_CREDENTIALS_PATH, GOOGLE_HTTP_TIMEOUT
+from metrics import increment, timer
+from resilience import acquire
+
+_credentials = {}
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+def get_credentials(scopes, credentials_path=None, subject=None):
+    """Get shared service-account credentials for a set of scopes.
+
+    Args:
+        scopes: List of OAuth scopes
+        credentials_path: Service account key file, defaulting to
+            GOOGLE_APPLICATION_CREDENTIALS
+        subject: User to impersonate through domain-wide delegation, if any
+
+    Returns:
+        google.oauth2.service_account.Credentials
+    """
+    credentials_path = credentials_path or GOOGLE_CREDENTIALS_PATH
+    key = (tuple(sorted(scopes)), credentials_path, subject)
+    with _credentials_lock:
+        if key not in _credentials:
+            credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=list(key[0])
+            )
+            _credentials[key] = credentials.with_subject(subject) if subject else credentials
+        return _credentials[key]
+
+class InstrumentedHttp:
+    """Transport wrapper recording latency, status and bytes of every request.
+
+    Batch HTTP requests go through the same transport, so each batch counts
+    as one request. Any other attribute is delegated to the wrapped transport.
+    """
+
+    def __init__(self, http, api):
+        """Wrap an httplib2-compatible transport used for `api`."""
+        self._http = http
+        self._api = api
+
+    def request(self, uri, method='GET', body=None, *args, **kwargs):
+        """Send a request through the wrapped transport, within the API's rate limit."""
+        acquire(self._api)
+        with timer('api_request_seconds', api=self._api, method=method):
+            response, content = self._http.request(uri, method, body, *args, **kwargs)
+        increment('api_requests_total', api=self._api, status=response.status)
+        if body:
+            increment('api_bytes_sent_total', len(body), api=self._api)
+        increment('api_bytes_received_total', len(content or b''), api=self._api)
+        return response, content
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+def create_service(api, version, credentials):
+    """Build a new, uncached Google API service with its own connection.
+
+    Use this when a service object must not be shared with other callers,
+    e.g. one per concurrent worker.
+
+    Args:
+        api: API name, e.g. 'gmail'
+        version: API version, e.g. 'v1'
+        credentials: Google API credentials
+
+    Returns:
+        googleapiclient Resource bound to a keep-alive authorized transport
+    """
+    http = google_auth_httplib2.AuthorizedHttp(
+        credentials,
+        http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT)
+    )
+    http = InstrumentedHttp(http, api)
+    return build(api, version, http=http, cache_discovery=False)
+
+def build_service(api, version, credentials):
+    """Get a Google API service for this thread, building it on first use.
+
+    Args:
+        api: API name, e.g. 'gmail'
+        version: API version, e.g. 'v1'
+        credentials: Google API credentials
+
+    Returns:
+        googleapiclient Resource bound to a keep-alive authorized transport
+    """
+    services = getattr(_local, 'services', None)
+    if services is None:
+        services = _local.services = {}
+
+    key = (api, version, id(credentials))
+    if key not in services:
+        # Keep a reference to the credentials so their id() cannot be reused
+        services[key] = (credentials, create_service(api, version, credentials))
+    return services[key][1]
+
+def get_service(api, version, scopes, credentials_path=None):
+    """Get a Google API service using shared credentials for `scopes`.
+
+    Args:
+        api: API name, e.g. 'sheets'
+        version: API version, e.g. 'v4'
+        scopes: List of OAuth scopes
+        credentials_path: Service account key file, defaulting to
+            GOOGLE_APPLICATION_CREDENTIALS
+
+    Returns:
+        googleapiclient Resource
+    """
+    return build_service(api, version, get_credentials(scopes, credentials_path))
+
+def clear_services():
+    """Drop every cached credential and this thread's cached services."""
+    with _credentials_lock:
+        _credentials.clear()
+    _local.services = {}
@@ -1,17 +1,29 @@
 """Google Sheets connector for reading and writing data."""
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import logging
+import threading
+import time
 import pandas as pd
-from config import GOOGLE_CREDENTIALS_PATH, SPREADSHEET_ID
+from config import (
+    SPREADSHEET_ID, SHEETS_BATCH_MAX_ROWS, SHEETS_BATCH_MAX_INTERVAL,
+    SHEETS_MAX_RETRIES
+)
+from connectors.services import get_service, get_credentials, create_service
+from metrics import increment, timed
+from resilience import RetryPolicy, call
 
-def get_sheets_service():
+logger = logging.getLogger(__name__)
+
+SHEETS_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+def get_sheets_service(credentials_path=None):
     """Get Google Sheets API service."""
-    credentials = service_account.Credentials.from_service_account_file(
-        GOOGLE_CREDENTIALS_PATH,
-        scopes=['https://www.googleapis.com/auth/spreadsheets']
-    )
-    return build('sheets', 'v4', credentials=credentials)
+    return get_service('sheets', 'v4', SHEETS_SCOPES, credentials_path)
 
+def create_sheets_service():
+    """Create a dedicated Google Sheets API service not shared with other callers."""
+    return create_service('sheets', 'v4', get_credentials(SHEETS_SCOPES))
+
+@timed('connector_seconds', operation='sheets.read_from_sheets')
 def read_from_sheets(service, spreadsheet_id=SPREADSHEET_ID, sheet_range='Sheet1!A:Z'):
     """Read data from Google Sheets.
     
@@ -23,10 +35,11 @@ def read_from_sheets(service, spreadsheet_id=SPREADSHEET_ID, sheet_range='Sheet1
     Returns:
         Pandas DataFrame containing the sheet data
     """
-    result = service.spreadsheets().values().get(
+    request = service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
         range=sheet_range
-    ).execute()
+    )
+    result = call('sheets', request.execute)
     
     values = result.get('values', [])
     if not values:
@@ -36,7 +49,8 @@ def read_from_sheets(service, spreadsheet_id=SPREADSHEET_ID, sheet_range='Sheet1
     df = pd.DataFrame(values[1:], columns=values[0])
     return df
 
-def write_to_sheets(service, data, spreadsheet_id=SPREADSHEET_ID, sheet_range='Sheet1!A:Z'):
+@timed('connector_seconds', operation='sheets.write_to_sheets')
+def write_to_sheets(service, data, spreadsheet_id=SPREADSHEET_ID, sheet_range='Sheet1!A:Z', policy=None):
     """Write data to Google Sheets.
     
     Args:
@@ -44,17 +58,112 @@ def write_to_sheets(service, data, spreadsheet_id=SPREADSHEET_ID, sheet_range='S
         data: List of values to write
         spreadsheet_id: ID of the spreadsheet
         sheet_range: Range to write to (e.g., 'Sheet1!A:Z')
+        policy: RetryPolicy for quota and server errors, defaulting to
+            the process-wide one
     """
     body = {
         'values': [data] if not isinstance(data[0], list) else data
     }
     
-    result = service.spreadsheets().values().append(
+    request = service.spreadsheets().values().append(
         spreadsheetId=spreadsheet_id,
         range=sheet_range,
         valueInputOption='USER_ENTERED',
         insertDataOption='INSERT_ROWS',
         body=body
-    ).execute()
+    )
     
-    return result
\ No newline at end of file
+    return call('sheets', request.execute, policy=policy)
+
+class SheetsBatchWriter:
+    """Buffer rows and append them to Google Sheets in bulk.
+
+    Rows are grouped per range and each range is written with a single
+    `values().append` call. A flush happens when `max_rows` rows are
+    buffered, when `add` is called more than `max_interval` seconds after the
+    last flush, or on leaving the context manager. Quota and server errors
+    are retried with jittered exponential backoff (see `resilience`).
+
+    Example:
+        with SheetsBatchWriter(service) as writer:
+            writer.add(['a', 'b'], sheet_range='Emails!A:F')
+    """
+
+    def __init__(self, service, spreadsheet_id=SPREADSHEET_ID, max_rows=SHEETS_BATCH_MAX_ROWS,
+                 max_interval=SHEETS_BATCH_MAX_INTERVAL, max_retries=SHEETS_MAX_RETRIES, backoff=1.0):
+        """Initialize with sheets service and flush thresholds."""
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+        self._policy = RetryPolicy(max_retries=max_retries, backoff=backoff)
+        self._buffers = {}
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def add(self, data, sheet_range='Sheet1!A:Z'):
+        """Buffer one row or a list of rows for `sheet_range`.
+
+        Args:
+            data: List of values, or list of such lists
+            sheet_range: Range to append to (e.g., 'Sheet1!A:Z')
+        """
+        rows = [data] if not isinstance(data[0], list) else data
+        with self._lock:
+            self._buffers.setdefault(sheet_range, []).extend(rows)
+            self._buffered_rows += len(rows)
+            should_flush = (
+                self._buffered_rows >= self.max_rows
+                or time.monotonic() - self._last_flush >= self.max_interval
+            )
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered row, one append call per range.
+
+        Returns:
+            List of append responses, one per range written
+
+        Raises:
+            HttpError: If a range still fails after retries. Ranges that were
+                not written stay buffered.
+            CircuitOpenError: If the Sheets API keeps failing. Rows stay
+                buffered as above.
+        """
+        with self._lock:
+            buffers = self._buffers
+            self._buffers = {}
+            self._buffered_rows = 0
+            self._last_flush = time.monotonic()
+
+        results = []
+        pending = list(buffers.items())
+        while pending:
+            sheet_range, rows = pending[0]
+            try:
+                results.append(self._append_with_retry(sheet_range, rows))
+            except Exception:
+                # Put unwritten rows back in front of anything added meanwhile
+                with self._lock:
+                    restored = dict(pending)
+                    for other_range, other_rows in self._buffers.items():
+                        restored.setdefault(other_range, []).extend(other_rows)
+                    self._buffers = restored
+                    self._buffered_rows = sum(len(r) for r in restored.values())
+                raise
+            increment('sheets_rows_written_total', len(rows))
+            pending.pop(0)
+        return results
+
+    def _append_with_retry(self, sheet_range, rows):
+        """Append rows, retrying retryable responses with backoff."""
+        return write_to_sheets(self.service, rows, self.spreadsheet_id, sheet_range, policy=self._policy)
@@ -2,84 +2,200 @@
 import shopify
 import pandas as pd
 from config import SHOPIFY_API_KEY, SHOPIFY_API_SECRET, SHOPIFY_STORE_URL
+from metrics import increment, timer
+from resilience import call_limited
 
-def initialize_shopify():
-    """Initialize Shopify API connection."""
-    shop_url = f"https://{SHOPIFY_API_KEY}:{SHOPIFY_API_SECRET}@{SHOPIFY_STORE_URL}/admin"
+# Largest page size the Shopify REST Admin API accepts
+MAX_PAGE_SIZE = 250
+
+def initialize_shopify(shop=None):
+    """Initialize Shopify API connection.
+
+    Args:
+        shop: Dictionary with 'store_url', 'api_key' and 'api_secret' of the
+            store to connect to, defaulting to the SHOPIFY_* settings
+    """
+    shop = shop or {}
+    api_key = shop.get('api_key', SHOPIFY_API_KEY)
+    api_secret = shop.get('api_secret', SHOPIFY_API_SECRET)
+    store_url = shop.get('store_url', SHOPIFY_STORE_URL)
+    shop_url = f"https://{api_key}:{api_secret}@{store_url}/admin"
     shopify.ShopifyResource.set_site(shop_url)
     return shopify
 
+def _iter_pages(resource, name, **params):
+    """Iterate over every page of a resource using cursor (page_info) pagination.
+
+    Pages are fetched without caching, so only the current page is held in
+    memory.
+
+    Args:
+        resource: Shopify resource class, e.g. shopify.Order
+        name: Resource name used in metrics, e.g. 'orders'
+        **params: Query parameters for the first request
+
+    Yields:
+        Paginated collections of resources
+    """
+    operation = f'shopify.{name}'
+    with timer('connector_seconds', operation=operation):
+        page = call_limited('shopify', resource.find, **params)
+    while True:
+        increment('shopify_records_total', len(page), resource=name)
+        yield page
+        if not page.has_next_page():
+            return
+        with timer('connector_seconds', operation=operation):
+            page = call_limited('shopify', page.next_page, no_cache=True)
+
+def _format_timestamp(value):
+    """Format a datetime (or pass through a string) for Shopify query parameters."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def _query_params(chunk_size, updated_at_min=None, since_id=None, **params):
+    """Build query parameters shared by the paginated exports."""
+    params['limit'] = min(chunk_size, MAX_PAGE_SIZE)
+    if updated_at_min is not None:
+        params['updated_at_min'] = _format_timestamp(updated_at_min)
+    if since_id is not None:
+        params['since_id'] = since_id
+    return params
+
+def _product_to_dict(product):
+    """Convert a product resource to a flat row."""
+    return {
+        'id': product.id,
+        'title': product.title,
+        'vendor': product.vendor,
+        'product_type': product.product_type,
+        'created_at': product.created_at,
+        'updated_at': product.updated_at,
+        'published_at': product.published_at,
+        'tags': product.tags
+    }
+
+def _variant_to_dict(variant):
+    """Convert a variant resource to a dict."""
+    return {
+        'variant_id': variant.id,
+        'price': variant.price,
+        'sku': variant.sku,
+        'inventory_quantity': variant.inventory_quantity
+    }
+
+def _order_to_dict(order):
+    """Convert an order resource to a flat row."""
+    return {
+        'id': order.id,
+        'name': order.name,
+        'email': order.email,
+        'created_at': order.created_at,
+        'processed_at': order.processed_at,
+        'updated_at': order.updated_at,
+        'total_price': order.total_price,
+        'subtotal_price': order.subtotal_price,
+        'total_tax': order.total_tax,
+        'currency': order.currency,
+        'financial_status': order.financial_status,
+        'fulfillment_status': order.fulfillment_status
+    }
+
 def get_products(limit=50):
     """Get products from Shopify store.
-    
+
     Args:
         limit: Maximum number of products to fetch
-        
+
     Returns:
         Pandas DataFrame with product data
     """
     shopify_api = initialize_shopify()
-    
+
     products = shopify_api.Product.find(limit=limit)
     product_data = []
-    
+
     for product in products:
-        product_dict = {
-            'id': product.id,
-            'title': product.title,
-            'vendor': product.vendor,
-            'product_type': product.product_type,
-            'created_at': product.created_at,
-            'updated_at': product.updated_at,
-            'published_at': product.published_at,
-            'tags': product.tags
-        }
-        
-        # Get variants
-        variants = []
-        for variant in product.variants:
-            variants.append({
-                'variant_id': variant.id,
-                'price': variant.price,
-                'sku': variant.sku,
-                'inventory_quantity': variant.inventory_quantity
-            })
-        
-        product_dict['variants'] = variants
+        product_dict = _product_to_dict(product)
+        product_dict['variants'] = [_variant_to_dict(variant) for variant in product.variants]
         product_data.append(product_dict)
-    
+
     return pd.DataFrame(product_data)
 
 def get_orders(limit=50, status='any'):
     """Get orders from Shopify store.
-    
+
     Args:
         limit: Maximum number of orders to fetch
         status: Order status filter
-        
+
     Returns:
         Pandas DataFrame with order data
     """
     shopify_api = initialize_shopify()
-    
+
     orders = shopify_api.Order.find(limit=limit, status=status)
-    order_data = []
-    
-    for order in orders:
-        order_dict = {
-            'id': order.id,
-            'name': order.name,
-            'email': order.email,
-            'created_at': order.created_at,
-            'processed_at': order.processed_at,
-            'total_price': order.total_price,
-            'subtotal_price': order.subtotal_price,
-            'total_tax': order.total_tax,
-            'currency': order.currency,
-            'financial_status': order.financial_status,
-            'fulfillment_status': order.fulfillment_status
-        }
-        
-        order_data.append(order_dict)
-    
-    return pd.DataFrame(order_data)
\ No newline at end of file
+    order_data = [_order_to_dict(order) for order in orders]
+
+    return pd.DataFrame(order_data)
+
+def iter_orders(chunk_size=MAX_PAGE_SIZE, status='any', updated_at_min=None, since_id=None, shop=None):
+    """Stream every matching order as fixed-size DataFrame chunks.
+
+    Args:
+        chunk_size: Number of orders per DataFrame
+        status: Order status filter
+        updated_at_min: Only fetch orders updated at or after this time
+            (datetime or ISO 8601 string), for incremental syncs
+        since_id: Only fetch orders with a larger ID, to resume a full sync
+        shop: Store to read, see `initialize_shopify`
+
+    Yields:
+        Pandas DataFrames with order data
+    """
+    shopify_api = initialize_shopify(shop)
+    params = _query_params(chunk_size, updated_at_min, since_id, status=status)
+
+    rows = []
+    for page in _iter_pages(shopify_api.Order, 'orders', **params):
+        for order in page:
+            rows.append(_order_to_dict(order))
+            if len(rows) == chunk_size:
+                yield pd.DataFrame(rows)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+def iter_products(chunk_size=MAX_PAGE_SIZE, updated_at_min=None, since_id=None, shop=None):
+    """Stream every matching product as fixed-size DataFrame chunks.
+
+    Variants are flattened into their own table, keyed by `product_id`,
+    instead of being nested inside the product rows.
+
+    Args:
+        chunk_size: Number of products per chunk
+        updated_at_min: Only fetch products updated at or after this time
+            (datetime or ISO 8601 string), for incremental syncs
+        since_id: Only fetch products with a larger ID, to resume a full sync
+        shop: Store to read, see `initialize_shopify`
+
+    Yields:
+        Tuples of (products DataFrame, variants DataFrame)
+    """
+    shopify_api = initialize_shopify(shop)
+    params = _query_params(chunk_size, updated_at_min, since_id)
+
+    product_rows = []
+    variant_rows = []
+    for page in _iter_pages(shopify_api.Product, 'products', **params):
+        for product in page:
+            product_rows.append(_product_to_dict(product))
+            for variant in product.variants:
+                variant_rows.append(dict(_variant_to_dict(variant), product_id=product.id))
+            if len(product_rows) == chunk_size:
+                yield pd.DataFrame(product_rows), pd.DataFrame(variant_rows)
+                product_rows = []
+                variant_rows = []
+    if product_rows:
+        yield pd.DataFrame(product_rows), pd.DataFrame(variant_rows)
@@ -1,70 +1,55 @@
 """Email analysis component for the dashboard."""
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime, timedelta
+from dashboard.data import load_email_counts, load_recent_emails
+from storage.aggregates import email_totals, weekly_counts, top_values
 
-def render_email_analysis(email_data):
+def render_email_analysis(start_date, end_date):
     """Render email analysis component.
     
+    Charts are drawn from the precomputed email counts and rendered in the
+    browser, so reruns do not touch the email history.
+    
     Args:
-        email_data: DataFrame with email data
+        start_date: First day to show
+        end_date: Last day to show
     """
     st.header("Email Analysis")
     
-    if email_data.empty:
+    counts = load_email_counts(start_date, end_date)
+    if counts.empty:
         st.info("No email data available for the selected date range.")
         return
     
     # Display metrics
+    totals = email_totals(counts)
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Total Emails", len(email_data))
+        st.metric("Total Emails", totals['total'])
     
     with col2:
-        if 'Sentiment' in email_data.columns:
-            positive = sum(email_data['Sentiment'] == 'positive')
-            st.metric("Positive Sentiment", f"{positive} ({positive/len(email_data):.1%})")
+        positive = totals['positive']
+        st.metric("Positive Sentiment", f"{positive} ({positive/max(totals['total'], 1):.1%})")
     
     with col3:
-        if 'Sentiment' in email_data.columns:
-            negative = sum(email_data['Sentiment'] == 'negative')
-            st.metric("Negative Sentiment", f"{negative} ({negative/len(email_data):.1%})")
+        negative = totals['negative']
+        st.metric("Negative Sentiment", f"{negative} ({negative/max(totals['total'], 1):.1%})")
     
     # Display sentiment trend
-    if 'Sentiment' in email_data.columns and 'Date' in email_data.columns:
-        st.subheader("Sentiment Trend")
-        
-        # Prepare data
-        email_data['Date'] = pd.to_datetime(email_data['Date'])
-        email_data['Week'] = email_data['Date'].dt.isocalendar().week
-        
-        # Count sentiments by week
-        sentiment_by_week = pd.crosstab(email_data['Week'], email_data['Sentiment'])
-        
-        # Plot
-        fig, ax = plt.subplots(figsize=(10, 6))
-        sentiment_by_week.plot(kind='bar', stacked=True, ax=ax)
-        ax.set_xlabel('Week')
-        ax.set_ylabel('Count')
-        ax.set_title('Email Sentiment by Week')
-        st.pyplot(fig)
+    st.subheader("Sentiment Trend")
+    st.bar_chart(weekly_counts(counts, 'sentiment'))
     
     # Display most common issues
-    if 'Main Issue' in email_data.columns:
-        st.subheader("Most Common Issues")
-        
-        issues = email_data['Main Issue'].value_counts().head(10)
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        issues.plot(kind='barh', ax=ax)
-        ax.set_xlabel('Count')
-        ax.set_ylabel('Issue')
-        ax.set_title('Most Common Issues')
-        st.pyplot(fig)
+    st.subheader("Most Common Issues")
+    st.bar_chart(top_values(counts, 'main_issue', n=10))
     
     # Display recent emails
     st.subheader("Recent Emails")
-    st.dataframe(email_data.head(10))
\ No newline at end of file
+    st.dataframe(load_recent_emails(start_date, end_date).rename(columns={
+        'sender': 'Sender',
+        'subject': 'Subject',
+        'sentiment': 'Sentiment',
+        'main_issue': 'Main Issue',
+        'product': 'Product',
+        'processed_at': 'Date'
+    }))
@@ -0,0 +1,56 @@
+"""Cached data access for the dashboard.
+
+Streamlit reruns the whole script on every widget interaction, so every
+loader here is memoized with `st.cache_data`. The cache key includes the
+version of the store table read, which changes on every append, so cached
+results are reused across reruns and sessions until new data is ingested.
+"""
+import pandas as pd
+import streamlit as st
+from storage.parquet_store import get_store
+from storage.ingest import backfill_email_counts
+from storage.aggregates import read_email_counts, recent_emails
+
+def _day(value):
+    """Format a date as YYYY-MM-DD, so datetime.now() ranges do not miss the cache."""
+    return pd.Timestamp(value).strftime('%Y-%m-%d') if value is not None else None
+
+@st.cache_resource
+def _ensure_email_counts():
+    """Build the email_counts table once for stores that predate it."""
+    return backfill_email_counts(get_store())
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _email_counts(start_date, end_date, version):
+    return read_email_counts(get_store(), start_date, end_date)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _recent_emails(n, start_date, end_date, version):
+    return recent_emails(get_store(), n, start_date, end_date)
+
+def load_email_counts(start_date, end_date):
+    """Load the precomputed per-day email counts of a date range.
+
+    Args:
+        start_date: First day to include
+        end_date: Last day to include
+
+    Returns:
+        DataFrame returned by `read_email_counts`
+    """
+    _ensure_email_counts()
+    return _email_counts(_day(start_date), _day(end_date), get_store().version('email_counts'))
+
+def load_recent_emails(start_date, end_date, n=10):
+    """Load the most recently processed emails of a date range.
+
+    Args:
+        start_date: First day to include
+        end_date: Last day to include
+        n: Number of emails to return
+
+    Returns:
+        DataFrame returned by `recent_emails`
+    """
+    # email_counts is appended with every emails batch, and is cheaper to stat
+    return _recent_emails(n, _day(start_date), _day(end_date), get_store().version('email_counts'))
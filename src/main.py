@@ -1,13 +1,28 @@
 """Main orchestration script for the business intelligence system."""
-import schedule
-import time
+import argparse
+import asyncio
+import functools
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from config import DATA_REFRESH_INTERVAL, LOG_LEVEL
-from connectors.gmail import get_unread_emails, get_gmail_credentials
-from connectors.sheets import get_sheets_service, write_to_sheets
-from processors.email_parser import parse_email_content
+from config import (
+    DATA_REFRESH_INTERVAL, LOG_LEVEL, SPREADSHEET_ID, GA_VIEW_ID, JOB_SCHEDULES,
+    METRICS_ENABLED, METRICS_PORT, TENANTS_PATH
+)
+from connectors.gmail import get_gmail_credentials, get_gmail_service
+from connectors.sheets import get_sheets_service
+from processors.email_parser import get_email_llm
+from processors.email_classifier import get_preclassifier
+from connectors.analytics import get_analytics_service, get_page_metrics
+from pipeline import run_email_pipeline
+from scheduler import Scheduler
+from tenants import TenantRunner, TENANT_JOBS, load_tenants
+from work_queue import ACKED, get_work_queue, process_email_queue
+from metrics import start_metrics_server, write_snapshot
+from storage.parquet_store import get_store
+from storage.ingest import (
+    ingest_orders, ingest_products, ingest_page_metrics, ingest_daily_page_metrics, shopify_watermark
+)
 from agents.decision_agent import create_analysis_agent
 
 # Configure logging
@@ -21,44 +36,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def log_preclassifier_stats():
+    """Log how many emails skipped the LLM since startup."""
+    preclassifier = get_preclassifier()
+    if preclassifier is not None:
+        stats = preclassifier.stats()
+        logger.info(f"Pre-classifier answered {stats['classified']} emails, sent {stats['sent_to_llm']} "
+                    f"to the LLM ({stats['avoided_fraction']:.0%} of LLM calls avoided)")
+
 def process_emails():
-    """Process unread emails and store extracted data in Google Sheets."""
+    """Process new emails through the durable work queue.
+
+    Emails are stored locally, mirrored to Google Sheets and marked as read,
+    and a run interrupted at any step is resumed by the next one.
+    """
     try:
         logger.info("Starting email processing job")
         
         # Get Gmail credentials
         credentials = get_gmail_credentials()
         
-        # Fetch unread emails
-        emails = get_unread_emails(credentials)
-        logger.info(f"Found {len(emails)} unread emails")
+        # Queue emails received since the last run, then fetch, parse, write and acknowledge them
+        progress = process_email_queue(credentials, get_work_queue(), get_store(), spreadsheet_id=SPREADSHEET_ID)
+        log_preclassifier_stats()
         
-        # Process each email
-        for email in emails:
-            # Parse email content
-            parsed_data = parse_email_content(email['body'])
-            logger.debug(f"Parsed data: {parsed_data}")
-            
-            # Write to Google Sheets
-            sheets_service = get_sheets_service()
-            write_to_sheets(
-                service=sheets_service,
-                spreadsheet_id=SPREADSHEET_ID,
-                data=[
-                    email['sender'],
-                    email['subject'],
-                    parsed_data['sentiment'],
-                    parsed_data['main_issue'],
-                    parsed_data['product'],
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ],
-                sheet_range='Emails!A:F'
-            )
-            
-        logger.info("Email processing completed successfully")
+        logger.info(f"Email processing completed: {progress[ACKED]} emails done, "
+                    f"{get_work_queue().counts()['parked']} parked after repeated failures")
     except Exception as e:
         logger.error(f"Error in email processing: {str(e)}", exc_info=True)
 
+def process_emails_pipelined():
+    """Process new emails through the durable work queue with concurrent fetch, parse and write stages."""
+    try:
+        logger.info("Starting pipelined email processing job")
+        
+        credentials = get_gmail_credentials()
+        progress = asyncio.run(run_email_pipeline(
+            credentials, get_work_queue(), get_store(), spreadsheet_id=SPREADSHEET_ID
+        ))
+        log_preclassifier_stats()
+        
+        logger.info(f"Email processing completed: {progress[ACKED]} emails done, "
+                    f"{get_work_queue().counts()['parked']} parked after repeated failures")
+    except Exception as e:
+        logger.error(f"Error in email processing: {str(e)}", exc_info=True)
+
+def sync_shop_data():
+    """Incrementally sync Shopify orders and products into the local data store."""
+    try:
+        logger.info("Starting Shopify sync job")
+        store = get_store()
+        
+        orders = ingest_orders(store, updated_at_min=shopify_watermark(store, 'orders'))
+        products = ingest_products(store, updated_at_min=shopify_watermark(store, 'products'))
+        
+        logger.info(f"Shopify sync completed: {orders} orders, {products} products")
+    except Exception as e:
+        logger.error(f"Error in Shopify sync: {str(e)}", exc_info=True)
+
+def sync_analytics_data():
+    """Store yesterday's Google Analytics page metrics in the local data store."""
+    if not GA_VIEW_ID:
+        return
+    try:
+        logger.info("Starting analytics sync job")
+        day = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        service = get_analytics_service()
+        store = get_store()
+        metrics = get_page_metrics(service, GA_VIEW_ID, day, day)
+        rows = ingest_page_metrics(store, metrics, day)
+        daily_rows = ingest_daily_page_metrics(store, service, GA_VIEW_ID, day, day)
+        
+        logger.info(f"Analytics sync completed: {rows} pages, {daily_rows} daily page totals")
+    except Exception as e:
+        logger.error(f"Error in analytics sync: {str(e)}", exc_info=True)
+
 def run_analysis():
     """Run analysis on collected data and take actions."""
     try:
@@ -68,21 +121,79 @@ def run_analysis():
     except Exception as e:
         logger.error(f"Error in analysis: {str(e)}", exc_info=True)
 
-def main():
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Business Intelligence System")
+    parser.add_argument(
+        '--mode',
+        choices=['sequential', 'pipelined'],
+        default='sequential',
+        help="Run email ingestion stage by stage, or as a concurrent asyncio pipeline"
+    )
+    parser.add_argument(
+        '--tenants',
+        default=TENANTS_PATH,
+        help="Tenant registry (JSON or YAML) to serve many brands from one process pool"
+    )
+    return parser.parse_args(argv)
+
+def write_metrics_snapshot():
+    """Write the current metrics to the JSON snapshot file."""
+    try:
+        write_snapshot()
+    except Exception as e:
+        logger.error(f"Error writing metrics snapshot: {str(e)}", exc_info=True)
+
+def warm_clients():
+    """Create the API and LLM clients in a worker thread, so scheduled runs reuse them."""
+    try:
+        get_gmail_service(get_gmail_credentials())
+        get_sheets_service()
+        if GA_VIEW_ID:
+            get_analytics_service()
+        get_email_llm()
+    except Exception as e:
+        logger.warning(f"Could not warm up clients: {str(e)}")
+
+def main(argv=None):
     """Main function to set up scheduled jobs."""
-    logger.info("Starting Business Intelligence System")
+    args = parse_args(argv)
+    logger.info(f"Starting Business Intelligence System ({args.mode} mode)")
     
-    # Schedule jobs
-    schedule.every(1).hours.do(process_emails)
-    schedule.every().day.at("07:00").do(run_analysis)
+    runner = None
+    if args.tenants:
+        # Ingestion jobs run for every tenant on the process pool
+        runner = TenantRunner(load_tenants(args.tenants))
+        logger.info(f"Serving {len(runner.tenants)} tenants")
+        jobs = {name: functools.partial(runner.run, [name]) for name in TENANT_JOBS}
+        jobs['run_analysis'] = run_analysis
+    else:
+        email_job = process_emails_pipelined if args.mode == 'pipelined' else process_emails
+        jobs = {
+            'process_emails': email_job,
+            'sync_shop_data': sync_shop_data,
+            'sync_analytics_data': sync_analytics_data,
+            'run_analysis': run_analysis
+        }
+    if METRICS_ENABLED:
+        jobs['write_metrics_snapshot'] = write_metrics_snapshot
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
     
-    # Run jobs immediately on startup
-    process_emails()
+    # Schedule jobs, running email processing immediately on startup
+    scheduler = Scheduler(initializer=None if runner else warm_clients)
+    for name, job in jobs.items():
+        scheduler.add_job(name, job, JOB_SCHEDULES[name], run_on_start=(name == 'process_emails'))
     
     # Keep the script running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        scheduler.shutdown()
+        if runner is not None:
+            runner.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""Process-wide counters, timers and histograms for pipeline instrumentation.
+
+Metrics are identified by a name plus keyword labels, e.g.
+`increment('api_bytes_received_total', 512, api='gmail')`. Recording is a
+dictionary update under one lock, cheap enough to leave on in production,
+and a no-op when METRICS_ENABLED is false.
+
+The registry can be rendered in the Prometheus text format (served by
+`start_metrics_server`) or written as a JSON snapshot (`write_snapshot`).
+Worker processes send their snapshots to the parent, which `merge`s them
+into its own registry.
+"""
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_ENABLED, METRICS_SNAPSHOT_PATH
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds for latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with a running sum and count."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Get (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+class MetricsRegistry:
+    """Thread-safe store of counters and histograms."""
+
+    def __init__(self, enabled=True):
+        """Initialize an empty registry."""
+        self.enabled = enabled
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a value, e.g. a latency in seconds, in a histogram."""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time a block into the `name` histogram; failures also count `<name>_errors_total`."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment(f'{name}_errors_total', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        """Drop every recorded value."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def merge(self, snapshot, **labels):
+        """Add the metrics of a snapshot, e.g. one taken in a worker process.
+
+        Args:
+            snapshot: Result of `snapshot()` on a registry using DEFAULT_BUCKETS
+            **labels: Labels added to every merged metric, e.g. tenant='acme'
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for counter in snapshot['counters']:
+                key = self._key(counter['name'], dict(counter['labels'], **labels))
+                self._counters[key] = self._counters.get(key, 0) + counter['value']
+            for data in snapshot['histograms']:
+                key = self._key(data['name'], dict(data['labels'], **labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                previous = 0
+                for i, total in enumerate(data['buckets'].values()):
+                    histogram.counts[i] += total - previous
+                    previous = total
+                histogram.sum += data['sum']
+                histogram.count += data['count']
+
+    def snapshot(self):
+        """Get every metric as JSON-serializable data.
+
+        Returns:
+            Dictionary with 'counters' and 'histograms' lists
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative_counts()}
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {'timestamp': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                for bound, count in histogram.cumulative_counts():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", le)])} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+_registry = MetricsRegistry(enabled=METRICS_ENABLED)
+
+def get_registry():
+    """Get the process-wide metrics registry."""
+    return _registry
+
+def increment(name, value=1, **labels):
+    """Add `value` to a counter in the process-wide registry."""
+    _registry.increment(name, value, **labels)
+
+def observe(name, value, **labels):
+    """Record a value in a histogram of the process-wide registry."""
+    _registry.observe(name, value, **labels)
+
+def timer(name, **labels):
+    """Context manager timing a block into the process-wide registry."""
+    return _registry.timer(name, **labels)
+
+def timed(name, **labels):
+    """Decorator timing every call of a function (sync or async) into a histogram.
+
+    Args:
+        name: Histogram name, e.g. 'processor_seconds'
+        **labels: Labels for the histogram, e.g. processor='parse_emails_batch'
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def track_llm(chain):
+    """Time LLM calls made inside the block and count their OpenAI token usage.
+
+    Args:
+        chain: Label naming the calling chain, e.g. 'email_batch'
+    """
+    from langchain.callbacks import get_openai_callback
+
+    with timer('llm_request_seconds', chain=chain), get_openai_callback() as usage:
+        yield
+    increment('llm_requests_total', usage.successful_requests, chain=chain)
+    increment('llm_tokens_total', usage.prompt_tokens, chain=chain, kind='prompt')
+    increment('llm_tokens_total', usage.completion_tokens, chain=chain, kind='completion')
+    increment('llm_cost_usd_total', usage.total_cost, chain=chain)
+
+def write_snapshot(path=METRICS_SNAPSHOT_PATH):
+    """Atomically write the process-wide metrics as JSON.
+
+    Args:
+        path: File to write
+
+    Returns:
+        The path written
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_registry.snapshot(), f)
+    os.replace(tmp_path, path)
+    return path
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the registry at /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = _registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve Prometheus metrics at http://<host>:<port>/metrics from a daemon thread.
+
+    Returns:
+        The running HTTP server; call `shutdown()` to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
@@ -0,0 +1,264 @@
+"""Pipelined (asyncio) email ingestion over the durable email work queue.
+
+The fetch, parse and write stages of `work_queue` run concurrently instead
+of one after the other. Messages keep their lease from one stage to the
+next and are only released at the end, once written and marked as read,
+so a crash mid-run is resumed by the next run like in sequential mode.
+"""
+import asyncio
+import logging
+import time
+
+from config import (
+    SPREADSHEET_ID, GMAIL_CHECKPOINT_PATH, EMAIL_QUEUE_BATCH_SIZE, PIPELINE_FETCH_CONCURRENCY,
+    PIPELINE_PARSE_CONCURRENCY, PIPELINE_WRITE_CONCURRENCY, PIPELINE_QUEUE_SIZE, DEDUP_ENABLED
+)
+from connectors.gmail import FETCH_BATCH_SIZE
+from processors.email_parser import aparse_email_content
+from processors.email_classifier import get_preclassifier
+from processors.dedup import NearDuplicateIndex, fan_out_result
+from work_queue import (
+    QUEUED, FETCHED, PARSED, WRITTEN, ACKED, enqueue_new_messages, advance_item, release_all, fetch_step,
+    write_step, ack_step
+)
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+class StageStats:
+    """Item counter and wall-clock timer for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, count=1):
+        """Count processed items, starting the clock on the first one."""
+        if self.started is None:
+            self.started = time.monotonic()
+        self.items += count
+        self.finished = time.monotonic()
+        increment('pipeline_items_total', count, stage=self.name)
+
+    def log(self):
+        """Log the stage's item count and throughput."""
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Stage {self.name}: {self.items} items in {elapsed:.2f}s ({rate:.1f} items/s)")
+
+async def _fetch_worker(queue, credentials, user_id, parse_queue, claimed, stats):
+    """Claim queued messages and fetch them in batch requests until none are left.
+
+    Several workers run at once, each with one Gmail batch request in flight.
+    """
+    while True:
+        items = await asyncio.to_thread(queue.claim, QUEUED, FETCH_BATCH_SIZE)
+        if not items:
+            return
+        claimed.update((item['message_id'], item) for item in items)
+        fetched = await asyncio.to_thread(fetch_step, queue, credentials, items, user_id, True)
+        # Messages that failed to fetch were released for a later run
+        for item in items:
+            claimed.pop(item['message_id'], None)
+        for item in fetched:
+            claimed[item['message_id']] = item
+            await parse_queue.put(item)
+            stats.record()
+
+class DuplicateParses:
+    """Share one LLM parse between near-duplicate emails across parse workers.
+
+    The first email of a cluster becomes its representative and is parsed;
+    later near-duplicates await the representative's result instead.
+    """
+
+    def __init__(self):
+        self.index = NearDuplicateIndex()
+        self.results = {}
+
+    async def parse(self, email):
+        """Parse an email, or reuse the parse of a near-duplicate seen earlier."""
+        signature = self.index.signature(email['body'])
+        representative = self.index.find(signature)
+        if representative is not None:
+            increment('email_duplicates_total')
+            return fan_out_result(await asyncio.shield(self.results[representative]), email)
+
+        # Registered before the first await, so concurrent workers see it
+        future = asyncio.get_running_loop().create_future()
+        self.index.add(email['id'], signature)
+        self.results[email['id']] = future
+        try:
+            parsed_data = await aparse_email_content(email['body'])
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; the worker raising is what stops the pipeline
+            raise
+        future.set_result(parsed_data)
+        return parsed_data
+
+async def _parse_worker(queue, parse_queue, write_queue, stats, duplicates=None):
+    """Parse fetched messages from `parse_queue` until a None sentinel arrives.
+
+    Trivial emails are answered by the pre-classifier without an LLM call,
+    and near-duplicates share a parse through `duplicates` when given.
+    """
+    preclassifier = get_preclassifier()
+    while True:
+        item = await parse_queue.get()
+        if item is None:
+            return
+        email = item['email']
+        parsed_data = preclassifier.classify(email) if preclassifier else None
+        if parsed_data is None:
+            if duplicates is not None:
+                parsed_data = await duplicates.parse(email)
+            else:
+                parsed_data = await aparse_email_content(email['body'])
+        logger.debug(f"Parsed data: {parsed_data}")
+        item = await asyncio.to_thread(advance_item, queue, item, FETCHED, True, parsed=parsed_data)
+        if item is not None:
+            increment('email_queue_steps_total', state=PARSED)
+            await write_queue.put(item)
+        stats.record()
+
+async def _write_worker(queue, store, credentials, write_queue, claimed, stats, spreadsheet_id,
+                        credentials_path, user_id, batch_size):
+    """Write parsed messages from `write_queue` until a None sentinel arrives.
+
+    Every `batch_size` messages, and once more at the end, the batch is
+    appended to the local data store and the Sheets mirror and then marked
+    as read in Gmail. Blocking calls run in a thread to keep the loop
+    responsive; each thread uses its own Sheets service from the registry.
+    """
+    batch = []
+
+    async def flush():
+        written = await asyncio.to_thread(write_step, queue, store, batch, spreadsheet_id, credentials_path, True)
+        acked = await asyncio.to_thread(ack_step, queue, credentials, written, user_id)
+        for item in batch:
+            claimed.pop(item['message_id'], None)
+        stats.record(len(acked))
+        batch.clear()
+
+    while True:
+        item = await write_queue.get()
+        if item is None:
+            break
+        batch.append(item)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+async def _resume(queue, credentials, user_id, parse_queue, write_queue, claimed, batch_size, stats):
+    """Send messages an earlier run left halfway back to the stage where they stopped.
+
+    Written messages only need to be marked as read, which is done here.
+    """
+    while True:
+        items = await asyncio.to_thread(queue.claim, WRITTEN, batch_size)
+        if not items:
+            break
+        claimed.update((item['message_id'], item) for item in items)
+        acked = await asyncio.to_thread(ack_step, queue, credentials, items, user_id)
+        for item in items:
+            claimed.pop(item['message_id'], None)
+        stats.record(len(acked))
+    for state, stage_queue in ((PARSED, write_queue), (FETCHED, parse_queue)):
+        while True:
+            items = await asyncio.to_thread(queue.claim, state, batch_size)
+            if not items:
+                break
+            for item in items:
+                claimed[item['message_id']] = item
+                await stage_queue.put(item)
+
+async def run_email_pipeline(credentials, queue, store, spreadsheet_id=SPREADSHEET_ID, credentials_path=None,
+                             checkpoint_path=GMAIL_CHECKPOINT_PATH, user_id=None,
+                             fetch_concurrency=PIPELINE_FETCH_CONCURRENCY,
+                             parse_concurrency=PIPELINE_PARSE_CONCURRENCY,
+                             write_concurrency=PIPELINE_WRITE_CONCURRENCY,
+                             queue_size=PIPELINE_QUEUE_SIZE, batch_size=EMAIL_QUEUE_BATCH_SIZE):
+    """Queue new Gmail messages and run the fetch, parse and write stages concurrently.
+
+    Stages are connected by bounded queues, so a slow stage applies
+    backpressure to the ones before it instead of letting work pile up.
+    Messages left halfway by an earlier run join the stage they stopped at.
+    If a stage fails, the pipeline stops and every message still claimed is
+    released for the next run.
+
+    Args:
+        credentials: Google API credentials for Gmail
+        queue: EmailWorkQueue to work from
+        store: ParquetStore to write to
+        spreadsheet_id: Spreadsheet mirroring the emails, or None for none
+        credentials_path: Service account key file for Sheets
+        checkpoint_path: Path of the Gmail checkpoint file
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+        fetch_concurrency: Gmail batch requests in flight at once
+        parse_concurrency: LLM calls in flight at once
+        write_concurrency: Writers running at once
+        queue_size: Capacity of each queue between stages
+        batch_size: Messages written and marked as read together
+
+    Returns:
+        Dictionary mapping ACKED to the number of messages finished in this run
+    """
+    await asyncio.to_thread(enqueue_new_messages, credentials, queue, checkpoint_path, user_id)
+    await asyncio.to_thread(queue.purge_acked)
+
+    parse_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    stats = [StageStats('fetch'), StageStats('parse'), StageStats('write')]
+    duplicates = DuplicateParses() if DEDUP_ENABLED else None
+    # Messages this run holds a lease on, released if the run fails
+    claimed = {}
+
+    writers = [
+        asyncio.create_task(_write_worker(queue, store, credentials, write_queue, claimed, stats[2],
+                                          spreadsheet_id, credentials_path, user_id, batch_size))
+        for _ in range(write_concurrency)
+    ]
+    parsers = [
+        asyncio.create_task(_parse_worker(queue, parse_queue, write_queue, stats[1], duplicates))
+        for _ in range(parse_concurrency)
+    ]
+
+    async def feed():
+        await _resume(queue, credentials, user_id, parse_queue, write_queue, claimed, batch_size, stats[2])
+        await asyncio.gather(*(
+            _fetch_worker(queue, credentials, user_id, parse_queue, claimed, stats[0])
+            for _ in range(fetch_concurrency)
+        ))
+        for _ in parsers:
+            await parse_queue.put(None)
+        await asyncio.gather(*parsers)
+        for _ in writers:
+            await write_queue.put(None)
+
+    # Stop every stage as soon as one fails, so no stage waits on a dead consumer
+    tasks = [asyncio.create_task(feed())] + parsers + writers
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        increment('email_queue_failures_total', len(claimed), state='pipeline')
+        await asyncio.to_thread(release_all, queue, list(claimed.values()), e)
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        for stage in stats:
+            stage.log()
+
+    return {ACKED: stats[2].items}
@@ -1,44 +1,252 @@
 """Analytics data processing."""
 import pandas as pd
 import numpy as np
+from metrics import timed
 
-def identify_underperforming_pages(analytics_df, threshold=0.7):
-    """Identify underperforming pages based on bounce rate and session duration.
+# How each metric feeds the performance score: its weight, whether higher
+# values are better, the value it is normalized against (None for the
+# column maximum) and the name of the score column in the result
+DEFAULT_PAGE_METRICS = {
+    'ga:bounceRate': {
+        'weight': 1.0,
+        'higher_is_better': False,
+        'scale': 100,
+        'score_column': 'bounce_score'
+    },
+    'ga:avgSessionDuration': {
+        'weight': 1.0,
+        'higher_is_better': True,
+        'scale': None,
+        'score_column': 'duration_score'
+    }
+}
+
+def _metric_score(analytics_df, column, spec):
+    """Normalize one metric to a 0-1 score where higher is better.
+
+    Returns:
+        NumPy array of scores, or 0.5 when the metric is missing or all zero
+    """
+    if column not in analytics_df.columns:
+        return 0.5  # Default if missing
+
+    values = analytics_df[column].to_numpy(dtype=np.float64)
+    scale = spec.get('scale')
+    if scale is None:
+        scale = np.nanmax(values) if len(values) else 0
+    if not scale > 0:
+        return 0.5  # Default if all zeros
+
+    score = values / scale
+    if not spec.get('higher_is_better', True):
+        score = 1 - score
+    return score
+
+@timed('processor_seconds', processor='identify_underperforming_pages')
+def identify_underperforming_pages(analytics_df, threshold=0.7, top_k=None, metrics=None):
+    """Identify underperforming pages based on weighted, normalized metrics.
+    
+    Scores are computed as temporary arrays; the input DataFrame is never
+    modified. Only the selected rows are copied into the result.
     
     Args:
         analytics_df: DataFrame with analytics data
         threshold: Threshold for identifying underperforming pages
+        top_k: Return only the k worst pages, or None for all below threshold
+        metrics: Dictionary mapping metric columns to scoring specs (see
+            DEFAULT_PAGE_METRICS); defaults to bounce rate and session duration
         
     Returns:
-        DataFrame with underperforming pages
+        DataFrame with underperforming pages, worst first, with a score
+        column per metric and 'performance_score'
     """
-    # Normalize metrics
-    if 'ga:bounceRate' in analytics_df.columns:
-        # Lower is better for bounce rate, so invert
-        analytics_df['bounce_score'] = 1 - (analytics_df['ga:bounceRate'] / 100)
-    else:
-        analytics_df['bounce_score'] = 0.5  # Default if missing
-    
-    if 'ga:avgSessionDuration' in analytics_df.columns:
-        # Normalize session duration (higher is better)
-        max_duration = analytics_df['ga:avgSessionDuration'].max()
-        if max_duration > 0:
-            analytics_df['duration_score'] = analytics_df['ga:avgSessionDuration'] / max_duration
-        else:
-            analytics_df['duration_score'] = 0.5  # Default if all zeros
-    else:
-        analytics_df['duration_score'] = 0.5  # Default if missing
-    
-    # Calculate performance score (simple average of normalized metrics)
-    analytics_df['performance_score'] = (analytics_df['bounce_score'] + analytics_df['duration_score']) / 2
-    
-    # Filter underperforming pages
-    underperforming = analytics_df[analytics_df['performance_score'] < threshold].copy()
-    
+    if metrics is None:
+        metrics = DEFAULT_PAGE_METRICS
+
+    # Weighted average of normalized metric scores
+    scores = {}
+    performance = np.zeros(len(analytics_df))
+    total_weight = 0.0
+    for column, spec in metrics.items():
+        weight = spec.get('weight', 1.0)
+        score = _metric_score(analytics_df, column, spec)
+        scores[spec.get('score_column', f"{column.split(':')[-1]}_score")] = score
+        performance = performance + weight * score
+        total_weight += weight
+    if total_weight:
+        performance = performance / total_weight
+
+    # Filter underperforming pages, keeping only the k worst if asked
+    candidates = np.flatnonzero(performance < threshold)
+    if top_k is not None:
+        if top_k <= 0:
+            candidates = candidates[:0]
+        elif top_k < len(candidates):
+            worst = np.argpartition(performance[candidates], top_k - 1)[:top_k]
+            candidates = candidates[worst]
+
     # Sort by performance score (ascending)
-    underperforming = underperforming.sort_values('performance_score')
-    
-    return underperforming
+    order = candidates[np.argsort(performance[candidates], kind='stable')]
+
+    columns = {
+        name: score[order] if isinstance(score, np.ndarray) else score
+        for name, score in scores.items()
+    }
+    columns['performance_score'] = performance[order]
+    return analytics_df.iloc[order].assign(**columns)
+
+@timed('processor_seconds', processor='rolling_page_metrics')
+def rolling_page_metrics(daily_df):
+    """Combine per-page daily totals into metrics for the whole window.
+
+    Sessions, pageviews, bounces and session duration are summed per page,
+    then bounce rate and average session duration are derived from the sums,
+    which gives the same figures as querying the window directly.
+
+    Args:
+        daily_df: DataFrame with 'ga:pagePath', 'ga:sessions', 'ga:pageviews',
+            'ga:bounces' and 'ga:sessionDuration' columns, one row per page and day
+
+    Returns:
+        DataFrame with the columns of `get_page_metrics`, by pageviews (descending)
+    """
+    totals = daily_df.groupby('ga:pagePath', sort=False)[
+        ['ga:sessions', 'ga:pageviews', 'ga:bounces', 'ga:sessionDuration']
+    ].sum()
+
+    sessions = totals['ga:sessions'].to_numpy(dtype=np.float64)
+    safe_sessions = np.where(sessions > 0, sessions, 1)
+    result = pd.DataFrame({
+        'ga:pagePath': totals.index.to_numpy(dtype=object),
+        'ga:sessions': totals['ga:sessions'].to_numpy(dtype=np.int64),
+        'ga:pageviews': totals['ga:pageviews'].to_numpy(dtype=np.int64),
+        'ga:bounceRate': np.where(
+            sessions > 0, totals['ga:bounces'].to_numpy(dtype=np.float64) / safe_sessions * 100, 0.0
+        ),
+        'ga:avgSessionDuration': np.where(
+            sessions > 0, totals['ga:sessionDuration'].to_numpy(dtype=np.float64) / safe_sessions, 0.0
+        )
+    })
+    return result.sort_values('ga:pageviews', ascending=False, kind='stable', ignore_index=True)
+
+def _step_pageviews(analytics_df, steps, match):
+    """Look up pageviews for every funnel step in one pass over the page index.
+
+    Exact steps are looked up in a hash index and prefix steps by binary
+    search over the sorted paths, both in O((steps + paths) log paths).
+    Regex steps still scan the unique paths once per unique step: one path
+    may match several steps, which a combined alternation cannot report.
+
+    Args:
+        analytics_df: DataFrame with 'ga:pagePath' and 'ga:pageviews' columns
+        steps: Array of step definitions (paths, prefixes or regexes)
+        match: 'exact', 'prefix' or 'regex'
+
+    Returns:
+        Tuple of (boolean array marking steps that matched a page,
+        array of pageviews for each matched step)
+    """
+    paths = analytics_df['ga:pagePath']
+    pageviews = analytics_df['ga:pageviews'].to_numpy()
+
+    if match == 'exact':
+        # Like a per-step boolean mask, use the first row found for each path
+        first = ~paths.duplicated().to_numpy()
+        index = pd.Index(paths.to_numpy()[first])
+        positions = index.get_indexer(steps)
+        found = positions >= 0
+        return found, pageviews[first][positions[found]]
+
+    if match not in ('prefix', 'regex'):
+        raise ValueError(f"Unknown funnel match mode: {match}")
+
+    # Collapse to one row per path, then sum pageviews over the paths each step matches
+    by_path = analytics_df.groupby('ga:pagePath', sort=True)['ga:pageviews'].sum()
+    unique_steps, inverse = np.unique(steps, return_inverse=True)
+
+    if match == 'prefix':
+        # Paths starting with a prefix form one run of the sorted index, ending
+        # before the prefix followed by the highest code point
+        sorted_paths = by_path.index.to_numpy(dtype=object)
+        upper_bounds = np.array([step + '\U0010ffff' for step in unique_steps], dtype=object)
+        start = np.searchsorted(sorted_paths, unique_steps, side='left')
+        end = np.searchsorted(sorted_paths, upper_bounds, side='left')
+        cumulative = np.concatenate([[0], np.cumsum(by_path.to_numpy())])
+        matched = end > start
+        totals = cumulative[end] - cumulative[start]
+    else:
+        unique_paths = by_path.index.to_series()
+        totals = np.zeros(len(unique_steps), dtype=by_path.dtype)
+        matched = np.zeros(len(unique_steps), dtype=bool)
+        for i, step in enumerate(unique_steps):
+            mask = unique_paths.str.contains(step, regex=True).to_numpy()
+            matched[i] = mask.any()
+            totals[i] = by_path.to_numpy()[mask].sum()
+    found = matched[inverse]
+    return found, totals[inverse][found]
+
+@timed('processor_seconds', processor='calculate_conversion_funnels')
+def calculate_conversion_funnels(analytics_df, funnels, match='exact'):
+    """Calculate conversion metrics for many funnels at once.
+
+    Pageviews are looked up once for every step of every funnel, and
+    conversion and drop-off rates are computed with array operations over
+    all steps together.
+
+    Args:
+        analytics_df: DataFrame with analytics data
+        funnels: Dictionary mapping funnel names to lists of steps, or a list
+            of step lists (named by position)
+        match: How steps select pages: 'exact' page paths, path 'prefix'es,
+            or 'regex' patterns. Prefix and regex steps sum the pageviews of
+            every page they match.
+
+    Returns:
+        Tidy DataFrame with one row per matched step and columns funnel,
+        step, page_path, pageviews, previous_step, conversion_rate and
+        dropoff_rate
+    """
+    if not isinstance(funnels, dict):
+        funnels = dict(enumerate(funnels))
+
+    names = []
+    step_numbers = []
+    steps = []
+    for name, funnel_steps in funnels.items():
+        names.extend([name] * len(funnel_steps))
+        step_numbers.extend(range(1, len(funnel_steps) + 1))
+        steps.extend(funnel_steps)
+
+    columns = ['funnel', 'step', 'page_path', 'pageviews', 'previous_step', 'conversion_rate', 'dropoff_rate']
+    if not steps:
+        return pd.DataFrame(columns=columns)
+
+    steps = np.array(steps, dtype=object)
+    step_numbers = np.array(step_numbers)
+    is_first = step_numbers == 1
+
+    found, found_pageviews = _step_pageviews(analytics_df, steps, match)
+    all_pageviews = np.full(len(steps), np.nan)
+    all_pageviews[found] = found_pageviews
+
+    # Each step's predecessor is the previous entry, except for first steps
+    previous_pageviews = np.roll(all_pageviews, 1)
+    previous_step = np.roll(steps, 1)
+    previous_step[is_first] = None
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conversion_rate = np.where(is_first, 100.0, all_pageviews / previous_pageviews * 100)
+    dropoff_rate = np.where(is_first, 0.0, 100 - conversion_rate)
+
+    return pd.DataFrame({
+        'funnel': np.array(names, dtype=object)[found],
+        'step': step_numbers[found],
+        'page_path': steps[found],
+        'pageviews': found_pageviews,
+        'previous_step': previous_step[found],
+        'conversion_rate': conversion_rate[found],
+        'dropoff_rate': dropoff_rate[found]
+    }, columns=columns)
 
 def calculate_conversion_funnel(analytics_df, funnel_steps):
     """Calculate conversion funnel metrics.
@@ -50,38 +258,7 @@ def calculate_conversion_funnel(analytics_df, funnel_steps):
     Returns:
         DataFrame with funnel metrics
     """
-    funnel_metrics = []
-    
-    for i, step in enumerate(funnel_steps):
-        step_data = analytics_df[analytics_df['ga:pagePath'] == step]
-        
-        if not step_data.empty:
-            pageviews = step_data['ga:pageviews'].values[0]
-            
-            # For the first step, conversion rate is 100%
-            if i == 0:
-                conversion_rate = 100
-                previous_step = None
-                dropoff_rate = 0
-            else:
-                previous_step_data = analytics_df[analytics_df['ga:pagePath'] == funnel_steps[i-1]]
-                if not previous_step_data.empty:
-                    previous_pageviews = previous_step_data['ga:pageviews'].values[0]
-                    conversion_rate = (pageviews / previous_pageviews) * 100
-                    dropoff_rate = 100 - conversion_rate
-                    previous_step = funnel_steps[i-1]
-                else:
-                    conversion_rate = np.nan
-                    dropoff_rate = np.nan
-                    previous_step = funnel_steps[i-1]
-            
-            funnel_metrics.append({
-                'step': i + 1,
-                'page_path': step,
-                'pageviews': pageviews,
-                'previous_step': previous_step,
-                'conversion_rate': conversion_rate,
-                'dropoff_rate': dropoff_rate
-            })
-    
-    return pd.DataFrame(funnel_metrics)
\ No newline at end of file
+    funnel_metrics = calculate_conversion_funnels(analytics_df, [funnel_steps])
+    if funnel_metrics.empty:
+        return pd.DataFrame()
+    return funnel_metrics.drop(columns='funnel').reset_index(drop=True)
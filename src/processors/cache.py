@@ -0,0 +1,173 @@
+"""Persistent cache for LLM parsing results.
+
+The cache file may be shared by several processes, e.g. the tenant workers.
+It runs in WAL mode, so readers never wait for a writer, and writers wait
+up to BUSY_TIMEOUT seconds for each other. A lookup or store that still
+fails is logged and treated as a miss, so the cache never breaks parsing.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import PARSE_CACHE_ENABLED, PARSE_CACHE_PATH, PARSE_CACHE_TTL, PARSE_CACHE_MAX_ENTRIES
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+# Seconds a write waits for another process holding the database lock
+BUSY_TIMEOUT = 30
+
+def normalize_text(text):
+    """Normalize text so trivially different copies share a cache entry."""
+    return " ".join((text or "").split()).lower()
+
+def make_cache_key(text, template, settings):
+    """Build a content-addressed cache key.
+
+    Args:
+        text: Text sent to the model
+        template: Prompt template the text is rendered into
+        settings: Dictionary of model settings (model name, temperature, ...)
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(normalize_text(text).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(template.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class ResultCache:
+    """SQLite-backed result cache with TTL and LRU eviction.
+
+    Entries older than `ttl` seconds are treated as missing. When the number
+    of entries exceeds `max_entries`, the least recently used ones are
+    evicted.
+    """
+
+    def __init__(self, path=PARSE_CACHE_PATH, ttl=PARSE_CACHE_TTL, max_entries=PARSE_CACHE_MAX_ENTRIES):
+        """Open (or create) the cache database."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Parse cache lookup failed: {str(e)}")
+                row = None
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                if row is not None:
+                    self._write("DELETE FROM results WHERE key = ?", (key,))
+                self.misses += 1
+                increment('parse_cache_requests_total', result='miss')
+                return None
+            # The LRU touch is best effort; a hit stays a hit if it fails
+            self._write("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            increment('parse_cache_requests_total', result='hit')
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a JSON-serializable value under `key`."""
+        now = time.time()
+        with self._lock:
+            self._write(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+                evict=True
+            )
+
+    def _write(self, sql, params, evict=False):
+        """Run one write in its own transaction, logging instead of raising on failure."""
+        try:
+            self._conn.execute(sql, params)
+            if evict:
+                self._evict()
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            logger.warning(f"Parse cache write failed: {str(e)}")
+            increment('parse_cache_errors_total')
+
+    def _evict(self):
+        """Drop expired entries and trim the table to `max_entries`."""
+        if self.ttl:
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            self._conn.execute(
+                """
+                DELETE FROM results WHERE key IN (
+                    SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': size
+            }
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Get the process-wide parsing result cache.
+
+    Returns:
+        Shared ResultCache, or None when caching is disabled
+    """
+    global _result_cache
+    if not PARSE_CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
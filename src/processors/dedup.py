@@ -0,0 +1,148 @@
+"""Near-duplicate detection for email bodies with MinHash and LSH."""
+import functools
+import re
+import zlib
+from email.utils import parseaddr
+import numpy as np
+from config import DEDUP_THRESHOLD, DEDUP_NUM_PERM
+from processors.cache import normalize_text
+
+# Words per shingle
+SHINGLE_SIZE = 3
+
+# Order numbers, dates and amounts do not change what the LLM extracts
+DIGITS = re.compile(r'\d+')
+
+# Mersenne prime for the universal hash family; hash values stay below 2**31
+# so (a * x + b) fits in a signed 64-bit integer
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Seed for the hash permutations, so signatures are comparable between runs
+PERMUTATION_SEED = 1
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Get the set of word n-grams of normalized text, with numbers masked."""
+    words = DIGITS.sub('0', normalize_text(text)).split()
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+@functools.lru_cache(maxsize=None)
+def lsh_parameters(threshold, num_perm):
+    """Choose the number of bands and rows per band for a Jaccard threshold.
+
+    Picks the split of `num_perm` hash values that minimizes the sum of the
+    false positive and false negative probability mass around `threshold`.
+
+    Returns:
+        Tuple of (bands, rows)
+    """
+    similarities, step = np.linspace(0, 1, 1001, retstep=True)
+    below = similarities < threshold
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        candidate = 1 - (1 - similarities ** rows) ** bands  # probability of sharing a bucket
+        error = (candidate[below].sum() + (1 - candidate[~below]).sum()) * step
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+class NearDuplicateIndex:
+    """LSH index of MinHash signatures, answering "is this a near-duplicate?".
+
+    Each added item is hashed into one bucket per band. A query only
+    compares against the items sharing at least one bucket with it, and
+    accepts the first whose estimated Jaccard similarity reaches the
+    threshold, so indexing n items costs roughly O(n) comparisons.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM):
+        """Initialize an empty index.
+
+        Args:
+            threshold: Minimum estimated Jaccard similarity of word shingles
+            num_perm: Number of hash permutations per signature
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+
+        rng = np.random.default_rng(PERMUTATION_SEED)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = {}
+
+    def signature(self, text):
+        """Compute the MinHash signature of a text."""
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) & MERSENNE_PRIME for shingle in shingles(text)),
+            dtype=np.int64
+        )
+        return ((self._a * hashes + self._b) % MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, signature):
+        """Get the key of an indexed near-duplicate of `signature`, or None."""
+        checked = set()
+        for band, key in self._band_keys(signature):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, key, signature):
+        """Index a signature under `key`."""
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+def cluster_near_duplicates(texts, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM):
+    """Group texts into clusters of near-duplicates.
+
+    Each text joins the cluster of the first earlier representative it is a
+    near-duplicate of, or starts a new cluster.
+
+    Args:
+        texts: List of texts
+        threshold: Minimum estimated Jaccard similarity of word shingles
+        num_perm: Number of hash permutations per signature
+
+    Returns:
+        List of clusters, each a list of indices into `texts` with the
+        representative first, in order of first appearance
+    """
+    index = NearDuplicateIndex(threshold, num_perm)
+    clusters = {}
+    for i, text in enumerate(texts):
+        signature = index.signature(text)
+        representative = index.find(signature)
+        if representative is None:
+            index.add(i, signature)
+            clusters[i] = [i]
+        else:
+            clusters[representative].append(i)
+    return list(clusters.values())
+
+def fan_out_result(parsed_result, email):
+    """Copy a representative's extraction result for another member of its cluster.
+
+    Near-duplicates share their content but not their author, so the
+    customer name is taken from the member's own sender.
+
+    Args:
+        parsed_result: Extraction result of the cluster representative
+        email: Dictionary containing the member's email data
+
+    Returns:
+        Dictionary with extracted information for the member
+    """
+    name = parseaddr(email.get('sender', ''))[0]
+    return dict(parsed_result, customer_name=name or None)
@@ -0,0 +1,318 @@
+"""Local pre-classifier answering trivial emails without an LLM call."""
+import logging
+import os
+import pickle
+import re
+import threading
+from email.utils import parseaddr
+from config import PRECLASSIFIER_ENABLED, PRECLASSIFIER_THRESHOLD, PRECLASSIFIER_MODEL_PATH
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+# Extraction result given to every email of a trivial category
+CATEGORY_RESULTS = {
+    'auto_reply': {'sentiment': 'neutral', 'main_issue': 'Automatic reply', 'priority': 'low'},
+    'bounce': {'sentiment': 'neutral', 'main_issue': 'Delivery failure notice', 'priority': 'low'},
+    'newsletter': {'sentiment': 'neutral', 'main_issue': 'Newsletter or marketing email', 'priority': 'low'},
+    'receipt': {'sentiment': 'neutral', 'main_issue': 'Receipt or transactional notification', 'priority': 'low'},
+    'thank_you': {'sentiment': 'positive', 'main_issue': 'Thank-you note', 'priority': 'low'}
+}
+
+# Label for emails that need the LLM, used when training the model
+OTHER = 'other'
+
+AUTO_REPLY_SUBJECT = re.compile(
+    r'^\s*(auto(matic)?[ -]?(reply|response)|out of (the )?office|away from (the )?office|on vacation)', re.I
+)
+BOUNCE_SUBJECT = re.compile(
+    r'(undeliverable|undelivered mail|delivery status notification|mail delivery (failed|failure)|returned mail)', re.I
+)
+BOUNCE_SENDER = re.compile(r'^(mailer-daemon|postmaster)@', re.I)
+NOREPLY_SENDER = re.compile(r'^(no[-_.]?reply|do[-_.]?not[-_.]?reply|notifications?|billing|receipts?)@', re.I)
+RECEIPT_SUBJECT = re.compile(
+    r'(receipt|invoice|order confirm|payment (received|confirmation)|has shipped|shipping confirmation)', re.I
+)
+REPLY_SUBJECT = re.compile(r'^\s*(re|fwd?|aw|sv)\s*:', re.I)
+
+# Sentiment and priority lexicon
+POSITIVE_WORDS = re.compile(
+    r'\b(thanks?|thank you|love|great|awesome|amazing|excellent|appreciated?|perfect|happy)\b', re.I
+)
+NEGATIVE_WORDS = re.compile(
+    r"\b(refund\w*|broken|broke|damaged|defective|faulty|terrible|awful|horrible|worst|poor|angry|upset|"
+    r"unhappy|disappointed|frustrat\w*|annoy\w*|cancel\w*|complain\w*|problem\w*|issues?|error\w*|"
+    r"fail\w*|wrong|late|delay\w*|missing|lost|stuck|return\w*|replace\w*|exchange|charged|"
+    r"still waiting|not working|doesn't work|never arrived|not arrived|hasn't arrived|haven't received|"
+    r"never received|where is)\b", re.I
+)
+# Negations and contrasts that turn a thanks into the preface of a complaint
+NEGATION_WORDS = re.compile(
+    r"(\b(not|no|never|nothing|but|however|although|though|unfortunately|still|yet|except|instead|without)\b|n't\b)",
+    re.I
+)
+URGENT_WORDS = re.compile(r'\b(urgent|asap|immediately|right away|lawyer|chargeback|third time|escalate)\b', re.I)
+
+# Thank-you notes without complaint, urgency or negation wording. Short
+# ones reach the default PRECLASSIFIER_THRESHOLD; longer ones leave room
+# for a complaint the lexicon misses, so they only skip the LLM when the
+# model agrees or the threshold is lowered.
+THANK_YOU_SHORT_WORDS = 20
+THANK_YOU_MAX_WORDS = 40
+THANK_YOU_CONFIDENCE = 0.9
+THANK_YOU_LONG_CONFIDENCE = 0.7
+
+# Categories whose body is the sender's own message, so urgent wording in
+# it raises the priority. Auto-replies and bounces quote other mail and
+# newsletters are marketing copy.
+LEXICON_PRIORITY_CATEGORIES = {'receipt', 'thank_you'}
+
+def lexicon_signals(text):
+    """Score text against the sentiment and priority lexicon.
+
+    Returns:
+        Dictionary with 'positive', 'negative', 'negation' and 'urgent'
+        match counts
+    """
+    return {
+        'positive': len(POSITIVE_WORDS.findall(text)),
+        'negative': len(NEGATIVE_WORDS.findall(text)),
+        'negation': len(NEGATION_WORDS.findall(text)),
+        'urgent': len(URGENT_WORDS.findall(text))
+    }
+
+def lexicon_priority(text):
+    """Get the priority the lexicon gives text: 'high' on urgent wording, else None."""
+    return 'high' if URGENT_WORDS.search(text) else None
+
+def _header_rules(headers):
+    """Classify by the headers automated mail carries."""
+    auto_submitted = headers.get('auto-submitted', 'no').lower()
+    precedence = headers.get('precedence', '').lower()
+
+    if auto_submitted != 'no' or 'x-autoreply' in headers or 'x-autorespond' in headers \
+            or precedence == 'auto_reply':
+        return 'auto_reply', 0.99
+    if 'multipart/report' in headers.get('content-type', '').lower():
+        return 'bounce', 0.99
+    if 'list-unsubscribe' in headers or 'list-id' in headers or precedence in ('bulk', 'list', 'junk'):
+        return 'newsletter', 0.95
+    return None, 0.0
+
+def _content_rules(sender_address, subject, body):
+    """Classify by sender, subject and lexicon."""
+    if BOUNCE_SENDER.match(sender_address):
+        return 'bounce', 0.99
+    if BOUNCE_SUBJECT.search(subject):
+        return 'bounce', 0.9
+    if AUTO_REPLY_SUBJECT.match(subject):
+        return 'auto_reply', 0.9
+
+    signals = lexicon_signals(f"{subject}\n{body}")
+    complaint = signals['negative'] or signals['urgent']
+
+    # Urgent notifications are still receipts, see LEXICON_PRIORITY_CATEGORIES
+    noreply = NOREPLY_SENDER.match(sender_address)
+    if RECEIPT_SUBJECT.search(subject) and not REPLY_SUBJECT.match(subject):
+        if noreply and not signals['negative']:
+            return 'receipt', 0.95
+        return 'receipt', 0.6
+    if noreply:
+        return 'receipt', 0.8
+
+    words = len(body.split())
+    if signals['positive'] and not complaint and not signals['negation'] and '?' not in body:
+        if words <= THANK_YOU_SHORT_WORDS:
+            return 'thank_you', THANK_YOU_CONFIDENCE
+        if words <= THANK_YOU_MAX_WORDS:
+            return 'thank_you', THANK_YOU_LONG_CONFIDENCE
+    return None, 0.0
+
+def category_from_result(parsed_result):
+    """Map an LLM extraction result to a trivial category, or OTHER.
+
+    Used to label past LLM outputs for training the model.
+    """
+    issue = str(parsed_result.get('main_issue') or '').lower()
+    if re.search(r'out of (the )?office|auto(matic)?[ -]?(reply|response)', issue):
+        return 'auto_reply'
+    if re.search(r'bounce|undeliver|delivery fail', issue):
+        return 'bounce'
+    if re.search(r'newsletter|marketing|promotion', issue):
+        return 'newsletter'
+    if re.search(r'receipt|invoice|order confirmation|shipping confirmation', issue):
+        return 'receipt'
+    if 'thank' in issue and parsed_result.get('sentiment') == 'positive':
+        return 'thank_you'
+    return OTHER
+
+def _model_text(email):
+    """Text the model sees for an email."""
+    return f"{email.get('sender', '')}\n{email.get('subject', '')}\n{email.get('body', '')[:2000]}"
+
+class TrivialEmailModel:
+    """TF-IDF + logistic regression model recognizing trivial emails.
+
+    Requires scikit-learn, which is optional; see `train_model`.
+    """
+
+    def __init__(self, pipeline):
+        """Wrap a fitted scikit-learn pipeline."""
+        self.pipeline = pipeline
+
+    def predict(self, email):
+        """Predict an email's category.
+
+        Returns:
+            Tuple of (category, probability)
+        """
+        probabilities = self.pipeline.predict_proba([_model_text(email)])[0]
+        best = probabilities.argmax()
+        return self.pipeline.classes_[best], float(probabilities[best])
+
+def train_model(emails, parsed_results, path=PRECLASSIFIER_MODEL_PATH):
+    """Train the trivial-email model on past LLM outputs and save it.
+
+    Args:
+        emails: List of dictionaries containing email data
+        parsed_results: LLM extraction results, one per email
+        path: File to pickle the model to, or None to skip saving
+
+    Returns:
+        TrivialEmailModel
+
+    Raises:
+        ImportError: If scikit-learn is not installed
+        ValueError: If the examples cover fewer than two categories
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    labels = [category_from_result(parsed) for parsed in parsed_results]
+    if len(set(labels)) < 2:
+        raise ValueError("Training needs examples of at least two categories")
+
+    pipeline = make_pipeline(
+        TfidfVectorizer(ngram_range=(1, 2), max_features=20000, sublinear_tf=True),
+        LogisticRegression(max_iter=1000)
+    )
+    pipeline.fit([_model_text(email) for email in emails], labels)
+    model = TrivialEmailModel(pipeline)
+
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(model, f)
+    return model
+
+def load_model(path=PRECLASSIFIER_MODEL_PATH):
+    """Load a trained model, or None if there is none or scikit-learn is missing."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except ImportError:
+        logger.warning("scikit-learn is not installed, the email pre-classifier runs on rules only")
+        return None
+
+class EmailPreClassifier:
+    """Answer trivial emails locally and leave the rest to the LLM.
+
+    Header rules catch auto-replies, bounces and mailing-list mail, and
+    sender and subject rules catch receipts. The lexicon recognizes short
+    thank-you notes and sets the priority of emails with urgent wording. An
+    optional trained model gets a say when the rules are unsure. Only a
+    category reached with at least `threshold` confidence skips the LLM.
+    """
+
+    def __init__(self, threshold=PRECLASSIFIER_THRESHOLD, model=None):
+        """Initialize with a confidence threshold and an optional TrivialEmailModel."""
+        self.threshold = threshold
+        self.model = model
+        self.classified = 0
+        self.sent_to_llm = 0
+        self._lock = threading.Lock()
+
+    def predict(self, email):
+        """Get the most likely trivial category of an email.
+
+        Args:
+            email: Dictionary with 'sender', 'subject', 'body' and optionally
+                'headers' (lower-cased header names)
+
+        Returns:
+            Tuple of (category or None, confidence)
+        """
+        headers = email.get('headers') or {}
+        category, confidence = _header_rules(headers)
+        if confidence < self.threshold:
+            sender_address = parseaddr(email.get('sender', ''))[1]
+            category, confidence = max(
+                [(category, confidence),
+                 _content_rules(sender_address, email.get('subject', ''), email.get('body', ''))],
+                key=lambda item: item[1]
+            )
+        if confidence < self.threshold and self.model is not None:
+            model_category, model_confidence = self.model.predict(email)
+            if model_category != OTHER and model_confidence > confidence:
+                category, confidence = model_category, model_confidence
+        return category, confidence
+
+    def classify(self, email):
+        """Extract information from an email without the LLM, if it is trivial.
+
+        Returns:
+            Dictionary with extracted information, or None when the email
+            needs the LLM
+        """
+        category, confidence = self.predict(email)
+        if category is None or confidence < self.threshold:
+            with self._lock:
+                self.sent_to_llm += 1
+            increment('email_preclassifier_total', result='llm')
+            return None
+
+        with self._lock:
+            self.classified += 1
+        increment('email_preclassifier_total', result='skipped', category=category)
+        name = parseaddr(email.get('sender', ''))[0]
+        result = dict(CATEGORY_RESULTS[category], customer_name=name or None, product=None)
+        if category in LEXICON_PRIORITY_CATEGORIES:
+            result['priority'] = lexicon_priority(
+                f"{email.get('subject', '')}\n{email.get('body', '')}") or result['priority']
+        return result
+
+    def stats(self):
+        """Get how many emails skipped the LLM.
+
+        Returns:
+            Dictionary with classified, sent_to_llm and avoided_fraction
+        """
+        with self._lock:
+            total = self.classified + self.sent_to_llm
+            return {
+                'classified': self.classified,
+                'sent_to_llm': self.sent_to_llm,
+                'avoided_fraction': self.classified / total if total else 0.0
+            }
+
+_preclassifier = None
+_preclassifier_lock = threading.Lock()
+
+def get_preclassifier():
+    """Get the process-wide pre-classifier.
+
+    Returns:
+        Shared EmailPreClassifier, or None when pre-classification is disabled
+    """
+    global _preclassifier
+    if not PRECLASSIFIER_ENABLED:
+        return None
+    with _preclassifier_lock:
+        if _preclassifier is None:
+            _preclassifier = EmailPreClassifier(model=load_model())
+        return _preclassifier
@@ -2,55 +2,398 @@
 from langchain.llms import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-import json
-from config import OPENAI_API_KEY
+import functools
+import logging
+import re
+import threading
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, EMAIL_BATCH_SIZE, EMAIL_BODY_MAX_TOKENS, DEDUP_ENABLED, LLM_MAX_REASKS
+)
+from processors.cache import get_result_cache, make_cache_key
+from processors.email_classifier import get_preclassifier
+from processors.dedup import cluster_near_duplicates, fan_out_result
+from processors.structured_output import (
+    EmailExtraction, repair_json, validate_fields, parse_structured, merge_answer, format_errors, fill_defaults
+)
+from metrics import increment, timed, track_llm
+from resilience import call_limited, acall_limited
 
-def parse_email_content(email_body):
-    """Parse email content to extract structured information.
-    
-    Args:
-        email_body: Raw email text
-        
-    Returns:
-        Dictionary with extracted information
-    """
-    # Initialize LLM
-    llm = OpenAI(temperature=0, api_key=OPENAI_API_KEY)
-    
-    # Create prompt
-    prompt = PromptTemplate(
-        input_variables=["email"],
-        template="""
+logger = logging.getLogger(__name__)
+
+EMAIL_LLM_SETTINGS = {'model_name': OPENAI_MODEL, 'temperature': 0}
+
+EMAIL_FIELDS = list(EmailExtraction.model_fields)
+
+EMAIL_PROMPT_TEMPLATE = """
         Extract the following information from this email:
         1. Customer name (if available)
         2. Product mentioned (if any)
         3. Sentiment (positive, negative, neutral)
         4. Main issue or request
         5. Priority (high, medium, low)
-        
+
         Email:
         {email}
-        
+
         Format as JSON with these keys: customer_name, product, sentiment, main_issue, priority
         """
+
+BATCH_EMAIL_PROMPT_TEMPLATE = """
+        Extract the following information from each of the emails below:
+        1. Customer name (if available)
+        2. Product mentioned (if any)
+        3. Sentiment (positive, negative, neutral)
+        4. Main issue or request
+        5. Priority (high, medium, low)
+
+        Each email starts with a line of the form "### EMAIL <index> ###".
+
+        {emails}
+
+        Format as a JSON array with exactly one object per email, in the same order.
+        Each object must have these keys: index, customer_name, product, sentiment, main_issue, priority
+        """
+
+REASK_EMAIL_PROMPT_TEMPLATE = """
+        Your earlier answer about this email had missing or invalid fields:
+        {errors}
+
+        Email:
+        {email}
+
+        Reply with only a JSON object holding these keys: {fields}
+        Use null for a customer name or product that is not mentioned.
+        """
+
+# Rough token size of English text when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Appended to bodies cut to the token budget
+TRUNCATION_MARKER = "\n[... truncated]"
+
+@functools.lru_cache(maxsize=None)
+def _token_encoding():
+    """Get the tiktoken encoding of the email model, or None without tiktoken."""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken is not installed, email token budgets are estimated from length")
+        return None
+    try:
+        return tiktoken.encoding_for_model(OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+def count_tokens(text):
+    """Count the prompt tokens of a text, estimated when tiktoken is missing."""
+    encoding = _token_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+def truncate_to_token_budget(text, max_tokens=EMAIL_BODY_MAX_TOKENS):
+    """Cut an email body to at most `max_tokens` prompt tokens.
+
+    The cut falls back to the last paragraph, sentence or word boundary in
+    the final fifth of the allowed text, so the body does not end mid-word.
+
+    Args:
+        text: Email body
+        max_tokens: Token budget, or None for no limit
+
+    Returns:
+        The body, or its truncated head followed by TRUNCATION_MARKER
+    """
+    if not max_tokens or count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _token_encoding()
+    if encoding is None:
+        head = text[:max_tokens * CHARS_PER_TOKEN]
+    else:
+        head = encoding.decode(encoding.encode(text)[:max_tokens])
+
+    floor = len(head) * 4 // 5
+    for boundary in (re.compile(r'\n\s*\n'), re.compile(r'[.!?]\s'), re.compile(r'\s')):
+        cuts = [match.end() for match in boundary.finditer(head) if match.end() >= floor]
+        if cuts:
+            head = head[:cuts[-1]]
+            break
+    increment('email_bodies_truncated_total')
+    return head.rstrip() + TRUNCATION_MARKER
+
+# Values for fields the LLM still got wrong after re-asking
+FALLBACK_RESULT = {
+    'customer_name': 'Unknown',
+    'product': 'Unknown',
+    'sentiment': 'neutral',
+    'main_issue': 'Unknown',
+    'priority': 'medium'
+}
+
+def _fallback_result(valid_fields=None):
+    """Build the record used when the LLM answer stays invalid, keeping its valid fields."""
+    increment('email_parse_fallbacks_total')
+    return fill_defaults(EmailExtraction, valid_fields or {}, FALLBACK_RESULT)
+
+def _reask_inputs(email_body, errors):
+    """Build the inputs of a re-ask for the invalid fields of an answer."""
+    return {'email': email_body, 'errors': format_errors(errors), 'fields': ', '.join(errors)}
+
+def _cache_key(email_body):
+    """Build the result cache key for an email body."""
+    return make_cache_key(email_body, EMAIL_PROMPT_TEMPLATE, EMAIL_LLM_SETTINGS)
+
+def _format_batch(email_bodies):
+    """Join several email bodies into a single indexed prompt section."""
+    sections = []
+    for index, body in enumerate(email_bodies):
+        sections.append(f"### EMAIL {index} ###\n{body}")
+    return "\n\n".join(sections)
+
+def _parse_batch_output(output, expected_count):
+    """Split a batched LLM output into per-email results.
+
+    Args:
+        output: Raw LLM output expected to hold a JSON array
+        expected_count: Number of emails sent in the batch
+
+    Returns:
+        List of length expected_count holding, per email, the
+        `validate_fields` tuple of its entry, or None if the entry is
+        missing
+    """
+    results = [None] * expected_count
+    items = repair_json(output)
+    if not isinstance(items, list):
+        return results
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.get('index', position)
+        if not isinstance(index, int) or not 0 <= index < expected_count or results[index] is not None:
+            continue
+        results[index] = validate_fields(item, EmailExtraction)
+
+    return results
+
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_email_llm():
+    """Get the LLM client shared by every email parsing call, created on first use."""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            # Retries are left to `resilience`, so they share the OpenAI rate limit and circuit breaker
+            _llm = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, **EMAIL_LLM_SETTINGS)
+        return _llm
+
+def _build_chain():
+    """Build the single-email extraction chain."""
+    llm = get_email_llm()
+    prompt = PromptTemplate(
+        input_variables=["email"],
+        template=EMAIL_PROMPT_TEMPLATE
+    )
+    return LLMChain(llm=llm, prompt=prompt)
+
+def _build_reask_chain():
+    """Build the chain asking again for the invalid fields of an answer."""
+    prompt = PromptTemplate(
+        input_variables=["errors", "email", "fields"],
+        template=REASK_EMAIL_PROMPT_TEMPLATE
     )
-    
-    # Create chain
-    chain = LLMChain(llm=llm, prompt=prompt)
-    
+    return LLMChain(llm=get_email_llm(), prompt=prompt)
+
+def _finish_result(email_body, parsed_result, valid_fields, cache):
+    """Cache a valid answer, or fall back to defaults for the fields still invalid."""
+    if parsed_result is None:
+        return _fallback_result(valid_fields)
+    if cache is not None:
+        cache.set(_cache_key(email_body), parsed_result)
+    return parsed_result
+
+@timed('processor_seconds', processor='parse_email_content')
+def parse_email_content(email_body):
+    """Parse email content to extract structured information.
+
+    Args:
+        email_body: Raw email text, cut to EMAIL_BODY_MAX_TOKENS
+
+    Returns:
+        Dictionary with extracted information
+    """
+    email_body = truncate_to_token_budget(email_body)
+
+    # Check the result cache first
+    cache = get_result_cache()
+    if cache is not None:
+        cached_result = cache.get(_cache_key(email_body))
+        if cached_result is not None:
+            return cached_result
+
     # Run chain
-    result = chain.run(email=email_body)
-    
-    # Parse JSON result
-    try:
-        parsed_result = json.loads(result.strip())
-        return parsed_result
-    except json.JSONDecodeError:
-        # Fallback in case of parsing error
-        return {
-            'customer_name': 'Unknown',
-            'product': 'Unknown',
-            'sentiment': 'neutral',
-            'main_issue': result,
-            'priority': 'medium'
-        }
\ No newline at end of file
+    with track_llm('email'):
+        result = call_limited('openai', _build_chain().run, email=email_body)
+    parsed_result, valid_fields, errors = parse_structured(result, EmailExtraction)
+
+    # Ask again for the invalid fields only, instead of re-parsing the whole email
+    for _ in range(LLM_MAX_REASKS if parsed_result is None else 0):
+        increment('email_parse_reasks_total')
+        with track_llm('email_reask'):
+            answer = call_limited('openai', _build_reask_chain().run, **_reask_inputs(email_body, errors))
+        parsed_result, valid_fields, errors = merge_answer(EmailExtraction, valid_fields, errors, answer)
+        if parsed_result is not None:
+            break
+    return _finish_result(email_body, parsed_result, valid_fields, cache)
+
+@timed('processor_seconds', processor='aparse_email_content')
+async def aparse_email_content(email_body):
+    """Asynchronously parse email content to extract structured information.
+
+    Same as `parse_email_content`, but awaits the LLM call instead of blocking.
+
+    Args:
+        email_body: Raw email text, cut to EMAIL_BODY_MAX_TOKENS
+
+    Returns:
+        Dictionary with extracted information
+    """
+    email_body = truncate_to_token_budget(email_body)
+    cache = get_result_cache()
+    if cache is not None:
+        cached_result = cache.get(_cache_key(email_body))
+        if cached_result is not None:
+            return cached_result
+
+    with track_llm('email'):
+        result = await acall_limited('openai', _build_chain().arun, email=email_body)
+    parsed_result, valid_fields, errors = parse_structured(result, EmailExtraction)
+
+    for _ in range(LLM_MAX_REASKS if parsed_result is None else 0):
+        increment('email_parse_reasks_total')
+        with track_llm('email_reask'):
+            answer = await acall_limited('openai', _build_reask_chain().arun, **_reask_inputs(email_body, errors))
+        parsed_result, valid_fields, errors = merge_answer(EmailExtraction, valid_fields, errors, answer)
+        if parsed_result is not None:
+            break
+    return _finish_result(email_body, parsed_result, valid_fields, cache)
+
+@timed('processor_seconds', processor='parse_emails_batch')
+def parse_emails_batch(email_bodies, batch_size=EMAIL_BATCH_SIZE):
+    """Parse many emails with as few LLM calls as possible.
+
+    Emails are packed `batch_size` at a time into a single prompt. Entries
+    missing from the batched answer are re-run individually, and entries
+    with invalid fields are asked again for those fields only; each round
+    of retries goes out as one batched `generate` request. Emails already
+    in the result cache are not sent to the model at all.
+
+    Args:
+        email_bodies: List of raw email texts, each cut to EMAIL_BODY_MAX_TOKENS
+        batch_size: Maximum number of emails packed into one prompt
+
+    Returns:
+        List of dictionaries with extracted information, in input order
+    """
+    if not email_bodies:
+        return []
+    email_bodies = [truncate_to_token_budget(body) for body in email_bodies]
+
+    results = [None] * len(email_bodies)
+
+    # Serve what we can from the result cache
+    cache = get_result_cache()
+    pending = list(range(len(email_bodies)))
+    if cache is not None:
+        pending = []
+        for i, body in enumerate(email_bodies):
+            results[i] = cache.get(_cache_key(body))
+            if results[i] is None:
+                pending.append(i)
+    if not pending:
+        return results
+
+    # One chain per call on the shared client, used by every batch
+    llm = get_email_llm()
+    batch_chain = LLMChain(
+        llm=llm,
+        prompt=PromptTemplate(input_variables=["emails"], template=BATCH_EMAIL_PROMPT_TEMPLATE)
+    )
+
+    # index -> validate_fields tuple of the email's answer so far
+    answers = {}
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        with track_llm('email_batch'):
+            prompt_emails = _format_batch([email_bodies[i] for i in chunk])
+            output = call_limited('openai', batch_chain.run, emails=prompt_emails)
+        for i, answer in zip(chunk, _parse_batch_output(output, len(chunk))):
+            if answer is not None:
+                answers[i] = answer
+
+    # Re-run only the entries the batched answer left out
+    retry_indices = [i for i in pending if i not in answers]
+    if retry_indices:
+        single_chain = LLMChain(
+            llm=llm,
+            prompt=PromptTemplate(input_variables=["email"], template=EMAIL_PROMPT_TEMPLATE)
+        )
+        increment('email_parse_retries_total', len(retry_indices))
+        with track_llm('email_retry'):
+            inputs = [{'email': email_bodies[i]} for i in retry_indices]
+            outputs = call_limited('openai', single_chain.apply, inputs)
+        for i, output in zip(retry_indices, outputs):
+            answers[i] = parse_structured(output['text'], EmailExtraction)
+
+    # Ask again for just the invalid fields, all emails in one batched request
+    for _ in range(LLM_MAX_REASKS):
+        reask_indices = [i for i in pending if answers[i][0] is None]
+        if not reask_indices:
+            break
+        increment('email_parse_reasks_total', len(reask_indices))
+        with track_llm('email_reask'):
+            inputs = [_reask_inputs(email_bodies[i], answers[i][2]) for i in reask_indices]
+            outputs = call_limited('openai', _build_reask_chain().apply, inputs)
+        for i, output in zip(reask_indices, outputs):
+            answers[i] = merge_answer(EmailExtraction, answers[i][1], answers[i][2], output['text'])
+
+    # Only cache real answers, never the fallback records
+    for i in pending:
+        results[i] = _finish_result(email_bodies[i], answers[i][0], answers[i][1], cache)
+
+    return results
+
+def parse_emails(emails, batch_size=EMAIL_BATCH_SIZE):
+    """Parse emails, answering trivial ones locally and batching the rest to the LLM.
+
+    Emails that are near-duplicates of each other (mass complaints, form
+    submissions, forwarded templates) are parsed once, through the first
+    email of their cluster, and the result is copied to the others.
+
+    Args:
+        emails: List of dictionaries containing email data
+        batch_size: Maximum number of emails packed into one prompt
+
+    Returns:
+        List of dictionaries with extracted information, in input order
+    """
+    preclassifier = get_preclassifier()
+    results = [preclassifier.classify(email) if preclassifier else None for email in emails]
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if DEDUP_ENABLED:
+        clusters = [[pending[j] for j in cluster]
+                    for cluster in cluster_near_duplicates([emails[i]['body'] for i in pending])]
+    else:
+        clusters = [[i] for i in pending]
+    increment('email_duplicates_total', len(pending) - len(clusters))
+
+    parsed = parse_emails_batch([emails[cluster[0]]['body'] for cluster in clusters], batch_size=batch_size)
+    for cluster, parsed_result in zip(clusters, parsed):
+        results[cluster[0]] = parsed_result
+        for i in cluster[1:]:
+            results[i] = fan_out_result(parsed_result, emails[i])
+    return results
@@ -2,58 +2,107 @@
 from langchain.llms import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-import json
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, OPENAI_MODEL, LLM_MAX_REASKS
+from processors.cache import get_result_cache, make_cache_key
+from processors.structured_output import (
+    ReviewExtraction, parse_structured, merge_answer, format_errors, fill_defaults
+)
+from metrics import increment, timed, track_llm
+from resilience import call_limited
 
+REVIEW_LLM_SETTINGS = {'model_name': OPENAI_MODEL, 'temperature': 0}
+
+REVIEW_PROMPT_TEMPLATE = """
+        Extract the following information from this {source} review:
+        1. Product name (if mentioned)
+        2. Rating (extract or estimate on a scale of 1-5)
+        3. Sentiment (positive, negative, neutral)
+        4. Key positive points
+        5. Key negative points
+        6. Main suggestions for improvement (if any)
+
+        Review:
+        {review}
+
+        Format as JSON with these keys: product_name, rating, sentiment, positive_points, negative_points, suggestions
+        """
+
+REASK_REVIEW_PROMPT_TEMPLATE = """
+        Your earlier answer about this review had missing or invalid fields:
+        {errors}
+
+        Review:
+        {review}
+
+        Reply with only a JSON object holding these keys: {fields}
+        Ratings are whole numbers from 1 to 5, and points and suggestions are lists of strings.
+        """
+
+# Values for fields the LLM still got wrong after re-asking
+FALLBACK_RESULT = {
+    'product_name': 'Unknown',
+    'rating': 3,
+    'sentiment': 'neutral',
+    'positive_points': [],
+    'negative_points': [],
+    'suggestions': []
+}
+
+@timed('processor_seconds', processor='parse_review_content')
 def parse_review_content(review_text, source='unknown'):
     """Parse review content to extract structured information.
-    
+
     Args:
         review_text: Raw review text
         source: Source of the review (e.g., 'shopify', 'google', 'amazon')
-        
+
     Returns:
         Dictionary with extracted information
     """
+    # Check the result cache first; the source is part of the rendered prompt
+    cache = get_result_cache()
+    cache_key = make_cache_key(review_text, REVIEW_PROMPT_TEMPLATE, dict(REVIEW_LLM_SETTINGS, source=source))
+    if cache is not None:
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result
+
     # Initialize LLM
-    llm = OpenAI(temperature=0, api_key=OPENAI_API_KEY)
-    
+    llm = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, **REVIEW_LLM_SETTINGS)
+
     # Create prompt
     prompt = PromptTemplate(
         input_variables=["review", "source"],
-        template="""
-        Extract the following information from this {source} review:
-        1. Product name (if mentioned)
-        2. Rating (extract or estimate on a scale of 1-5)
-        3. Sentiment (positive, negative, neutral)
-        4. Key positive points
-        5. Key negative points
-        6. Main suggestions for improvement (if any)
-        
-        Review:
-        {review}
-        
-        Format as JSON with these keys: product_name, rating, sentiment, positive_points, negative_points, suggestions
-        """
+        template=REVIEW_PROMPT_TEMPLATE
     )
-    
+
     # Create chain
     chain = LLMChain(llm=llm, prompt=prompt)
-    
+
     # Run chain
-    result = chain.run(review=review_text, source=source)
-    
-    # Parse JSON result
-    try:
-        parsed_result = json.loads(result.strip())
-        return parsed_result
-    except json.JSONDecodeError:
-        # Fallback in case of parsing error
-        return {
-            'product_name': 'Unknown',
-            'rating': 3,
-            'sentiment': 'neutral',
-            'positive_points': [],
-            'negative_points': [],
-            'suggestions': []
-        }
\ No newline at end of file
+    with track_llm('review'):
+        result = call_limited('openai', chain.run, review=review_text, source=source)
+    parsed_result, valid_fields, errors = parse_structured(result, ReviewExtraction)
+
+    # Ask again for the invalid fields only
+    reask_prompt = PromptTemplate(
+        input_variables=["errors", "review", "fields"],
+        template=REASK_REVIEW_PROMPT_TEMPLATE
+    )
+    for _ in range(LLM_MAX_REASKS if parsed_result is None else 0):
+        increment('review_parse_reasks_total')
+        with track_llm('review_reask'):
+            answer = call_limited('openai', LLMChain(llm=llm, prompt=reask_prompt).run, review=review_text,
+                                  errors=format_errors(errors), fields=', '.join(errors))
+        parsed_result, valid_fields, errors = merge_answer(ReviewExtraction, valid_fields, errors, answer)
+        if parsed_result is not None:
+            break
+
+    if parsed_result is None:
+        # Keep what the model got right and default the rest
+        increment('review_parse_fallbacks_total')
+        return fill_defaults(ReviewExtraction, valid_fields, FALLBACK_RESULT)
+
+    if cache is not None:
+        cache.set(cache_key, parsed_result)
+    return parsed_result
@@ -0,0 +1,184 @@
+"""Schemas, tolerant JSON repair and field-level validation for LLM answers."""
+import json
+import re
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from metrics import increment
+
+# Values models write for "no value"
+EMPTY_VALUES = {'', 'n/a', 'na', 'none', 'null', 'not mentioned', 'not available'}
+
+def _lower(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+def _optional_text(value):
+    if isinstance(value, str) and value.strip().lower() in EMPTY_VALUES:
+        return None
+    return value.strip() if isinstance(value, str) else value
+
+def _text_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() and value.strip().lower() not in EMPTY_VALUES else []
+    return value
+
+class EmailExtraction(BaseModel):
+    """Information extracted from one customer email."""
+
+    model_config = ConfigDict(extra='ignore')
+
+    customer_name: Optional[str]
+    product: Optional[str]
+    sentiment: Literal['positive', 'negative', 'neutral']
+    main_issue: str = Field(min_length=1)
+    priority: Literal['high', 'medium', 'low']
+
+    normalize_choices = field_validator('sentiment', 'priority', mode='before')(_lower)
+    normalize_optional = field_validator('customer_name', 'product', mode='before')(_optional_text)
+
+class ReviewExtraction(BaseModel):
+    """Information extracted from one product review."""
+
+    model_config = ConfigDict(extra='ignore')
+
+    product_name: Optional[str]
+    rating: int = Field(ge=1, le=5)
+    sentiment: Literal['positive', 'negative', 'neutral']
+    positive_points: List[str]
+    negative_points: List[str]
+    suggestions: List[str]
+
+    normalize_sentiment = field_validator('sentiment', mode='before')(_lower)
+    normalize_optional = field_validator('product_name', mode='before')(_optional_text)
+    normalize_lists = field_validator(
+        'positive_points', 'negative_points', 'suggestions', mode='before'
+    )(_text_list)
+
+    @field_validator('rating', mode='before')
+    @classmethod
+    def parse_rating(cls, value):
+        """Accept ratings written as '4/5', '4 stars' or 4.5."""
+        if isinstance(value, str):
+            match = re.search(r'\d+(\.\d+)?', value)
+            value = match.group(0) if match else value
+        try:
+            return round(float(value))
+        except (TypeError, ValueError):
+            return value
+
+# Repairs for near-miss JSON, applied in order until the text parses
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_PYTHON_LITERALS = re.compile(r'\b(True|False|None)\b')
+_JSON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$', re.I)
+
+def _json_span(text):
+    """Cut the text from the first opening bracket to the last matching closing one."""
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind('}' if text[start] == '{' else ']')
+    return text[start:end + 1] if end > start else text[start:]
+
+def _repairs(text):
+    """Yield increasingly repaired versions of an LLM answer."""
+    text = text.strip()
+    yield text
+    text = _json_span(_CODE_FENCE.sub('', text).translate(_SMART_QUOTES))
+    yield text
+    text = _TRAILING_COMMA.sub(r'\1', text)
+    yield text
+    text = _PYTHON_LITERALS.sub(lambda match: _JSON_LITERALS[match.group(1)], text)
+    yield text
+    if '"' not in text:
+        yield text.replace("'", '"')
+
+def repair_json(text):
+    """Decode JSON from an LLM answer, fixing common near-misses.
+
+    Handles surrounding prose and code fences, smart quotes, trailing
+    commas, Python literals and single-quoted strings.
+
+    Args:
+        text: Raw LLM answer
+
+    Returns:
+        The decoded value, or None if no repair makes it valid JSON
+    """
+    if not isinstance(text, str):
+        return None
+    for attempt, candidate in enumerate(_repairs(text)):
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if attempt:
+            increment('llm_output_repaired_total')
+        return value
+    return None
+
+def validate_fields(data, schema):
+    """Validate a decoded answer field by field.
+
+    Args:
+        data: Decoded answer
+        schema: Pydantic model the answer should match
+
+    Returns:
+        Tuple of (validated dict, or None if any field is invalid;
+        dict of the fields that are valid; dict mapping every missing or
+        invalid field to the reason)
+    """
+    if not isinstance(data, dict):
+        return None, {}, {field: 'missing' for field in schema.model_fields}
+    try:
+        result = schema.model_validate(data).model_dump()
+        return result, result, {}
+    except ValidationError as e:
+        errors = {}
+        for error in e.errors():
+            field = error['loc'][0] if error['loc'] else None
+            if field in schema.model_fields:
+                errors.setdefault(field, 'missing' if error['type'] == 'missing' else error['msg'])
+        valid = {field: data[field] for field in schema.model_fields if field in data and field not in errors}
+        return None, valid, errors
+
+def parse_structured(output, schema):
+    """Repair, decode and validate an LLM answer; see `validate_fields`."""
+    return validate_fields(repair_json(output), schema)
+
+def merge_answer(schema, valid, errors, output):
+    """Fill the invalid fields of an earlier answer from a targeted re-ask.
+
+    Only the fields listed in `errors` are taken from the new answer, so a
+    re-ask cannot undo fields that were already valid.
+
+    Returns:
+        Same as `validate_fields`, for the merged answer
+    """
+    answer = repair_json(output)
+    data = dict(valid)
+    if isinstance(answer, dict):
+        data.update({field: answer[field] for field in errors if field in answer})
+    return validate_fields(data, schema)
+
+def format_errors(errors):
+    """Describe invalid fields for a re-ask prompt, one per line."""
+    return '\n'.join(f"- {field}: {reason}" for field, reason in errors.items())
+
+def fill_defaults(schema, valid, defaults):
+    """Complete the valid fields of an answer with defaults for the rest.
+
+    Args:
+        schema: Pydantic model of the answer
+        valid: Fields that passed validation
+        defaults: Value for every field of the schema
+
+    Returns:
+        Validated dictionary
+    """
+    return schema.model_validate(dict(defaults, **valid)).model_dump()
@@ -0,0 +1,378 @@
+"""Rate limiting, retries and circuit breaking for calls to external APIs.
+
+Every external API (Gmail, Sheets, Analytics Reporting, Shopify, OpenAI) has
+a name, e.g. 'gmail', under which it gets:
+
+- a token bucket limiting requests per second (`acquire`), applied where
+  requests are actually sent, or per attempt by `call_limited`;
+- a retry policy with jittered exponential backoff that honors
+  `Retry-After` (`call` / `acall`);
+- a circuit breaker that makes calls fail fast with CircuitOpenError once
+  the API keeps failing, instead of every caller retrying into an outage.
+
+Quota responses (429, Google's rate-limit 403s) are retried but do not trip
+the breaker, since the API is healthy and only asking callers to slow down.
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+from config import (
+    API_RATE_LIMITS, RETRY_MAX_RETRIES, RETRY_BACKOFF, RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+# Responses that ask the caller to slow down
+QUOTA_STATUSES = {429}
+
+# Responses worth retrying because the server may recover
+SERVER_STATUSES = {408, 500, 502, 503, 504}
+
+# Reasons Google APIs give for quota errors sent with status 403
+GOOGLE_QUOTA_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'dailyLimitExceeded')
+
+# Network failures without an HTTP status
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, httplib2.HttpLib2Error)
+try:
+    import openai
+    TRANSIENT_ERRORS += (openai.APIConnectionError,)
+except ImportError:
+    pass
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an API whose circuit breaker is open."""
+
+    def __init__(self, api, retry_in):
+        super().__init__(f"{api} is failing, calls are suspended for {retry_in:.0f}s")
+        self.api = api
+        self.retry_in = retry_in
+
+def error_status(exc):
+    """Get the HTTP status of an API error, or None for errors without one."""
+    if isinstance(exc, HttpError):
+        return exc.resp.status
+    # openai.APIStatusError has status_code, pyactiveresource errors have code
+    for attribute in ('status_code', 'code'):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def _error_headers(exc):
+    """Get the response headers of an API error, or an empty dict."""
+    if isinstance(exc, HttpError):
+        return exc.resp if isinstance(exc.resp, dict) else {}
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    return headers if hasattr(headers, 'items') else {}
+
+def retry_after(exc):
+    """Get the delay a `Retry-After` header of an API error asks for, in seconds, or None."""
+    value = next((v for k, v in _error_headers(exc).items() if str(k).lower() == 'retry-after'), None)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+def is_quota_error(exc):
+    """Check whether an error asks the caller to slow down."""
+    status = error_status(exc)
+    if status in QUOTA_STATUSES:
+        return True
+    if status == 403 and isinstance(exc, HttpError):
+        content = exc.content.decode('utf-8', errors='ignore') if isinstance(exc.content, bytes) else ''
+        return any(reason in content for reason in GOOGLE_QUOTA_REASONS)
+    return False
+
+def is_server_error(exc):
+    """Check whether an error means the API is unavailable or failing."""
+    status = error_status(exc)
+    if status is None:
+        return isinstance(exc, TRANSIENT_ERRORS)
+    return status in SERVER_STATUSES
+
+def is_retryable(exc):
+    """Check whether a failed call may succeed if tried again."""
+    return is_quota_error(exc) or is_server_error(exc)
+
+class RetryPolicy:
+    """How often and how long to wait between attempts of a failed call."""
+
+    def __init__(self, max_retries=RETRY_MAX_RETRIES, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY):
+        """Initialize a retry policy.
+
+        Args:
+            max_retries: Retries after the first attempt
+            backoff: Base delay in seconds, doubled on every retry
+            max_delay: Longest delay in seconds, including `Retry-After`
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+
+    def delay(self, attempt, exc):
+        """Get the delay before retrying after failed attempt number `attempt` (from 0).
+
+        A `Retry-After` header wins over the exponential backoff.
+        """
+        delay = retry_after(exc)
+        if delay is None:
+            delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+        return min(delay, self.max_delay)
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+class CircuitBreaker:
+    """Stop calling an API after `failure_threshold` consecutive server failures.
+
+    Once open, calls fail immediately for `reset_timeout` seconds. After that
+    calls go through again; the first failure reopens the circuit and the
+    first success closes it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, api, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        """Initialize a closed circuit breaker for `api`."""
+        self.api = api
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Check that a call may go ahead.
+
+        Raises:
+            CircuitOpenError: While the circuit is open
+        """
+        if self.state == self.OPEN:
+            raise CircuitOpenError(self.api, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def record_success(self):
+        """Record that the API answered."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """Record that the API failed, opening the circuit past the threshold."""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Circuit for {self.api} opened after {self._failures} failures")
+                    increment('circuit_opened_total', api=self.api)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts of `burst`."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """Initialize a full bucket.
+
+        Args:
+            rate: Sustained requests per second
+            burst: Bucket capacity, defaulting to one second of requests
+            clock: Monotonic time source, replaceable in tests
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token, possibly ahead of time.
+
+        Returns:
+            Seconds the caller must wait before using the token
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+_limiters = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def set_rate_limits(limits):
+    """Replace the process's rate limits.
+
+    Args:
+        limits: Dictionary mapping API name (e.g. 'gmail', 'shopify') to
+            requests per second; APIs left out or set to 0 are not limited
+    """
+    global _limiters
+    with _registry_lock:
+        _limiters = {api: TokenBucket(rate) for api, rate in (limits or {}).items() if rate}
+
+set_rate_limits(API_RATE_LIMITS)
+
+def _reserve(api):
+    limiter = _limiters.get(api)
+    wait = limiter.reserve() if limiter is not None else 0.0
+    if wait:
+        increment('rate_limit_wait_seconds_total', wait, api=api)
+    return wait
+
+def acquire(api):
+    """Wait for the rate limit of an API, if it has one.
+
+    Returns:
+        Seconds spent waiting
+    """
+    wait = _reserve(api)
+    if wait:
+        time.sleep(wait)
+    return wait
+
+async def acquire_async(api):
+    """Wait for the rate limit of an API without blocking the event loop.
+
+    Returns:
+        Seconds spent waiting
+    """
+    wait = _reserve(api)
+    if wait:
+        await asyncio.sleep(wait)
+    return wait
+
+def get_circuit_breaker(api):
+    """Get the process-wide circuit breaker of an API."""
+    with _registry_lock:
+        if api not in _breakers:
+            _breakers[api] = CircuitBreaker(api)
+        return _breakers[api]
+
+def reset_circuit_breakers():
+    """Close every circuit breaker."""
+    with _registry_lock:
+        _breakers.clear()
+
+def _record(api, breaker, exc):
+    """Update the breaker after a failed attempt and say whether to retry."""
+    if is_server_error(exc):
+        breaker.record_failure()
+        return breaker.state != CircuitBreaker.OPEN
+    if not is_quota_error(exc):
+        # The API answered; the request itself was wrong
+        breaker.record_success()
+        return False
+    return True
+
+def _log_retry(api, exc, attempt, delay):
+    status = error_status(exc)
+    increment('api_retries_total', api=api, status=status if status is not None else 'error')
+    logger.warning(f"{api} call failed ({status or type(exc).__name__}), retry {attempt + 1} in {delay:.1f}s")
+
+def call(api, func, *args, policy=None, **kwargs):
+    """Call `func(*args, **kwargs)` with retries and the API's circuit breaker.
+
+    Args:
+        api: API name, e.g. 'gmail'
+        func: Callable performing one request, e.g. `request.execute`
+        policy: RetryPolicy, defaulting to DEFAULT_RETRY_POLICY
+
+    Returns:
+        What `func` returns
+
+    Raises:
+        CircuitOpenError: If the API's circuit is open
+        Exception: The last error, once it is not retryable or retries ran out
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    breaker = get_circuit_breaker(api)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not _record(api, breaker, e) or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(api, e, attempt, delay)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+async def acall(api, func, *args, policy=None, **kwargs):
+    """Await `func(*args, **kwargs)` with retries and the API's circuit breaker.
+
+    Same as `call`, for coroutine functions.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    breaker = get_circuit_breaker(api)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if not _record(api, breaker, e) or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(api, e, attempt, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+def call_limited(api, func, *args, policy=None, **kwargs):
+    """Same as `call`, waiting for the API's rate limit before every attempt.
+
+    For clients whose requests do not go through a rate-limited transport,
+    like the Shopify and OpenAI SDKs.
+    """
+    def attempt():
+        acquire(api)
+        return func(*args, **kwargs)
+    return call(api, attempt, policy=policy)
+
+async def acall_limited(api, func, *args, policy=None, **kwargs):
+    """Same as `acall`, waiting for the API's rate limit before every attempt."""
+    async def attempt():
+        await acquire_async(api)
+        return await func(*args, **kwargs)
+    return await acall(api, attempt, policy=policy)
@@ -0,0 +1,250 @@
+"""Cron-style job scheduler running jobs on a shared worker pool."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from config import SCHEDULER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# (name, lowest, highest) for the five fields of a cron expression
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7)  # 0 and 7 are both Sunday
+]
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *'
+}
+
+# Upper bound when counting missed runs, so a long outage stays cheap to report
+MAX_MISSED_COUNT = 1000
+
+def _parse_field(field, low, high):
+    """Parse one cron field (e.g. '*/15', '1-5', '0,30') into a set of values."""
+    values = set()
+    for part in field.split(','):
+        span, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (int(value) for value in span.split('-', 1))
+        else:
+            start = int(span)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field '{field}' (allowed {low}-{high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """A five-field cron expression: minute hour day-of-month month weekday.
+
+    Supports '*', lists, ranges and steps in every field, plus the @hourly,
+    @daily, @weekly and @monthly aliases. Like cron, when both day-of-month
+    and weekday are restricted a time matches if either of them does.
+    """
+
+    def __init__(self, expression):
+        """Parse a cron expression, raising ValueError if it is malformed."""
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression '{expression}' must have {len(CRON_FIELDS)} fields")
+
+        minutes, hours, days, months, weekdays = (
+            _parse_field(field, low, high) for field, (_, low, high) in zip(fields, CRON_FIELDS)
+        )
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        """Check the day-of-month and weekday fields against a datetime."""
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_after(self, moment):
+        """Get the first time strictly after `moment` the schedule fires.
+
+        Args:
+            moment: Naive local datetime
+
+        Returns:
+            Datetime of the next run, at whole-minute precision
+        """
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=5 * 366)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def count_between(self, start, end):
+        """Count the runs strictly after `start` and up to `end` (capped at MAX_MISSED_COUNT)."""
+        count = 0
+        moment = self.next_after(start)
+        while moment <= end and count < MAX_MISSED_COUNT:
+            count += 1
+            moment = self.next_after(moment)
+        return count
+
+class Job:
+    """A scheduled function and its run bookkeeping."""
+
+    def __init__(self, name, func, schedule, next_run):
+        """Initialize a job due at `next_run`."""
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.next_run = next_run
+        self.future = None
+        self.runs = 0
+        self.skipped = 0
+        self.missed = 0
+
+    @property
+    def running(self):
+        """Whether a run of this job is in progress."""
+        return self.future is not None and not self.future.done()
+
+class Scheduler:
+    """Run jobs on cron schedules with a pool of long-lived worker threads.
+
+    Independent jobs run concurrently, while a job that is still running
+    when it comes due again is skipped rather than started twice. When the
+    scheduler falls behind (the process was suspended, or the host slept)
+    each overdue job runs once and the number of missed runs is logged.
+
+    Worker threads live as long as the scheduler, so per-thread API clients
+    (see `connectors.services.build_service`) stay warm between runs; the
+    optional `initializer` runs once in each worker to create them up front.
+    """
+
+    def __init__(self, max_workers=SCHEDULER_WORKERS, initializer=None, clock=datetime.now):
+        """Initialize the scheduler.
+
+        Args:
+            max_workers: Number of worker threads
+            initializer: Callable run once in every worker thread
+            clock: Function returning the current naive local datetime
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='scheduler',
+            initializer=initializer
+        )
+        self._clock = clock
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def jobs(self):
+        """Get the scheduled jobs by name."""
+        return dict(self._jobs)
+
+    def add_job(self, name, func, cron, run_on_start=False):
+        """Schedule a function.
+
+        Args:
+            name: Unique job name used in logs
+            func: Callable taking no arguments
+            cron: Cron expression, e.g. '0 7 * * *'
+            run_on_start: Whether to run the job on the first poll as well
+
+        Returns:
+            The scheduled Job
+        """
+        schedule = CronSchedule(cron)
+        now = self._clock()
+        job = Job(name, func, schedule, now if run_on_start else schedule.next_after(now))
+        with self._lock:
+            self._jobs[name] = job
+        logger.info(f"Scheduled job {name} ({cron}), next run at {job.next_run}")
+        return job
+
+    def _run_job(self, job):
+        """Run one job in a worker thread, logging its duration and errors."""
+        start = time.perf_counter()
+        logger.info(f"Job {job.name} started")
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"Job {job.name} failed: {str(e)}", exc_info=True)
+        finally:
+            job.runs += 1
+            logger.info(f"Job {job.name} finished in {time.perf_counter() - start:.1f}s")
+
+    def run_pending(self):
+        """Start every job that is due.
+
+        Returns:
+            Names of the jobs started
+        """
+        now = self._clock()
+        started = []
+        with self._lock:
+            for job in self._jobs.values():
+                if job.next_run > now:
+                    continue
+
+                missed = job.schedule.count_between(job.next_run, now)
+                if missed:
+                    job.missed += missed
+                    logger.warning(
+                        f"Job {job.name} missed {missed} scheduled run(s) since {job.next_run}; "
+                        f"running once to catch up"
+                    )
+                job.next_run = job.schedule.next_after(now)
+
+                if job.running:
+                    job.skipped += 1
+                    logger.warning(f"Job {job.name} is still running; skipping this run")
+                    continue
+
+                job.future = self._executor.submit(self._run_job, job)
+                started.append(job.name)
+        return started
+
+    def run_forever(self, poll_interval=1.0):
+        """Poll for due jobs until `stop` is called."""
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(poll_interval)
+
+    def stop(self):
+        """Make `run_forever` return after the current poll."""
+        self._stop.set()
+
+    def shutdown(self, wait=True):
+        """Stop polling and release the worker threads.
+
+        Args:
+            wait: Whether to wait for running jobs to finish
+        """
+        self.stop()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,104 @@
+"""Dashboard aggregates read from the precomputed tables of the data store."""
+import pandas as pd
+from storage.parquet_store import PARTITION_COLUMN
+
+EMAIL_COLUMNS = ['sender', 'subject', 'sentiment', 'main_issue', 'product', 'processed_at']
+
+def read_email_counts(store, start_date=None, end_date=None):
+    """Read the per-day email counts of a date range.
+
+    Counts appended by several ingest batches for the same day and value are
+    summed, so every (date, dimension, value) appears once.
+
+    Args:
+        store: ParquetStore to read from
+        start_date: First day to include (inclusive)
+        end_date: Last day to include (inclusive)
+
+    Returns:
+        DataFrame with date, dimension, value and count columns
+    """
+    counts = store.read('email_counts', columns=['dimension', 'value', 'count', PARTITION_COLUMN],
+                        start_date=start_date, end_date=end_date)
+    if counts.empty:
+        return pd.DataFrame(columns=['date', 'dimension', 'value', 'count'])
+    counts = counts.rename(columns={PARTITION_COLUMN: 'date'})
+    counts['date'] = pd.to_datetime(counts['date'])
+    return counts.groupby(['date', 'dimension', 'value'], as_index=False, observed=True)['count'].sum()
+
+def _dimension(counts, dimension):
+    return counts[counts['dimension'] == dimension]
+
+def email_totals(counts):
+    """Get the total, positive and negative email counts.
+
+    Args:
+        counts: DataFrame returned by `read_email_counts`
+
+    Returns:
+        Dictionary with 'total', 'positive' and 'negative' counts
+    """
+    by_sentiment = _dimension(counts, 'sentiment').groupby('value', observed=True)['count'].sum()
+    return {
+        'total': int(by_sentiment.sum()),
+        'positive': int(by_sentiment.get('positive', 0)),
+        'negative': int(by_sentiment.get('negative', 0))
+    }
+
+def weekly_counts(counts, dimension):
+    """Get email counts per week (starting Monday) and value of a dimension.
+
+    Args:
+        counts: DataFrame returned by `read_email_counts`
+        dimension: Counted column, e.g. 'sentiment'
+
+    Returns:
+        DataFrame indexed by week start with one column per value
+    """
+    rows = _dimension(counts, dimension)
+    week = (rows['date'] - pd.to_timedelta(rows['date'].dt.weekday, unit='D')).rename('week')
+    return rows.pivot_table(index=week, columns='value', values='count', aggfunc='sum', fill_value=0)
+
+def top_values(counts, dimension, n=10):
+    """Get the `n` most frequent values of a dimension.
+
+    Args:
+        counts: DataFrame returned by `read_email_counts`
+        dimension: Counted column, e.g. 'main_issue'
+        n: Number of values to return
+
+    Returns:
+        Series of counts indexed by value, most frequent first
+    """
+    totals = _dimension(counts, dimension).groupby('value', observed=True)['count'].sum()
+    return totals.nlargest(n)
+
+def recent_emails(store, n=10, start_date=None, end_date=None):
+    """Read the `n` most recently processed emails of a date range.
+
+    Partitions are read newest first, and only until `n` rows are found.
+
+    Args:
+        store: ParquetStore to read from
+        n: Number of emails to return
+        start_date: First day to include (inclusive)
+        end_date: Last day to include (inclusive)
+
+    Returns:
+        DataFrame of EMAIL_COLUMNS, newest first
+    """
+    start = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else None
+    end = pd.Timestamp(end_date).strftime('%Y-%m-%d') if end_date is not None else None
+    frames = []
+    found = 0
+    for day in sorted(store.partitions('emails'), reverse=True):
+        if (end is not None and day > end) or (start is not None and day < start):
+            continue
+        frame = store.read('emails', columns=EMAIL_COLUMNS, start_date=day, end_date=day)
+        frames.append(frame)
+        found += len(frame)
+        if found >= n:
+            break
+    if not frames:
+        return pd.DataFrame(columns=EMAIL_COLUMNS)
+    return pd.concat(frames, ignore_index=True).nlargest(n, 'processed_at').reset_index(drop=True)
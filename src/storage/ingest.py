@@ -0,0 +1,197 @@
+"""Load data from the connectors into the local data store."""
+import pandas as pd
+from config import SHOPIFY_SYNC_OVERLAP
+from connectors.analytics import get_daily_page_metrics
+from connectors.shopify import iter_orders, iter_products
+
+# Email columns pre-aggregated into `email_counts` at ingest time
+EMAIL_COUNT_DIMENSIONS = ['sentiment', 'main_issue']
+
+def email_counts(emails_df):
+    """Count emails per day and value of every EMAIL_COUNT_DIMENSIONS column.
+
+    Args:
+        emails_df: Rows of the `emails` table
+
+    Returns:
+        DataFrame with date, dimension, value and count columns
+    """
+    dates = pd.to_datetime(emails_df['processed_at']).dt.normalize()
+    counts = []
+    for dimension in EMAIL_COUNT_DIMENSIONS:
+        values = emails_df[dimension].astype('string').fillna('unknown')
+        grouped = values.groupby([dates, values]).size()
+        grouped.index.names = ['date', 'value']
+        counts.append(grouped.rename('count').reset_index().assign(dimension=dimension))
+    return pd.concat(counts, ignore_index=True)[['date', 'dimension', 'value', 'count']]
+
+def ingest_emails(store, emails, parsed_emails, processed_at=None):
+    """Append parsed emails to the `emails` table.
+
+    The per-day counts the dashboard charts are appended to `email_counts`
+    in the same step, so the dashboard never aggregates the email history.
+
+    Args:
+        store: ParquetStore to write to
+        emails: List of dictionaries containing email data
+        parsed_emails: List of dictionaries with extracted information, one per email
+        processed_at: Processing time recorded for every row (defaults to now)
+
+    Returns:
+        Number of rows written
+    """
+    processed_at = processed_at or pd.Timestamp.now()
+    rows = []
+    for email, parsed_data in zip(emails, parsed_emails):
+        rows.append({
+            'message_id': email['id'],
+            'sender': email['sender'],
+            'subject': email['subject'],
+            'customer_name': parsed_data.get('customer_name'),
+            'product': parsed_data.get('product'),
+            'sentiment': parsed_data.get('sentiment'),
+            'main_issue': parsed_data.get('main_issue'),
+            'priority': parsed_data.get('priority'),
+            'processed_at': processed_at
+        })
+    df = pd.DataFrame(rows)
+    written = store.append('emails', df, date_column='processed_at')
+    if written:
+        store.append('email_counts', email_counts(df), date_column='date')
+    return written
+
+def backfill_email_counts(store):
+    """Rebuild `email_counts` from the `emails` table, for stores predating it.
+
+    Args:
+        store: ParquetStore to read from and write to
+
+    Returns:
+        Number of count rows written, 0 if `email_counts` already exists
+    """
+    if store.has_table('email_counts') or not store.has_table('emails'):
+        return 0
+    emails_df = store.read('emails', columns=EMAIL_COUNT_DIMENSIONS + ['processed_at'])
+    return store.append('email_counts', email_counts(emails_df), date_column='date')
+
+def shopify_watermark(store, table, overlap=SHOPIFY_SYNC_OVERLAP):
+    """Get the `updated_at_min` for the next incremental Shopify sync of a table.
+
+    Every row of a sync is stamped with the time the sync started, so a
+    record changed in Shopify while an earlier sync was still paging is
+    fetched again by the next one. `overlap` also covers clock skew between
+    this host and Shopify; records fetched twice are collapsed by
+    `read_latest`.
+
+    Args:
+        store: ParquetStore holding the table
+        table: 'orders' or 'products'
+        overlap: Seconds to sync again before the start of the last sync
+
+    Returns:
+        Timestamp, or None for a full sync if the table is empty
+    """
+    last_sync = store.last_ingested_at(table)
+    if last_sync is None:
+        return None
+    return last_sync - pd.Timedelta(seconds=overlap)
+
+def ingest_orders(store, updated_at_min=None, shop=None):
+    """Stream Shopify orders into the `orders` table, partitioned by creation date.
+
+    Rows are stamped with the start of the sync as `ingested_at`, see
+    `shopify_watermark`.
+
+    Args:
+        store: ParquetStore to write to
+        updated_at_min: Only sync orders updated since this time; None syncs everything
+        shop: Store to read, see `initialize_shopify`
+
+    Returns:
+        Number of rows written
+    """
+    synced_at = pd.Timestamp.now(tz='UTC')
+    written = 0
+    for chunk in iter_orders(updated_at_min=updated_at_min, shop=shop):
+        written += store.append('orders', chunk.assign(ingested_at=synced_at), date_column='created_at')
+    return written
+
+def ingest_products(store, updated_at_min=None, shop=None):
+    """Stream Shopify products and variants into the `products` and `variants` tables.
+
+    Product catalogs are not time series, so rows are partitioned by sync date.
+    Rows are stamped with the start of the sync as `ingested_at`, see
+    `shopify_watermark`.
+
+    Args:
+        store: ParquetStore to write to
+        updated_at_min: Only sync products updated since this time; None syncs everything
+        shop: Store to read, see `initialize_shopify`
+
+    Returns:
+        Number of product rows written
+    """
+    synced_at = pd.Timestamp.now(tz='UTC')
+    written = 0
+    for products, variants in iter_products(updated_at_min=updated_at_min, shop=shop):
+        written += store.append('products', products.assign(ingested_at=synced_at), date=synced_at)
+        store.append('variants', variants.assign(ingested_at=synced_at), date=synced_at)
+    return written
+
+def ingest_page_metrics(store, metrics_df, date):
+    """Append Google Analytics page metrics for one reporting date.
+
+    Args:
+        store: ParquetStore to write to
+        metrics_df: DataFrame returned by `get_page_metrics`
+        date: Date the metrics cover
+
+    Returns:
+        Number of rows written
+    """
+    return store.append('page_metrics', metrics_df, date=date)
+
+def _contiguous_ranges(dates):
+    """Group sorted dates into (start_date, end_date) runs of consecutive days."""
+    ranges = []
+    for date in dates:
+        if ranges and date - ranges[-1][1] == pd.Timedelta(days=1):
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
+    return [(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')) for start, end in ranges]
+
+def ingest_daily_page_metrics(store, service, view_id, start_date, end_date):
+    """Fill the `page_daily` table with per-page totals for completed days.
+
+    Only days without a partition yet are fetched, so keeping a rolling
+    window current costs one day of Analytics data per day. Days must be
+    complete when first ingested, as stored days are never fetched again.
+    Days Analytics returns no rows for are stored as empty partitions, so
+    they are not fetched again either.
+
+    Args:
+        store: ParquetStore to write to
+        service: Google Analytics API service
+        view_id: Analytics view ID
+        start_date: First day to cover
+        end_date: Last day to cover (inclusive)
+
+    Returns:
+        Number of rows written
+    """
+    stored = store.partitions('page_daily')
+    missing = [
+        day for day in pd.date_range(start_date, end_date, freq='D')
+        if day.strftime('%Y-%m-%d') not in stored
+    ]
+    if not missing:
+        return 0
+
+    daily = get_daily_page_metrics(service, view_id, _contiguous_ranges(missing))
+    written = store.append('page_daily', daily, date_column='date')
+    returned = set(pd.to_datetime(daily['date']).dt.strftime('%Y-%m-%d')) if not daily.empty else set()
+    for day in missing:
+        if day.strftime('%Y-%m-%d') not in returned:
+            store.append_empty('page_daily', day)
+    return written
@@ -0,0 +1,310 @@
+"""Local, date-partitioned Parquet store used as the analytics source of truth."""
+import os
+import threading
+import uuid
+import pandas as pd
+from config import DATA_STORE_PATH
+from connectors.sheets import SheetsBatchWriter
+
+PARTITION_COLUMN = 'date'
+INGESTED_AT_COLUMN = 'ingested_at'
+# Marker rewritten on every append, see `ParquetStore.version`; the Parquet
+# reader skips files starting with '_'
+VERSION_FILE = '_version'
+
+# Column dtypes applied on append, so every partition of a table shares a schema
+TABLE_SCHEMAS = {
+    'emails': {
+        'message_id': 'string',
+        'sender': 'string',
+        'subject': 'string',
+        'customer_name': 'string',
+        'product': 'string',
+        'sentiment': 'string',
+        'main_issue': 'string',
+        'priority': 'string',
+        'processed_at': 'datetime64[ns]'
+    },
+    'email_counts': {
+        'dimension': 'string',
+        'value': 'string',
+        'count': 'Int64'
+    },
+    'orders': {
+        'id': 'Int64',
+        'name': 'string',
+        'email': 'string',
+        'created_at': 'datetime64[ns, UTC]',
+        'processed_at': 'datetime64[ns, UTC]',
+        'updated_at': 'datetime64[ns, UTC]',
+        'total_price': 'float64',
+        'subtotal_price': 'float64',
+        'total_tax': 'float64',
+        'currency': 'string',
+        'financial_status': 'string',
+        'fulfillment_status': 'string'
+    },
+    'products': {
+        'id': 'Int64',
+        'title': 'string',
+        'vendor': 'string',
+        'product_type': 'string',
+        'created_at': 'datetime64[ns, UTC]',
+        'updated_at': 'datetime64[ns, UTC]',
+        'published_at': 'datetime64[ns, UTC]',
+        'tags': 'string'
+    },
+    'variants': {
+        'variant_id': 'Int64',
+        'product_id': 'Int64',
+        'price': 'float64',
+        'sku': 'string',
+        'inventory_quantity': 'Int64'
+    },
+    'page_metrics': {
+        'ga:pagePath': 'string',
+        'ga:sessions': 'Int64',
+        'ga:pageviews': 'Int64',
+        'ga:bounceRate': 'float64',
+        'ga:avgSessionDuration': 'float64'
+    },
+    'page_daily': {
+        'ga:pagePath': 'string',
+        'ga:sessions': 'Int64',
+        'ga:pageviews': 'Int64',
+        'ga:bounces': 'Int64',
+        'ga:sessionDuration': 'float64'
+    }
+}
+
+def _coerce(df, schema):
+    """Cast the columns of `df` that appear in `schema` to their declared dtype."""
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column], utc='UTC' in dtype)
+        elif dtype in ('Int64', 'float64'):
+            df[column] = pd.to_numeric(df[column]).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+class ParquetStore:
+    """Append-only tables of typed Parquet files, partitioned by date.
+
+    Each table lives under `<root>/<table>/date=YYYY-MM-DD/`. Every append
+    writes new files, stamped with an `ingested_at` column, so no existing
+    file is ever rewritten. Reads push
+    column selection and date/row predicates down to the Parquet reader, so
+    only the partitions and columns asked for are loaded.
+    """
+
+    def __init__(self, root=DATA_STORE_PATH):
+        """Initialize with the store's root directory."""
+        self.root = root
+        self._lock = threading.Lock()
+
+    def table_path(self, table):
+        """Get the directory holding a table."""
+        return os.path.join(self.root, table)
+
+    def has_table(self, table):
+        """Check whether anything was ever written to a table."""
+        return os.path.isdir(self.table_path(table))
+
+    def partitions(self, table):
+        """Get the set of partition dates (YYYY-MM-DD) a table holds data for."""
+        if not self.has_table(table):
+            return set()
+        prefix = f'{PARTITION_COLUMN}='
+        return {
+            name[len(prefix):]
+            for name in os.listdir(self.table_path(table))
+            if name.startswith(prefix)
+        }
+
+    def append(self, table, df, date_column=None, date=None):
+        """Append rows to a table.
+
+        Args:
+            table: Table name, e.g. 'emails'
+            df: DataFrame of rows to append
+            date_column: Column whose date picks each row's partition
+            date: Partition date for every row, used when `date_column` is None
+
+        Returns:
+            Number of rows written
+        """
+        if df.empty:
+            return 0
+        if date_column is None and date is None:
+            raise ValueError("append needs either date_column or date")
+
+        if INGESTED_AT_COLUMN not in df.columns:
+            df = df.assign(**{INGESTED_AT_COLUMN: pd.Timestamp.now(tz='UTC')})
+        df = _coerce(df, dict(TABLE_SCHEMAS.get(table, {}), **{INGESTED_AT_COLUMN: 'datetime64[ns, UTC]'}))
+        if date_column is not None:
+            partition = pd.to_datetime(df[date_column]).dt.strftime('%Y-%m-%d')
+        else:
+            partition = pd.Timestamp(date).strftime('%Y-%m-%d')
+        df = df.assign(**{PARTITION_COLUMN: partition})
+
+        with self._lock:
+            os.makedirs(self.table_path(table), exist_ok=True)
+            df.to_parquet(self.table_path(table), partition_cols=[PARTITION_COLUMN], index=False)
+            self._bump_version(table)
+        return len(df)
+
+    def append_empty(self, table, date):
+        """Record that a partition date holds no rows.
+
+        Writes a zero-row file with the table's schema, so the date is listed
+        by `partitions` while reads return nothing for it.
+
+        Args:
+            table: Table name
+            date: Partition date known to have no rows
+        """
+        schema = dict(TABLE_SCHEMAS.get(table, {}), **{INGESTED_AT_COLUMN: 'datetime64[ns, UTC]'})
+        df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()})
+        partition = pd.Timestamp(date).strftime('%Y-%m-%d')
+        directory = os.path.join(self.table_path(table), f'{PARTITION_COLUMN}={partition}')
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            df.to_parquet(os.path.join(directory, f'{uuid.uuid4().hex}-0.parquet'), index=False)
+            self._bump_version(table)
+
+    def read(self, table, columns=None, start_date=None, end_date=None, filters=None):
+        """Read rows from a table.
+
+        Args:
+            table: Table name
+            columns: Columns to load, or None for all
+            start_date: First partition date to include (inclusive)
+            end_date: Last partition date to include (inclusive)
+            filters: Extra pyarrow-style row filters, e.g.
+                [('sentiment', '==', 'negative')]
+
+        Returns:
+            Pandas DataFrame, empty if the table does not exist
+        """
+        if not self.has_table(table):
+            return pd.DataFrame(columns=columns)
+
+        predicates = list(filters or [])
+        if start_date is not None:
+            predicates.append((PARTITION_COLUMN, '>=', pd.Timestamp(start_date).strftime('%Y-%m-%d')))
+        if end_date is not None:
+            predicates.append((PARTITION_COLUMN, '<=', pd.Timestamp(end_date).strftime('%Y-%m-%d')))
+
+        df = pd.read_parquet(
+            self.table_path(table),
+            columns=columns,
+            filters=predicates or None
+        )
+        if PARTITION_COLUMN in df.columns:
+            df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype('string')
+        return df
+
+    def read_latest(self, table, key, columns=None, start_date=None, end_date=None, filters=None):
+        """Read a table keeping only the most recently ingested row per key.
+
+        Re-synced records are appended again rather than updated in place,
+        so tables fed by incremental syncs can hold several versions of a row.
+
+        Args:
+            table: Table name
+            key: Column identifying a record, e.g. 'id'
+            columns: Columns to return, or None for all
+            start_date: First partition date to include (inclusive)
+            end_date: Last partition date to include (inclusive)
+            filters: Extra pyarrow-style row filters
+
+        Returns:
+            Pandas DataFrame with one row per key
+        """
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys(list(columns) + [key, INGESTED_AT_COLUMN]))
+        df = self.read(table, read_columns, start_date, end_date, filters)
+        if df.empty or INGESTED_AT_COLUMN not in df.columns:
+            return df
+        df = df.sort_values(INGESTED_AT_COLUMN, kind='stable').drop_duplicates(key, keep='last')
+        return df[columns] if columns is not None else df
+
+    def last_ingested_at(self, table):
+        """Get the latest `ingested_at` timestamp of a table, or None."""
+        df = self.read(table, columns=[INGESTED_AT_COLUMN])
+        if df.empty:
+            return None
+        return df[INGESTED_AT_COLUMN].max()
+
+    def _bump_version(self, table):
+        """Write a new token to a table's version marker."""
+        path = os.path.join(self.table_path(table), VERSION_FILE)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(temp_path, path)
+
+    def version(self, table):
+        """Get a token that changes whenever a table is appended to.
+
+        Reads the table's version marker only, so it costs the same however
+        many files the table holds. Tables written before the marker existed
+        get one on first use.
+
+        Returns:
+            Version string, or None if the table does not exist
+        """
+        path = os.path.join(self.table_path(table), VERSION_FILE)
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            if not self.has_table(table):
+                return None
+        with self._lock:
+            if not os.path.exists(path):
+                self._bump_version(table)
+        with open(path) as f:
+            return f.read()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Get the process-wide data store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ParquetStore()
+        return _store
+
+def export_to_sheets(store, table, service, spreadsheet_id, sheet_range, columns=None,
+                     start_date=None, end_date=None):
+    """Mirror (part of) a store table to Google Sheets.
+
+    Args:
+        store: ParquetStore to read from
+        table: Table name
+        service: Google Sheets API service
+        spreadsheet_id: ID of the spreadsheet
+        sheet_range: Range to write to (e.g., 'Emails!A:F')
+        columns: Columns to export, in sheet order
+        start_date: First partition date to export
+        end_date: Last partition date to export
+
+    Returns:
+        Number of rows exported
+    """
+    df = store.read(table, columns=columns, start_date=start_date, end_date=end_date)
+    if df.empty:
+        return 0
+
+    rows = df.astype(object).where(df.notna(), '').astype(str).values.tolist()
+    with SheetsBatchWriter(service, spreadsheet_id=spreadsheet_id) as writer:
+        writer.add(rows, sheet_range=sheet_range)
+    return len(rows)
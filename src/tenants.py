@@ -0,0 +1,303 @@
+"""Tenant registry and process-pool ingestion runner for many brands on one host.
+
+Each tenant has its own mailbox, Shopify store, Analytics view and
+spreadsheet, and keeps its data store, email work queue and Gmail
+checkpoint under its own directory. Tenants run in a pool of worker
+processes, one tenant at a time per process, so the rate limits a worker
+sets for a tenant apply to that tenant alone. The metrics a worker records
+for a tenant are sent back and merged into the parent's registry with a
+`tenant` label, so the metrics endpoint and snapshots cover every tenant.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from config import TENANTS_PATH, TENANT_DATA_PATH, TENANT_WORKERS, TENANT_RATE_LIMITS, API_RATE_LIMITS
+from connectors.gmail import get_gmail_credentials
+from connectors.analytics import get_analytics_service, get_page_metrics
+from resilience import set_rate_limits
+from storage.parquet_store import ParquetStore
+from storage.ingest import (
+    ingest_orders, ingest_products, ingest_page_metrics, ingest_daily_page_metrics, shopify_watermark
+)
+from work_queue import ACKED, EmailWorkQueue, process_email_queue
+from metrics import increment, get_registry
+
+logger = logging.getLogger(__name__)
+
+# Requests per second allowed per tenant, unless its registry entry overrides them
+DEFAULT_RATE_LIMITS = {**API_RATE_LIMITS, **TENANT_RATE_LIMITS}
+
+TENANT_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def _expand(value):
+    """Expand ${VAR} references in registry values, so secrets can stay in the environment."""
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, dict):
+        return {key: _expand(item) for key, item in value.items()}
+    return value
+
+class Tenant:
+    """One client brand: its data sources, destinations and rate limits."""
+
+    def __init__(self, name, gmail_user=None, spreadsheet_id=None, ga_view_id=None, shopify=None,
+                 google_credentials=None, rate_limits=None, data_dir=None):
+        """Initialize a tenant.
+
+        Args:
+            name: Unique name, used for the data directory and in logs
+            gmail_user: Mailbox to ingest, or None to skip email jobs
+            spreadsheet_id: Spreadsheet mirroring the tenant's emails, if any
+            ga_view_id: Analytics view ID, or None to skip analytics jobs
+            shopify: Dictionary with 'store_url', 'api_key' and 'api_secret',
+                or None to skip Shopify jobs
+            google_credentials: Service account key file, defaulting to
+                GOOGLE_APPLICATION_CREDENTIALS
+            rate_limits: Requests per second per API, merged over DEFAULT_RATE_LIMITS
+            data_dir: Directory for the tenant's store and checkpoints
+        """
+        if not TENANT_NAME.match(name or ''):
+            raise ValueError(f"Invalid tenant name: {name!r}")
+        self.name = name
+        self.gmail_user = gmail_user
+        self.spreadsheet_id = spreadsheet_id
+        self.ga_view_id = ga_view_id
+        self.shopify = shopify
+        self.google_credentials = google_credentials
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.data_dir = data_dir or os.path.join(TENANT_DATA_PATH, name)
+
+    @classmethod
+    def from_dict(cls, entry):
+        """Build a tenant from a registry entry."""
+        return cls(**_expand(entry))
+
+    @property
+    def store_path(self):
+        """Root directory of the tenant's data store."""
+        return os.path.join(self.data_dir, 'store')
+
+    @property
+    def checkpoint_path(self):
+        """Path of the tenant's Gmail history checkpoint."""
+        return os.path.join(self.data_dir, 'gmail_checkpoint.json')
+
+    @property
+    def queue_path(self):
+        """Path of the tenant's email work queue."""
+        return os.path.join(self.data_dir, 'email_queue.sqlite3')
+
+    def store(self):
+        """Get the tenant's data store."""
+        return ParquetStore(self.store_path)
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+def load_tenants(path=TENANTS_PATH):
+    """Load the tenant registry.
+
+    The registry is a JSON or YAML file holding a list of tenants, or a
+    mapping with a 'tenants' list; see `Tenant` for the fields.
+
+    Args:
+        path: Registry file
+
+    Returns:
+        List of Tenant
+
+    Raises:
+        ValueError: If tenant names are invalid or not unique
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            registry = yaml.safe_load(f)
+        else:
+            registry = json.load(f)
+
+    entries = registry.get('tenants', []) if isinstance(registry, dict) else registry
+    tenants = [Tenant.from_dict(entry) for entry in entries]
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError("Tenant names must be unique")
+    return tenants
+
+def sync_tenant_emails(tenant):
+    """Move a tenant's new emails through its durable work queue.
+
+    Returns:
+        Number of emails fully processed in this run
+    """
+    if not tenant.gmail_user:
+        return 0
+    # The service account reads the tenant's mailbox through domain-wide delegation
+    credentials = get_gmail_credentials(tenant.google_credentials, subject=tenant.gmail_user)
+    queue = EmailWorkQueue(tenant.queue_path)
+    try:
+        progress = process_email_queue(
+            credentials, queue, tenant.store(), spreadsheet_id=tenant.spreadsheet_id,
+            credentials_path=tenant.google_credentials, checkpoint_path=tenant.checkpoint_path,
+            user_id=tenant.gmail_user
+        )
+    finally:
+        queue.close()
+    return progress[ACKED]
+
+def sync_tenant_shop(tenant):
+    """Incrementally sync a tenant's Shopify orders and products.
+
+    Returns:
+        Number of order and product rows written
+    """
+    if not tenant.shopify:
+        return 0
+    store = tenant.store()
+    orders = ingest_orders(store, updated_at_min=shopify_watermark(store, 'orders'), shop=tenant.shopify)
+    products = ingest_products(store, updated_at_min=shopify_watermark(store, 'products'), shop=tenant.shopify)
+    return orders + products
+
+def sync_tenant_analytics(tenant):
+    """Store yesterday's Google Analytics page metrics of a tenant.
+
+    Returns:
+        Number of page and daily page rows written
+    """
+    if not tenant.ga_view_id:
+        return 0
+    day = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    service = get_analytics_service(tenant.google_credentials)
+    store = tenant.store()
+    rows = ingest_page_metrics(store, get_page_metrics(service, tenant.ga_view_id, day, day), day)
+    return rows + ingest_daily_page_metrics(store, service, tenant.ga_view_id, day, day)
+
+# Job name -> per-tenant job, run inside a worker process
+TENANT_JOBS = {
+    'process_emails': sync_tenant_emails,
+    'sync_shop_data': sync_tenant_shop,
+    'sync_analytics_data': sync_tenant_analytics
+}
+
+def run_tenant(tenant, jobs):
+    """Run jobs for one tenant under its rate limits. Runs in a worker process.
+
+    A failing job is logged and does not stop the tenant's other jobs. The
+    worker's metrics registry is cleared first, so the snapshot returned
+    only covers this run.
+
+    Args:
+        tenant: Tenant to run
+        jobs: Names of TENANT_JOBS to run, in order
+
+    Returns:
+        Tuple of (dictionary mapping job name to the number of items
+        processed, or to None if the job failed; metrics snapshot)
+    """
+    registry = get_registry()
+    registry.reset()
+    set_rate_limits(tenant.rate_limits)
+    results = {}
+    for job in jobs:
+        try:
+            results[job] = TENANT_JOBS[job](tenant)
+            logger.info(f"[{tenant.name}] {job} completed: {results[job]} items")
+        except Exception as e:
+            results[job] = None
+            logger.error(f"[{tenant.name}] Error in {job}: {str(e)}", exc_info=True)
+    return results, registry.snapshot()
+
+def _copy_outcome(source, target, tenant):
+    """Settle `target` with the outcome of the finished `run_tenant` future `source`.
+
+    The worker's metrics are merged into this process's registry, labelled
+    with the tenant. Runs as a done-callback, where errors would only be
+    logged, so `target` is settled whatever fails; a failed merge loses the
+    metrics but not the results.
+    """
+    try:
+        if source.cancelled():
+            target.cancel()
+            return
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+            return
+        results, snapshot = source.result()
+    except Exception as e:
+        target.set_exception(e)
+        return
+    try:
+        get_registry().merge(snapshot, tenant=tenant.name)
+    except Exception as e:
+        logger.error(f"[{tenant.name}] Error merging worker metrics: {str(e)}", exc_info=True)
+    target.set_result(results)
+
+class TenantRunner:
+    """Run tenant jobs on a persistent pool of worker processes.
+
+    Tenants are spread over the workers as they free up, so one slow tenant
+    does not hold up the others. Work for a tenant that is still running
+    is queued behind it rather than started in a second process, which
+    keeps its rate limits and checkpoints consistent.
+    """
+
+    def __init__(self, tenants, max_workers=TENANT_WORKERS):
+        """Initialize with the tenants to serve and the number of worker processes."""
+        self.tenants = list(tenants)
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        self._tails = {}
+        self._lock = threading.Lock()
+
+    def submit(self, tenant, jobs):
+        """Queue jobs for one tenant behind any of its work still running.
+
+        Returns:
+            concurrent.futures.Future of the job results of `run_tenant`
+        """
+        result = concurrent.futures.Future()
+
+        def start(_=None):
+            try:
+                future = self._executor.submit(run_tenant, tenant, jobs)
+            except RuntimeError as e:  # pool shut down
+                result.set_exception(e)
+                return
+            future.add_done_callback(lambda done: _copy_outcome(done, result, tenant))
+
+        with self._lock:
+            previous = self._tails.get(tenant.name)
+            self._tails[tenant.name] = result
+        if previous is None:
+            start()
+        else:
+            previous.add_done_callback(start)
+        return result
+
+    def run(self, jobs):
+        """Run jobs for every tenant and wait for all of them.
+
+        Args:
+            jobs: Names of TENANT_JOBS to run for each tenant
+
+        Returns:
+            Dictionary mapping tenant name to its job results, see `run_tenant`
+        """
+        futures = {tenant.name: self.submit(tenant, jobs) for tenant in self.tenants}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"[{name}] Tenant worker failed: {str(e)}")
+                results[name] = {job: None for job in jobs}
+            for job, items in results[name].items():
+                increment('tenant_jobs_total', job=job, status='error' if items is None else 'ok')
+        return results
+
+    def shutdown(self):
+        """Stop the worker processes once queued work has finished."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,425 @@
+"""Durable email work queue, so an interrupted run resumes instead of starting over.
+
+Every new Gmail message is recorded in a local SQLite queue and moves
+through the states
+
+    queued -> fetched -> parsed -> written -> acked
+
+one step at a time. A worker claims a batch of messages in one state under a
+lease, does the step, and advances them with its result. If the worker
+dies, its lease runs out and another run picks the messages up where they
+stopped: a message parsed before a crash is not sent to the LLM again, and
+one already written is only marked as read.
+
+`process_email_queue` runs the steps one after the other; the pipelined
+mode in `pipeline` runs them concurrently on the same queue.
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from config import (
+    EMAIL_QUEUE_PATH, EMAIL_QUEUE_BATCH_SIZE, EMAIL_QUEUE_LEASE, EMAIL_QUEUE_MAX_ATTEMPTS, EMAIL_QUEUE_RETRY_DELAY,
+    EMAIL_QUEUE_ACKED_RETENTION, GMAIL_CHECKPOINT_PATH, SPREADSHEET_ID, SHEETS_MIRROR_ENABLED
+)
+from connectors.gmail import (
+    list_new_message_ids, fetch_messages, parse_message, get_gmail_service, save_history_checkpoint,
+    mark_as_read
+)
+from connectors.sheets import get_sheets_service, SheetsBatchWriter
+from processors.email_parser import parse_emails
+from storage.ingest import ingest_emails
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+EMAILS_RANGE = 'Emails!A:F'
+
+QUEUED = 'queued'
+FETCHED = 'fetched'
+PARSED = 'parsed'
+WRITTEN = 'written'
+ACKED = 'acked'
+
+# State -> the state a message moves to once its step is done
+NEXT_STATE = {QUEUED: FETCHED, FETCHED: PARSED, PARSED: WRITTEN, WRITTEN: ACKED}
+
+def build_email_row(email, parsed_data):
+    """Build the Emails sheet row for a parsed email.
+
+    Args:
+        email: Dictionary containing email data
+        parsed_data: Dictionary with information extracted from the email
+
+    Returns:
+        List of cell values
+    """
+    return [
+        email['sender'],
+        email['subject'],
+        parsed_data['sentiment'],
+        parsed_data['main_issue'],
+        parsed_data['product'],
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+class EmailWorkQueue:
+    """SQLite-backed queue of Gmail message IDs and their processing state.
+
+    Claims are leases: a message claimed by one worker is invisible to the
+    others until the worker advances or releases it, or until the lease
+    expires. Only the lease holder can advance a message, so a worker that
+    lost its lease cannot overwrite the work of the one that took over.
+    """
+
+    def __init__(self, path=EMAIL_QUEUE_PATH, lease=EMAIL_QUEUE_LEASE, max_attempts=EMAIL_QUEUE_MAX_ATTEMPTS,
+                 retry_delay=EMAIL_QUEUE_RETRY_DELAY, acked_retention=EMAIL_QUEUE_ACKED_RETENTION, clock=time.time):
+        """Open (or create) the queue database.
+
+        Args:
+            path: SQLite database file
+            lease: Seconds a claim lasts
+            max_attempts: Claims after which a message is parked for inspection
+                instead of being retried
+            retry_delay: Seconds a released message waits before it can be
+                claimed again
+            acked_retention: Seconds an acked message is kept, see `purge_acked`
+            clock: Time source, replaceable in tests
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.acked_retention = acked_retention
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                email TEXT,
+                parsed TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_state ON messages (state, lease_expires)")
+
+    def enqueue(self, message_ids):
+        """Add messages to the queue. Messages already in it are left alone.
+
+        Returns:
+            Number of messages added
+        """
+        now = self._clock()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (message_id, state, updated_at) VALUES (?, ?, ?)",
+                [(message_id, QUEUED, now) for message_id in message_ids]
+            )
+            return self._conn.total_changes - before
+
+    def claim(self, state, limit=EMAIL_QUEUE_BATCH_SIZE):
+        """Lease up to `limit` messages waiting in `state`.
+
+        Returns:
+            List of dictionaries with message_id, attempts (including this
+            claim), and the email and parsed data stored by earlier steps
+        """
+        now = self._clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT message_id, attempts, email, parsed FROM messages
+                    WHERE state = ? AND attempts < ? AND (lease_expires IS NULL OR lease_expires <= ?)
+                    ORDER BY updated_at, message_id LIMIT ?
+                    """,
+                    (state, self.max_attempts, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE messages SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE message_id = ?",
+                    [(self.owner, now + self.lease, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{
+            'message_id': message_id,
+            'attempts': attempts + 1,
+            'email': json.loads(email) if email else None,
+            'parsed': json.loads(parsed) if parsed else None
+        } for message_id, attempts, email, parsed in rows]
+
+    def advance(self, message_id, state, email=None, parsed=None, keep_lease=False):
+        """Move a claimed message out of `state` and end the lease.
+
+        Args:
+            message_id: Message claimed by this queue
+            state: State the message was claimed in
+            email: Fetched email to store, when leaving QUEUED
+            parsed: Extracted information to store, when leaving FETCHED
+            keep_lease: Keep the message claimed in its new state, with a
+                fresh lease counting as its first claim there, for a worker
+                that carries on with the next step itself
+
+        Returns:
+            True, or False if the lease was lost and the result is discarded
+        """
+        next_state = NEXT_STATE[state]
+        now = self._clock()
+        if keep_lease and next_state != ACKED:
+            assignments = ["state = ?", "lease_expires = ?", "attempts = 1", "error = NULL", "updated_at = ?"]
+            values = [next_state, now + self.lease, now]
+        else:
+            assignments = ["state = ?", "lease_owner = NULL", "lease_expires = NULL", "attempts = 0",
+                           "error = NULL", "updated_at = ?"]
+            values = [next_state, now]
+        if email is not None:
+            assignments.append("email = ?")
+            values.append(json.dumps(email))
+        if parsed is not None:
+            assignments.append("parsed = ?")
+            values.append(json.dumps(parsed))
+        if next_state == ACKED:
+            # Done for good; only the ID is kept, to ignore the message if it is listed again
+            assignments += ["email = NULL", "parsed = NULL"]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE messages SET {', '.join(assignments)} "
+                "WHERE message_id = ? AND state = ? AND lease_owner = ?",
+                values + [message_id, state, self.owner]
+            )
+        return cursor.rowcount == 1
+
+    def release(self, message_id, error=None):
+        """End the lease on a message without advancing it, so it is retried after `retry_delay`.
+
+        Args:
+            message_id: Message claimed by this queue
+            error: Description of the failure, kept for inspection
+        """
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET lease_owner = NULL, lease_expires = ?, error = ?, updated_at = ? "
+                "WHERE message_id = ? AND lease_owner = ?",
+                (now + self.retry_delay, error, now, message_id, self.owner)
+            )
+
+    def purge_acked(self):
+        """Delete messages acked more than `acked_retention` seconds ago.
+
+        Acked messages are only kept so that Gmail listing them again does not
+        queue them twice, which can only happen within its history window.
+
+        Returns:
+            Number of messages deleted
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM messages WHERE state = ? AND updated_at <= ?",
+                (ACKED, self._clock() - self.acked_retention)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Count messages per state, plus those parked after too many attempts.
+
+        Returns:
+            Dictionary mapping state (and 'parked') to a count
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall()
+            parked = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE state != ? AND attempts >= ?", (ACKED, self.max_attempts)
+            ).fetchone()[0]
+        counts = {state: 0 for state in (QUEUED, FETCHED, PARSED, WRITTEN, ACKED)}
+        counts.update(dict(rows))
+        counts['parked'] = parked
+        return counts
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+_work_queue = None
+_work_queue_lock = threading.Lock()
+
+def get_work_queue():
+    """Get the process-wide email work queue."""
+    global _work_queue
+    with _work_queue_lock:
+        if _work_queue is None:
+            _work_queue = EmailWorkQueue()
+        return _work_queue
+
+def enqueue_new_messages(credentials, queue, checkpoint_path=GMAIL_CHECKPOINT_PATH, user_id=None):
+    """Queue the messages received since the Gmail checkpoint, then move the checkpoint on.
+
+    Messages are recorded before the checkpoint advances, so the checkpoint
+    can move on right away.
+
+    Returns:
+        Number of messages added to the queue
+    """
+    message_ids, history_id = list_new_message_ids(credentials, checkpoint_path, user_id=user_id)
+    added = queue.enqueue(message_ids)
+    save_history_checkpoint(history_id, checkpoint_path)
+    logger.info(f"Queued {added} new emails")
+    return added
+
+def release_all(queue, items, error):
+    """Release claimed items after a failed step, so they are retried later."""
+    for item in items:
+        queue.release(item['message_id'], str(error))
+
+def advance_item(queue, item, state, keep_lease=False, **payload):
+    """Advance one claimed item, storing `payload` in the queue and on the item.
+
+    Returns:
+        The advanced item, or None if the lease was lost and the result is
+        discarded
+    """
+    if not queue.advance(item['message_id'], state, keep_lease=keep_lease, **payload):
+        logger.warning(f"Lost the lease on message {item['message_id']}, result discarded")
+        return None
+    item = dict(item, **payload)
+    if keep_lease:
+        item['attempts'] = 1
+    return item
+
+def _advance_all(queue, items, state, keep_lease=False, **payloads):
+    """Advance claimed items, returning those whose lease was still held."""
+    advanced = []
+    for i, item in enumerate(items):
+        item = advance_item(queue, item, state, keep_lease, **{key: value[i] for key, value in payloads.items()})
+        if item is not None:
+            advanced.append(item)
+    increment('email_queue_steps_total', len(advanced), state=NEXT_STATE[state])
+    return advanced
+
+def fetch_step(queue, credentials, items, user_id=None, keep_lease=False):
+    """Fetch claimed QUEUED items from Gmail; items that fail to fetch are released.
+
+    Returns:
+        The fetched items, with their email, advanced to FETCHED
+    """
+    messages = fetch_messages(get_gmail_service(credentials), [item['message_id'] for item in items],
+                              user_id=user_id)
+    emails = {email['id']: email for email in map(parse_message, messages)}
+    fetched = [item for item in items if item['message_id'] in emails]
+    release_all(queue, [item for item in items if item['message_id'] not in emails], "fetch failed")
+    return _advance_all(queue, fetched, QUEUED, keep_lease, email=[emails[item['message_id']] for item in fetched])
+
+def _parse_step(queue, items):
+    parsed_emails = parse_emails([item['email'] for item in items])
+    return _advance_all(queue, items, FETCHED, parsed=parsed_emails)
+
+def write_step(queue, store, items, spreadsheet_id=SPREADSHEET_ID, credentials_path=None, keep_lease=False):
+    """Write parsed emails to the store and the Sheets mirror.
+
+    A message claimed again after a failed write may already be in the
+    store, so retried messages are looked up first and only appended if
+    missing. Sheets rows carry no message ID; they are appended before the
+    messages are marked written, so a crash can repeat at most the rows of
+    the batch whose append was in flight.
+
+    Returns:
+        The items advanced to WRITTEN
+    """
+    retried = [item['message_id'] for item in items if item['attempts'] > 1]
+    stored = set()
+    if retried:
+        stored = set(store.read('emails', columns=['message_id'],
+                                filters=[('message_id', 'in', retried)])['message_id'])
+    new = [item for item in items if item['message_id'] not in stored]
+    if new:
+        ingest_emails(store, [item['email'] for item in new], [item['parsed'] for item in new])
+
+    if SHEETS_MIRROR_ENABLED and spreadsheet_id:
+        with SheetsBatchWriter(get_sheets_service(credentials_path), spreadsheet_id=spreadsheet_id) as writer:
+            for item in items:
+                writer.add(build_email_row(item['email'], item['parsed']), sheet_range=EMAILS_RANGE)
+    return _advance_all(queue, items, PARSED, keep_lease)
+
+def ack_step(queue, credentials, items, user_id=None):
+    """Mark written items as read in Gmail.
+
+    Returns:
+        The items advanced to ACKED
+    """
+    if not items:
+        return []
+    mark_as_read(credentials, [item['message_id'] for item in items], user_id=user_id)
+    return _advance_all(queue, items, WRITTEN)
+
+def process_email_queue(credentials, queue, store, spreadsheet_id=SPREADSHEET_ID, credentials_path=None,
+                        checkpoint_path=GMAIL_CHECKPOINT_PATH, user_id=None, batch_size=EMAIL_QUEUE_BATCH_SIZE):
+    """Queue new Gmail messages and move every queued message as far as it goes.
+
+    New message IDs are recorded before the Gmail checkpoint advances, so the
+    checkpoint can move on right away. Each step then works in batches of
+    claimed messages: fetch, parse, write to the store (and Sheets), and
+    finally mark as read in Gmail, which only happens once the write has
+    succeeded. A failing batch is released for a later run and the
+    remaining steps carry on with the messages that are ready. Messages
+    acked longer ago than the queue's retention are deleted.
+
+    Args:
+        credentials: Google API credentials for Gmail
+        queue: EmailWorkQueue to work from
+        store: ParquetStore to write to
+        spreadsheet_id: Spreadsheet mirroring the emails, or None for none
+        credentials_path: Service account key file for Sheets
+        checkpoint_path: Path of the Gmail checkpoint file
+        user_id: Mailbox to read, defaulting to GMAIL_USER
+
+    Returns:
+        Dictionary mapping each state reached to the number of messages
+        that reached it in this run
+    """
+    enqueue_new_messages(credentials, queue, checkpoint_path, user_id)
+    queue.purge_acked()
+
+    steps = [
+        (QUEUED, lambda items: fetch_step(queue, credentials, items, user_id)),
+        (FETCHED, lambda items: _parse_step(queue, items)),
+        (PARSED, lambda items: write_step(queue, store, items, spreadsheet_id, credentials_path)),
+        (WRITTEN, lambda items: ack_step(queue, credentials, items, user_id))
+    ]
+    progress = {NEXT_STATE[state]: 0 for state, _ in steps}
+    for state, step in steps:
+        while True:
+            items = queue.claim(state, batch_size)
+            if not items:
+                break
+            try:
+                progress[NEXT_STATE[state]] += len(step(items))
+            except Exception as e:
+                logger.error(f"Email queue step from {state} failed for {len(items)} messages: {str(e)}")
+                release_all(queue, items, e)
+                increment('email_queue_failures_total', len(items), state=state)
+                break
+    return progress
@@ -1,13 +1,17 @@
 """Tests for agents."""
 import unittest
 from unittest.mock import patch, MagicMock
+import asyncio
+import threading
 import sys
 import os
+import pandas as pd
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.agents.decision_agent import create_analysis_agent, generate_recommendation
+from src.agents.tools import GoogleSheetsTool, EmailAnalysisTool
 
 class TestDecisionAgent(unittest.TestCase):
     """Tests for decision agent."""
@@ -52,5 +56,44 @@ class TestDecisionAgent(unittest.TestCase):
         mock_llm.generate.assert_called_once()
         self.assertEqual(result, "Improve the product page")
 
+class TestToolsAsync(unittest.TestCase):
+    """Tests for async tool execution."""
+    
+    @patch('src.connectors.sheets.read_from_sheets')
+    def test_sheets_tools_run_concurrently(self, mock_read):
+        """Test _arun calls on different services overlap on the shared executor."""
+        # Both reads must be in flight at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        
+        def read(service, sheet_range):
+            barrier.wait()
+            return pd.DataFrame({'range': [sheet_range]})
+        mock_read.side_effect = read
+        
+        tools = [GoogleSheetsTool(MagicMock()), GoogleSheetsTool(MagicMock())]
+        
+        async def run_both():
+            return await asyncio.gather(
+                tools[0].arun({'sheet_range': 'A!A:B'}),
+                tools[1].arun({'sheet_range': 'B!A:B'})
+            )
+        results = asyncio.run(run_both())
+        
+        # Assert
+        self.assertIn('A!A:B', results[0])
+        self.assertIn('B!A:B', results[1])
+    
+    @patch('src.processors.email_parser.aparse_email_content')
+    def test_email_tool_arun(self, mock_parse):
+        """Test EmailAnalysisTool awaits the async parser."""
+        async def parse(body):
+            return {'sentiment': 'positive'}
+        mock_parse.side_effect = parse
+        
+        result = asyncio.run(EmailAnalysisTool().arun({'email_body': 'Great product'}))
+        
+        mock_parse.assert_called_once_with('Great product')
+        self.assertEqual(result, str({'sentiment': 'positive'}))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""Smoke test for the offline benchmarks."""
+import unittest
+import subprocess
+import sys
+import os
+import json
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestBenchmarks(unittest.TestCase):
+    """Tests for the benchmark harness."""
+
+    def test_benchmarks_run_at_smallest_scale(self):
+        """Test every benchmark runs against the replayed fixtures and results are saved."""
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run', '--scales', '1', '--repeat', '1', '--output', output],
+                cwd=REPO_ROOT, check=True, capture_output=True, timeout=300
+            )
+            with open(output) as f:
+                results = json.load(f)['results']
+
+        names = {result['name'] for result in results}
+        self.assertIn('process_emails', names)
+        self.assertIn('identify_underperforming_pages', names)
+        self.assertTrue(all(result['median_seconds'] > 0 for result in results))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,49 @@
 """Tests for connectors."""
 import unittest
 from unittest.mock import patch, MagicMock
+import base64
 import sys
 import os
+import tempfile
+import threading
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.connectors.gmail import get_unread_emails
-from src.connectors.sheets import read_from_sheets, write_to_sheets
+from googleapiclient.errors import HttpError
+from src.connectors.gmail import (
+    get_unread_emails, mark_as_read, get_gmail_credentials, sync_new_emails, save_history_checkpoint, load_history_checkpoint
+)
+from src.connectors.email_body import extract_body, clean_body, html_to_text
+from src.connectors.services import get_service, build_service, clear_services
+from src.connectors.sheets import read_from_sheets, write_to_sheets, SheetsBatchWriter
+from src.connectors.shopify import iter_orders, iter_products
+from src.connectors.analytics import get_page_metrics, get_reports, get_daily_page_metrics
+
+class FakeBatch:
+    """Stand-in for a googleapiclient BatchHttpRequest that runs requests in turn."""
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        for request_id, request in self.requests:
+            self.callback(request_id, request.execute(), None)
 
 class TestGmailConnector(unittest.TestCase):
     """Tests for Gmail connector."""
     
-    @patch('src.connectors.gmail.build')
+    @patch('src.connectors.gmail.build_service')
     def test_get_unread_emails(self, mock_build):
         """Test get_unread_emails."""
         # Setup mock
         mock_gmail = MagicMock()
         mock_build.return_value = mock_gmail
+        mock_gmail.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
         
         mock_messages_list = MagicMock()
         mock_gmail.users().messages().list.return_value = mock_messages_list
@@ -68,11 +93,245 @@ class TestGmailConnector(unittest.TestCase):
         self.assertEqual(emails[1]['subject'], 'Test Subject 2')
         self.assertEqual(emails[1]['sender'], 'test2@example.com')
         self.assertEqual(emails[1]['body'], 'Test body 2')
+        self.assertEqual(mock_gmail.new_batch_http_request.call_count, 1)
+    
+    @patch('src.connectors.gmail.build_service')
+    def test_get_unread_emails_paginates(self, mock_build):
+        """Test get_unread_emails follows pageToken when max_results is None."""
+        # Setup mock
+        mock_gmail = MagicMock()
+        mock_build.return_value = mock_gmail
+        mock_gmail.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+        
+        mock_gmail.users().messages().list().execute.side_effect = [
+            {'messages': [{'id': '1'}, {'id': '2'}], 'nextPageToken': 'next'},
+            {'messages': [{'id': '3'}]}
+        ]
+        mock_gmail.users().messages().get().execute.side_effect = [
+            {
+                'id': message_id,
+                'payload': {
+                    'headers': [{'name': 'Subject', 'value': f'Subject {message_id}'}],
+                    'body': {'data': 'VGVzdCBib2R5IDE='}
+                }
+            }
+            for message_id in ['1', '2', '3']
+        ]
+        
+        # Run test
+        emails = get_unread_emails(MagicMock(), max_results=None)
+        
+        # Assert
+        self.assertEqual([email['id'] for email in emails], ['1', '2', '3'])
+        page_tokens = [c.kwargs.get('pageToken') for c in mock_gmail.users().messages().list.call_args_list if c.kwargs]
+        self.assertEqual(page_tokens, [None, 'next'])
+    
+    @patch('src.connectors.gmail.build_service')
+    def test_mark_as_read(self, mock_build):
+        """Test mark_as_read uses a single batchModify call."""
+        # Setup mock
+        mock_gmail = MagicMock()
+        mock_build.return_value = mock_gmail
+        
+        # Run test
+        mark_as_read(MagicMock(), ['1', '2', '3'])
+        
+        # Assert
+        mock_gmail.users().messages().batchModify.assert_called_once()
+        body = mock_gmail.users().messages().batchModify.call_args.kwargs['body']
+        self.assertEqual(body['ids'], ['1', '2', '3'])
+        self.assertEqual(body['removeLabelIds'], ['UNREAD'])
+
+    @patch('src.connectors.services.service_account.Credentials.from_service_account_file')
+    def test_gmail_credentials_can_mark_as_read(self, mock_from_file):
+        """Test the credentials used to acknowledge emails carry a scope that allows batchModify."""
+        clear_services()
+        self.addCleanup(clear_services)
+
+        get_gmail_credentials('key.json', subject='support@acme.example')
+
+        scopes = mock_from_file.call_args.kwargs['scopes']
+        self.assertIn('https://www.googleapis.com/auth/gmail.modify', scopes)
+        self.assertNotIn('https://www.googleapis.com/auth/gmail.readonly', scopes)
+        mock_from_file.return_value.with_subject.assert_called_once_with('support@acme.example')
+
+    @patch('src.connectors.gmail.build_service')
+    def test_sync_new_emails_from_checkpoint(self, mock_build):
+        """Test sync_new_emails only fetches messages from history.list."""
+        # Setup mock
+        mock_gmail = MagicMock()
+        mock_build.return_value = mock_gmail
+        mock_gmail.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+        
+        mock_gmail.users().history().list().execute.return_value = {
+            'history': [
+                {'messagesAdded': [{'message': {'id': '7'}}]},
+                {'messagesAdded': [{'message': {'id': '7'}}, {'message': {'id': '8'}}]}
+            ],
+            'historyId': '200'
+        }
+        mock_gmail.users().messages().get().execute.side_effect = [
+            {'id': '7', 'payload': {'headers': [], 'body': {'data': 'VGVzdCBib2R5IDE='}}},
+            {'id': '8', 'payload': {'headers': [], 'body': {'data': 'VGVzdCBib2R5IDI='}}}
+        ]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, 'checkpoint.json')
+            save_history_checkpoint('100', checkpoint)
+            
+            # Run test
+            emails, history_id = sync_new_emails(MagicMock(), checkpoint_path=checkpoint)
+            
+            # Assert
+            self.assertEqual([email['id'] for email in emails], ['7', '8'])
+            self.assertEqual(history_id, '200')
+            self.assertEqual(load_history_checkpoint(checkpoint), '100')
+            mock_gmail.users().messages().list.assert_not_called()
+    
+    @patch('src.connectors.gmail.build_service')
+    def test_sync_new_emails_expired_checkpoint(self, mock_build):
+        """Test sync_new_emails falls back to a bounded scan on an expired historyId."""
+        # Setup mock
+        mock_gmail = MagicMock()
+        mock_build.return_value = mock_gmail
+        mock_gmail.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+        
+        mock_gmail.users().history().list().execute.side_effect = HttpError(MagicMock(status=404), b'')
+        mock_gmail.users().getProfile().execute.return_value = {'historyId': '300'}
+        mock_gmail.users().messages().list().execute.return_value = {'messages': []}
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, 'checkpoint.json')
+            save_history_checkpoint('1', checkpoint)
+            
+            # Run test
+            emails, history_id = sync_new_emails(MagicMock(), checkpoint_path=checkpoint, full_scan_limit=50)
+        
+        # Assert
+        self.assertEqual(emails, [])
+        self.assertEqual(history_id, '300')
+        self.assertEqual(mock_gmail.users().messages().list.call_args.kwargs['maxResults'], 50)
+
+def encode_part(mime_type, text, **extra):
+    """Build a Gmail payload part holding `text`."""
+    return dict({'mimeType': mime_type,
+                 'body': {'data': base64.urlsafe_b64encode(text.encode('utf-8')).decode()}}, **extra)
+
+class TestEmailBody(unittest.TestCase):
+    """Tests for email body extraction and cleaning."""
+    
+    def test_extract_body_walks_nested_parts(self):
+        """Test plain text is found below nested multiparts and attachments are skipped."""
+        payload = {'mimeType': 'multipart/mixed', 'parts': [
+            {'mimeType': 'multipart/related', 'parts': [
+                {'mimeType': 'multipart/alternative', 'parts': [
+                    encode_part('text/plain', 'My order arrived broken.'),
+                    encode_part('text/html', '<p>My order arrived <b>broken</b>.</p>')
+                ]}
+            ]},
+            encode_part('text/plain', 'photo bytes', filename='photo.txt'),
+            {'mimeType': 'image/png', 'filename': 'photo.png', 'body': {'attachmentId': 'a1'}}
+        ]}
+        
+        self.assertEqual(extract_body(payload), 'My order arrived broken.')
+    
+    def test_extract_body_falls_back_to_html(self):
+        """Test HTML-only mail is converted to text without scripts, styles or entities."""
+        html = ('<html><head><style>p {color: red}</style></head><body>'
+                '<p>Hi&nbsp;team,</p><div>The <a href="#">Widget&amp;Co</a> charger is missing.</div>'
+                '<ul><li>Order 1042</li></ul><script>track()</script></body></html>')
+        payload = {'mimeType': 'multipart/alternative', 'parts': [encode_part('text/html', html)]}
+        
+        self.assertEqual(extract_body(payload),
+                         'Hi team,\nThe Widget&Co charger is missing.\n- Order 1042')
+    
+    def test_clean_body_strips_quotes_and_signature(self):
+        """Test quoted replies, signature details and disclaimers are removed, the name kept."""
+        body = (
+            "The replacement still doesn't charge.\n\n"
+            "-- \nDana Lee\nHead of Ops, Example Corp\n+1 555 0100\n\n"
+            "On Tue, Mar 5, 2024 at 10:00 AM Support <support@shop.example.com> wrote:\n"
+            "> Sorry to hear that, we sent a replacement.\n"
+        )
+        html = ('<div>Still broken.</div><div class="gmail_quote">'
+                '<blockquote>Have you tried charging it overnight?</blockquote></div>'
+                '<p>CONFIDENTIALITY NOTICE: this message is private.</p>')
+        
+        self.assertEqual(clean_body(body), "The replacement still doesn't charge.\n\nDana Lee")
+        self.assertEqual(clean_body(html_to_text(html)), 'Still broken.')
+    
+    def test_clean_body_keeps_forwarded_content(self):
+        """Test a bare forward keeps the forwarded message, as there is nothing else."""
+        body = ("---------- Forwarded message ---------\n"
+                "From: Sam <sam@example.com>\n\n"
+                "The discount code does not work.")
+        
+        self.assertEqual(clean_body(body), body)
+    
+    def test_clean_body_keeps_forward_below_a_comment(self):
+        """Test a forward with a comment above it keeps the forwarded customer email."""
+        body = ("FYI, see below\n\n"
+                "-- \nAlex\nSupport lead\n\n"
+                "---------- Forwarded message ---------\n"
+                "From: Sam <sam@example.com>\n"
+                "Date: Mon, Mar 4, 2024 at 9:00 AM\n"
+                "Subject: Discount\n\n"
+                "The discount code does not work.")
+        
+        self.assertEqual(clean_body(body), "FYI, see below\n\nAlex\n" + body[body.index('----------'):])
+    
+    def test_clean_body_keeps_inline_reply_context(self):
+        """Test quotes answered inline are kept, while the trailing quote is removed."""
+        body = ("> Which model did you order?\n"
+                "Widget X.\n\n"
+                "> Is it charging at all?\n"
+                "No, the light stays off.\n\n"
+                "> Thanks, Support\n"
+                "> Order 1042")
+        
+        self.assertEqual(clean_body(body), body[:body.index('\n\n> Thanks')])
+
+class TestServiceRegistry(unittest.TestCase):
+    """Tests for the shared Google API service registry."""
+    
+    def setUp(self):
+        clear_services()
+        self.addCleanup(clear_services)
+    
+    @patch('src.connectors.services.build')
+    @patch('src.connectors.services.service_account.Credentials.from_service_account_file')
+    def test_get_service_is_cached(self, mock_from_file, mock_build):
+        """Test credentials and services are built once per key."""
+        # Run test
+        first = get_service('sheets', 'v4', ['scope-b', 'scope-a'])
+        second = get_service('sheets', 'v4', ['scope-a', 'scope-b'])
+        other = get_service('gmail', 'v1', ['scope-a', 'scope-b'])
+        
+        # Assert
+        mock_from_file.assert_called_once()
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertIs(first, second)
+        self.assertEqual(mock_build.call_args_list[1].args[:2], ('gmail', 'v1'))
+        self.assertIsNotNone(other)
+    
+    @patch('src.connectors.services.build')
+    def test_build_service_per_thread(self, mock_build):
+        """Test each thread gets its own service instance."""
+        mock_build.side_effect = lambda *args, **kwargs: MagicMock()
+        credentials = MagicMock()
+        
+        services = []
+        thread = threading.Thread(target=lambda: services.append(build_service('gmail', 'v1', credentials)))
+        thread.start()
+        thread.join()
+        
+        self.assertIs(build_service('gmail', 'v1', credentials), build_service('gmail', 'v1', credentials))
+        self.assertIsNot(services[0], build_service('gmail', 'v1', credentials))
 
 class TestSheetsConnector(unittest.TestCase):
     """Tests for Google Sheets connector."""
     
-    @patch('src.connectors.sheets.build')
+    @patch('src.connectors.sheets.get_service')
     def test_read_from_sheets(self, mock_build):
         """Test read_from_sheets."""
         # Setup mock
@@ -99,7 +358,7 @@ class TestSheetsConnector(unittest.TestCase):
         self.assertEqual(df.iloc[0, 0], 'Value1')
         self.assertEqual(df.iloc[1, 2], 'Value6')
     
-    @patch('src.connectors.sheets.build')
+    @patch('src.connectors.sheets.get_service')
     def test_write_to_sheets(self, mock_build):
         """Test write_to_sheets."""
         # Setup mock
@@ -118,6 +377,244 @@ class TestSheetsConnector(unittest.TestCase):
         # Assert
         mock_sheets.spreadsheets().values().append.assert_called_once()
         self.assertEqual(result['updates']['updatedRows'], 1)
+    
+    def test_batch_writer_groups_rows_per_range(self):
+        """Test SheetsBatchWriter flushes one append per range on exit."""
+        # Setup mock
+        mock_sheets = MagicMock()
+        
+        # Run test
+        with SheetsBatchWriter(mock_sheets, 'test_id', max_rows=100) as writer:
+            writer.add(['a', '1'], sheet_range='Emails!A:B')
+            writer.add(['b', '2'], sheet_range='Emails!A:B')
+            writer.add(['c', '3'], sheet_range='Reviews!A:B')
+            mock_sheets.spreadsheets().values().append.assert_not_called()
+        
+        # Assert
+        calls = mock_sheets.spreadsheets().values().append.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0].kwargs['range'], 'Emails!A:B')
+        self.assertEqual(calls[0].kwargs['body'], {'values': [['a', '1'], ['b', '2']]})
+        self.assertEqual(calls[1].kwargs['body'], {'values': [['c', '3']]})
+    
+    def test_batch_writer_flushes_at_max_rows(self):
+        """Test SheetsBatchWriter flushes once the row threshold is reached."""
+        mock_sheets = MagicMock()
+        writer = SheetsBatchWriter(mock_sheets, 'test_id', max_rows=2)
+        
+        writer.add(['a'], sheet_range='Emails!A:A')
+        mock_sheets.spreadsheets().values().append.assert_not_called()
+        writer.add(['b'], sheet_range='Emails!A:A')
+        mock_sheets.spreadsheets().values().append.assert_called_once()
+    
+    @patch('src.connectors.sheets.time.sleep')
+    def test_batch_writer_retries_rate_limits(self, mock_sleep):
+        """Test SheetsBatchWriter retries 429 responses with backoff."""
+        mock_sheets = MagicMock()
+        mock_append = mock_sheets.spreadsheets().values().append.return_value
+        mock_append.execute.side_effect = [
+            HttpError(MagicMock(status=429), b''),
+            HttpError(MagicMock(status=429), b''),
+            {'updates': {'updatedRows': 1}}
+        ]
+        
+        writer = SheetsBatchWriter(mock_sheets, 'test_id', backoff=0.5)
+        writer.add(['a'], sheet_range='Emails!A:A')
+        results = writer.flush()
+        
+        self.assertEqual(results, [{'updates': {'updatedRows': 1}}])
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertGreaterEqual(mock_sleep.call_args_list[1].args[0], 1.0)
+
+def make_report(dimensions, metrics, rows, next_page_token=None):
+    """Build a Reporting API v4 report with one date range per row value list."""
+    report = {
+        'columnHeader': {
+            'dimensions': dimensions,
+            'metricHeader': {'metricHeaderEntries': [{'name': name, 'type': kind} for name, kind in metrics]}
+        },
+        'data': {
+            'rows': [
+                {'dimensions': dims, 'metrics': [{'values': values} for values in ranges]}
+                for dims, ranges in rows
+            ]
+        }
+    }
+    if next_page_token:
+        report['nextPageToken'] = next_page_token
+    return report
+
+PAGE_METRIC_TYPES = [
+    ('ga:sessions', 'INTEGER'),
+    ('ga:pageviews', 'INTEGER'),
+    ('ga:bounceRate', 'PERCENT'),
+    ('ga:avgSessionDuration', 'TIME')
+]
+
+class TestAnalyticsConnector(unittest.TestCase):
+    """Tests for Google Analytics connector."""
+    
+    def test_get_page_metrics_paginates(self):
+        """Test get_page_metrics follows nextPageToken and types columns."""
+        # Setup mock
+        mock_service = MagicMock()
+        mock_service.reports().batchGet().execute.side_effect = [
+            {'reports': [make_report(['ga:pagePath'], PAGE_METRIC_TYPES,
+                                     [(['/home'], [['100', '150', '40.5', '62.25']])], 'next')]},
+            {'reports': [make_report(['ga:pagePath'], PAGE_METRIC_TYPES,
+                                     [(['/about'], [['10', '12', '80', '5']])])]}
+        ]
+        
+        # Run test
+        df = get_page_metrics(mock_service, '123', '2024-01-01', '2024-01-31')
+        
+        # Assert
+        self.assertEqual(list(df['ga:pagePath']), ['/home', '/about'])
+        self.assertEqual(df['ga:sessions'].dtype, 'int64')
+        self.assertEqual(df['ga:bounceRate'].dtype, 'float64')
+        self.assertEqual(df['ga:avgSessionDuration'][0], 62.25)
+        second_body = mock_service.reports().batchGet.call_args_list[-1].kwargs['body']
+        self.assertEqual(second_body['reportRequests'][0]['pageToken'], 'next')
+    
+    def test_get_reports_packs_ranges_and_specs(self):
+        """Test date ranges go two per request and specs share a batchGet."""
+        mock_service = MagicMock()
+        
+        def batch_get(body):
+            request = MagicMock()
+            request.execute.return_value = {'reports': [
+                make_report(
+                    [d['name'] for d in report_request['dimensions']],
+                    [(m['expression'], 'INTEGER') for m in report_request['metrics']],
+                    [(['x'], [['1'] for _ in report_request['dateRanges']])]
+                )
+                for report_request in body['reportRequests']
+            ]}
+            return request
+        mock_service.reports().batchGet.side_effect = batch_get
+        
+        date_ranges = [('2024-01-01', '2024-01-31'), ('2024-02-01', '2024-02-29'), ('2024-03-01', '2024-03-31')]
+        specs = [
+            {'metrics': ['ga:sessions'], 'dimensions': ['ga:pagePath']},
+            {'metrics': ['ga:users'], 'dimensions': ['ga:deviceCategory']}
+        ]
+        
+        # Run test
+        pages, devices = get_reports(mock_service, '123', date_ranges, specs)
+        
+        # Assert
+        self.assertEqual(mock_service.reports().batchGet.call_count, 2)
+        self.assertEqual(list(pages['start_date']), [start for start, _ in date_ranges])
+        self.assertEqual(list(devices.columns), ['ga:deviceCategory', 'ga:users', 'start_date', 'end_date'])
+
+    def test_get_daily_page_metrics(self):
+        """Test daily totals come back with ISO dates, one row per page and day."""
+        mock_service = MagicMock()
+        mock_service.reports().batchGet().execute.return_value = {'reports': [make_report(
+            ['ga:date', 'ga:pagePath'],
+            [('ga:sessions', 'INTEGER'), ('ga:pageviews', 'INTEGER'),
+             ('ga:bounces', 'INTEGER'), ('ga:sessionDuration', 'TIME')],
+            [(['20240301', '/home'], [['10', '20', '5', '600']]),
+             (['20240302', '/home'], [['8', '12', '2', '300']])]
+        )]}
+        
+        df = get_daily_page_metrics(mock_service, '123', [('2024-03-01', '2024-03-02')])
+        
+        self.assertEqual(list(df.columns), ['date', 'ga:pagePath', 'ga:sessions', 'ga:pageviews',
+                                            'ga:bounces', 'ga:sessionDuration'])
+        self.assertEqual(list(df['date']), ['2024-03-01', '2024-03-02'])
+        self.assertEqual(list(df['ga:bounces']), [5, 2])
+
+    def test_get_daily_page_metrics_keeps_rows_in_their_own_range(self):
+        """Test rows of one packed date range are not repeated, zeroed, under the other."""
+        mock_service = MagicMock()
+        mock_service.reports().batchGet().execute.return_value = {'reports': [make_report(
+            ['ga:date', 'ga:pagePath'],
+            [('ga:sessions', 'INTEGER'), ('ga:pageviews', 'INTEGER'),
+             ('ga:bounces', 'INTEGER'), ('ga:sessionDuration', 'TIME')],
+            [(['20240301', '/home'], [['10', '20', '5', '600'], ['0', '0', '0', '0']]),
+             (['20240303', '/home'], [['0', '0', '0', '0'], ['8', '12', '2', '300']]),
+             (['20240303', '/faq'], [['0', '0', '0', '0'], ['0', '0', '0', '0']])]
+        )]}
+
+        df = get_daily_page_metrics(mock_service, '123', [('2024-03-01', '2024-03-01'), ('2024-03-03', '2024-03-03')])
+
+        self.assertEqual(list(zip(df['date'], df['ga:pagePath'], df['ga:sessions'])),
+                         [('2024-03-01', '/home', 10), ('2024-03-03', '/home', 8), ('2024-03-03', '/faq', 0)])
+
+    def test_get_reports_drops_rows_of_the_other_range(self):
+        """Test dimension rows occurring in one packed range only are reported for that range."""
+        mock_service = MagicMock()
+        mock_service.reports().batchGet().execute.return_value = {'reports': [make_report(
+            ['ga:pagePath'], [('ga:sessions', 'INTEGER')],
+            [(['/home'], [['5'], ['7']]), (['/new'], [['0'], ['3']])]
+        )]}
+
+        df = get_reports(mock_service, '123', [('2024-01-01', '2024-01-31'), ('2024-02-01', '2024-02-29')],
+                         [{'metrics': ['ga:sessions'], 'dimensions': ['ga:pagePath']}])[0]
+
+        self.assertEqual(list(zip(df['ga:pagePath'], df['start_date'])),
+                         [('/home', '2024-01-01'), ('/home', '2024-02-01'), ('/new', '2024-02-01')])
+
+class FakePage(list):
+    """Stand-in for a Shopify PaginatedCollection."""
+    
+    def __init__(self, items, next_page=None):
+        super().__init__(items)
+        self._next_page = next_page
+    
+    def has_next_page(self):
+        return self._next_page is not None
+    
+    def next_page(self, no_cache=False):
+        return self._next_page
+
+def make_order(order_id):
+    """Build a mock Shopify order."""
+    order = MagicMock()
+    order.id = order_id
+    return order
+
+class TestShopifyConnector(unittest.TestCase):
+    """Tests for Shopify connector."""
+    
+    @patch('src.connectors.shopify.initialize_shopify')
+    def test_iter_orders_chunks_across_pages(self, mock_initialize):
+        """Test iter_orders follows pagination and yields fixed-size chunks."""
+        # Setup mock
+        mock_api = MagicMock()
+        mock_initialize.return_value = mock_api
+        last = FakePage([make_order(5)])
+        middle = FakePage([make_order(3), make_order(4)], last)
+        mock_api.Order.find.return_value = FakePage([make_order(1), make_order(2)], middle)
+        
+        # Run test
+        chunks = list(iter_orders(chunk_size=2, updated_at_min='2024-01-01T00:00:00Z'))
+        
+        # Assert
+        self.assertEqual([list(chunk['id']) for chunk in chunks], [[1, 2], [3, 4], [5]])
+        params = mock_api.Order.find.call_args.kwargs
+        self.assertEqual(params['limit'], 2)
+        self.assertEqual(params['updated_at_min'], '2024-01-01T00:00:00Z')
+        self.assertEqual(params['status'], 'any')
+    
+    @patch('src.connectors.shopify.initialize_shopify')
+    def test_iter_products_flattens_variants(self, mock_initialize):
+        """Test iter_products yields variants as their own table."""
+        # Setup mock
+        mock_api = MagicMock()
+        mock_initialize.return_value = mock_api
+        product = MagicMock(id=10)
+        product.variants = [MagicMock(id=100, sku='A'), MagicMock(id=101, sku='B')]
+        mock_api.Product.find.return_value = FakePage([product])
+        
+        # Run test
+        (products, variants), = list(iter_products())
+        
+        # Assert
+        self.assertNotIn('variants', products.columns)
+        self.assertEqual(list(variants['variant_id']), [100, 101])
+        self.assertEqual(list(variants['product_id']), [10, 10])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
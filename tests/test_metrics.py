@@ -0,0 +1,132 @@
+"""Tests for the metrics registry."""
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import json
+import sys
+import os
+import tempfile
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.metrics import MetricsRegistry, timed, write_snapshot
+from src.connectors.services import InstrumentedHttp
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Tests for MetricsRegistry."""
+
+    def test_counters_and_histograms(self):
+        """Test counters add up per label set and histograms bucket values."""
+        registry = MetricsRegistry()
+        registry.increment('rows_total', 2, source='gmail')
+        registry.increment('rows_total', 3, source='gmail')
+        registry.increment('rows_total', source='shopify')
+        registry.observe('latency_seconds', 0.02, api='sheets')
+        registry.observe('latency_seconds', 3.0, api='sheets')
+
+        snapshot = registry.snapshot()
+
+        counters = {c['labels']['source']: c['value'] for c in snapshot['counters']}
+        self.assertEqual(counters, {'gmail': 5, 'shopify': 1})
+        histogram = snapshot['histograms'][0]
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(histogram['buckets']['0.025'], 1)
+        self.assertEqual(histogram['buckets']['inf'], 2)
+
+    def test_merge_adds_worker_snapshots(self):
+        """Test snapshots from other processes add up, with extra labels."""
+        worker = MetricsRegistry()
+        worker.increment('rows_total', 2, source='gmail')
+        worker.observe('latency_seconds', 0.02)
+        worker.observe('latency_seconds', 3.0)
+        registry = MetricsRegistry()
+        registry.observe('latency_seconds', 0.02, tenant='acme')
+
+        registry.merge(worker.snapshot(), tenant='acme')
+        registry.merge(worker.snapshot(), tenant='acme')
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters'], [
+            {'name': 'rows_total', 'labels': {'source': 'gmail', 'tenant': 'acme'}, 'value': 4}
+        ])
+        histogram = snapshot['histograms'][0]
+        self.assertEqual(histogram['count'], 5)
+        self.assertAlmostEqual(histogram['sum'], 6.06)
+        self.assertEqual((histogram['buckets']['0.025'], histogram['buckets']['inf']), (3, 5))
+
+    def test_render_prometheus(self):
+        """Test the Prometheus text format, including histogram series."""
+        registry = MetricsRegistry()
+        registry.increment('api_retries_total', api='sheets', status=429)
+        registry.observe('api_request_seconds', 0.2, api='gmail')
+
+        text = registry.render_prometheus()
+
+        self.assertIn('# TYPE api_retries_total counter', text)
+        self.assertIn('api_retries_total{api="sheets",status="429"} 1', text)
+        self.assertIn('api_request_seconds_bucket{api="gmail",le="0.25"} 1', text)
+        self.assertIn('api_request_seconds_bucket{api="gmail",le="+Inf"} 1', text)
+        self.assertIn('api_request_seconds_count{api="gmail"} 1', text)
+
+    def test_timer_counts_errors(self):
+        """Test a failing block is timed and counted as an error."""
+        registry = MetricsRegistry()
+        with self.assertRaises(ValueError):
+            with registry.timer('step_seconds', step='parse'):
+                raise ValueError("bad")
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters'][0]['name'], 'step_seconds_errors_total')
+        self.assertEqual(snapshot['histograms'][0]['count'], 1)
+
+    def test_disabled_registry_records_nothing(self):
+        """Test a disabled registry is a no-op."""
+        registry = MetricsRegistry(enabled=False)
+        registry.increment('rows_total')
+        with registry.timer('step_seconds'):
+            pass
+        self.assertEqual(registry.snapshot()['counters'], [])
+        self.assertEqual(registry.snapshot()['histograms'], [])
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests for the instrumentation helpers."""
+
+    def setUp(self):
+        registry = MetricsRegistry()
+        patcher = patch('src.metrics._registry', registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = registry
+
+    def test_timed_wraps_async_functions(self):
+        """Test @timed awaits coroutines and times them."""
+        @timed('processor_seconds', processor='echo')
+        async def echo(value):
+            return value
+
+        self.assertEqual(asyncio.run(echo(3)), 3)
+        self.assertEqual(self.registry.snapshot()['histograms'][0]['labels'], {'processor': 'echo'})
+
+    def test_instrumented_http_and_snapshot(self):
+        """Test transport requests are measured and snapshots are written as JSON."""
+        transport = MagicMock()
+        transport.request.return_value = (MagicMock(status=200), b'{"ok": true}')
+        http = InstrumentedHttp(transport, 'sheets')
+
+        with patch('src.connectors.services.increment', self.registry.increment), \
+                patch('src.connectors.services.timer', self.registry.timer):
+            http.request('https://example.com', 'POST', body='{"values": []}')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_snapshot(os.path.join(tmp, 'metrics.json'))
+            with open(path) as f:
+                snapshot = json.load(f)
+
+        counters = {c['name']: c['value'] for c in snapshot['counters']}
+        self.assertEqual(counters['api_bytes_sent_total'], 14)
+        self.assertEqual(counters['api_bytes_received_total'], 12)
+        self.assertIs(http.credentials, transport.credentials)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Tests for the pipelined email ingestion."""
+import unittest
+from unittest.mock import patch, MagicMock, ANY
+import asyncio
+import sys
+import os
+import tempfile
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.pipeline import run_email_pipeline
+from src.work_queue import EmailWorkQueue, QUEUED, FETCHED, PARSED, ACKED
+from src.storage.parquet_store import ParquetStore
+
+def make_message(message_id):
+    """Build a minimal Gmail message resource."""
+    return {
+        'id': message_id,
+        'payload': {
+            'headers': [
+                {'name': 'Subject', 'value': f'Subject {message_id}'},
+                {'name': 'From', 'value': f'{message_id}@example.com'}
+            ],
+            'body': {'data': 'VGVzdCBib2R5IDE='}
+        }
+    }
+
+# The pipeline runs the steps of the top-level `work_queue` module, as imported from src/
+@patch('work_queue.save_history_checkpoint')
+@patch('work_queue.mark_as_read')
+@patch('work_queue.get_sheets_service')
+@patch('work_queue.SHEETS_MIRROR_ENABLED', True)
+@patch('work_queue.get_gmail_service')
+@patch('work_queue.fetch_messages')
+@patch('work_queue.list_new_message_ids')
+@patch('src.pipeline.aparse_email_content')
+class TestEmailPipeline(unittest.TestCase):
+    """Tests for run_email_pipeline."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.queue = EmailWorkQueue(os.path.join(tmp.name, 'queue.sqlite3'), retry_delay=0)
+        self.addCleanup(self.queue.close)
+        self.store = ParquetStore(os.path.join(tmp.name, 'store'))
+
+    def run_pipeline(self, **kwargs):
+        return asyncio.run(run_email_pipeline(MagicMock(), self.queue, self.store, spreadsheet_id='test_id',
+                                              **kwargs))
+
+    @patch('src.pipeline.DEDUP_ENABLED', False)
+    def test_run_email_pipeline(self, mock_parse, mock_list, mock_fetch, mock_gmail, mock_sheets, mock_mark,
+                                mock_save):
+        """Test every fetched email is parsed, written and marked as read once."""
+        # Setup mocks
+        message_ids = [str(i) for i in range(250)]
+        mock_list.return_value = (message_ids, '999')
+        mock_fetch.side_effect = lambda gmail, chunk, user_id=None: [make_message(i) for i in chunk]
+
+        async def parse(body):
+            return {'sentiment': 'neutral', 'main_issue': body, 'product': 'Widget X'}
+        mock_parse.side_effect = parse
+
+        # Run test
+        progress = self.run_pipeline(fetch_concurrency=2, parse_concurrency=4, write_concurrency=2,
+                                     queue_size=10)
+
+        # Assert
+        self.assertEqual(progress[ACKED], 250)
+        mock_save.assert_called_once_with('999', ANY)
+        self.assertEqual(mock_fetch.call_count, 3)
+        self.assertEqual(mock_parse.call_count, 250)
+        written = [
+            row
+            for call in mock_sheets.return_value.spreadsheets().values().append.call_args_list
+            for row in call.kwargs['body']['values']
+        ]
+        self.assertEqual(sorted(row[0] for row in written), sorted(f'{i}@example.com' for i in message_ids))
+        self.assertEqual(sorted(self.store.read('emails')['message_id']), sorted(message_ids))
+        acked = [message_id for call in mock_mark.call_args_list for message_id in call.args[1]]
+        self.assertEqual(sorted(acked), sorted(message_ids))
+        self.assertEqual(self.queue.counts()[ACKED], 250)
+
+    def test_run_email_pipeline_stage_failure(self, mock_parse, mock_list, mock_fetch, mock_gmail, mock_sheets,
+                                              mock_mark, mock_save):
+        """Test a failing stage stops the pipeline, and the next run resumes without fetching again."""
+        mock_list.return_value = (['1', '2', '3'], '999')
+        mock_fetch.side_effect = lambda gmail, chunk, user_id=None: [make_message(i) for i in chunk]
+        mock_parse.side_effect = RuntimeError("LLM unavailable")
+
+        with self.assertRaises(RuntimeError):
+            self.run_pipeline(queue_size=1)
+
+        mock_mark.assert_not_called()
+        self.assertEqual(self.queue.counts()[ACKED], 0)
+
+        async def parse(body):
+            return {'sentiment': 'negative', 'main_issue': body, 'product': None}
+        mock_parse.side_effect = parse
+        mock_list.return_value = ([], '1000')
+
+        progress = self.run_pipeline()
+
+        self.assertEqual(progress[ACKED], 3)
+        mock_fetch.assert_called_once()
+        self.assertEqual(sorted(self.store.read('emails')['message_id']), ['1', '2', '3'])
+
+    def test_run_email_pipeline_resumes_written_and_parsed(self, mock_parse, mock_list, mock_fetch, mock_gmail,
+                                                           mock_sheets, mock_mark, mock_save):
+        """Test messages an earlier run left written or parsed are finished without the LLM."""
+        mock_list.return_value = ([], '999')
+        email = {'id': '1', 'sender': 'a@example.com', 'subject': 'Hi', 'body': 'Late'}
+        parsed = {'sentiment': 'negative', 'main_issue': 'Late', 'product': None}
+        self.queue.enqueue(['1', '2'])
+        for item in self.queue.claim(QUEUED):
+            self.queue.advance(item['message_id'], QUEUED, email=dict(email, id=item['message_id']))
+        for item in self.queue.claim(FETCHED):
+            self.queue.advance(item['message_id'], FETCHED, parsed=parsed)
+        # Message 1 was written before the earlier run stopped, message 2 was not
+        self.assertEqual(self.queue.claim(PARSED, limit=1)[0]['message_id'], '1')
+        self.queue.advance('1', PARSED)
+
+        progress = self.run_pipeline()
+
+        self.assertEqual(progress[ACKED], 2)
+        self.assertEqual(self.queue.counts()[ACKED], 2)
+        mock_parse.assert_not_called()
+        mock_fetch.assert_not_called()
+        self.assertEqual(sorted(c.args[1] for c in mock_mark.call_args_list), [['1'], ['2']])
+
+    def test_run_email_pipeline_parses_duplicates_once(self, mock_parse, mock_list, mock_fetch, mock_gmail,
+                                                       mock_sheets, mock_mark, mock_save):
+        """Test concurrent workers share one parse between identical emails."""
+        mock_list.return_value = ([str(i) for i in range(20)], '999')
+        mock_fetch.side_effect = lambda gmail, chunk, user_id=None: [make_message(i) for i in chunk]
+
+        async def parse(body):
+            await asyncio.sleep(0.01)
+            return {'customer_name': 'Jane', 'sentiment': 'neutral', 'main_issue': body, 'product': None}
+        mock_parse.side_effect = parse
+
+        self.run_pipeline(parse_concurrency=4)
+
+        self.assertEqual(mock_parse.call_count, 1)
+        stored = self.store.read('emails')
+        self.assertEqual(len(stored), 20)
+        self.assertTrue((stored['main_issue'] == 'Test body 1').all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,17 +4,35 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import json
+import sqlite3
+import tempfile
 import pandas as pd
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.processors.email_parser import parse_email_content
-from src.processors.analytics import identify_underperforming_pages
+from src.processors.email_parser import (
+    parse_email_content, parse_emails_batch, parse_emails, truncate_to_token_budget, TRUNCATION_MARKER,
+    EMAIL_PROMPT_TEMPLATE, EMAIL_LLM_SETTINGS
+)
+from src.processors.email_classifier import EmailPreClassifier
+from src.processors.analytics import (
+    identify_underperforming_pages, calculate_conversion_funnel, calculate_conversion_funnels
+)
+from src.processors.cache import ResultCache, make_cache_key
+from src.processors.dedup import cluster_near_duplicates
+from src.processors.structured_output import EmailExtraction, repair_json, parse_structured
 
 class TestEmailParser(unittest.TestCase):
     """Tests for email parser."""
     
+    def setUp(self):
+        """Disable the persistent result cache and the shared LLM client."""
+        for patcher in (patch('src.processors.email_parser.get_result_cache', return_value=None),
+                        patch('src.processors.email_parser._llm', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
     @patch('src.processors.email_parser.OpenAI')
     def test_parse_email_content(self, mock_openai):
         """Test parse_email_content."""
@@ -59,6 +77,358 @@ class TestEmailParser(unittest.TestCase):
         self.assertEqual(result['customer_name'], 'Unknown')
         self.assertEqual(result['sentiment'], 'neutral')
 
+    @patch('src.processors.email_parser.LLMChain')
+    @patch('src.processors.email_parser.OpenAI')
+    def test_parse_emails_batch(self, mock_openai, mock_chain_cls):
+        """Test parse_emails_batch packs emails and re-runs only bad entries."""
+        # Setup mock
+        mock_chain = MagicMock()
+        mock_chain_cls.return_value = mock_chain
+        
+        def make_result(name):
+            return {
+                'customer_name': name,
+                'product': 'Widget X',
+                'sentiment': 'neutral',
+                'main_issue': 'Question',
+                'priority': 'low'
+            }
+        
+        # First batch answers out of order, second batch omits its only email
+        mock_chain.run.side_effect = [
+            json.dumps([dict(make_result('B'), index=1), dict(make_result('A'), index=0)]),
+            "Not JSON"
+        ]
+        mock_chain.apply.return_value = [{'text': json.dumps(make_result('C'))}]
+        
+        # Run test
+        result = parse_emails_batch(['email a', 'email b', 'email c'], batch_size=2)
+        
+        # Assert
+        self.assertEqual(mock_chain.run.call_count, 2)
+        mock_chain.apply.assert_called_once_with([{'email': 'email c'}])
+        self.assertEqual([r['customer_name'] for r in result], ['A', 'B', 'C'])
+    
+    @patch('src.processors.email_parser.LLMChain')
+    @patch('src.processors.email_parser.OpenAI')
+    def test_parse_email_content_reasks_invalid_fields(self, mock_openai, mock_chain_cls):
+        """Test only the invalid fields are asked for again, and kept fields survive."""
+        mock_chain = MagicMock()
+        mock_chain_cls.return_value = mock_chain
+        mock_chain.run.side_effect = [
+            "Here you go: {'customer_name': 'Jane', 'product': 'Widget X', 'sentiment': 'furious', "
+            "'main_issue': 'Broken on arrival', 'priority': 'High',}",
+            '{"sentiment": "Negative", "product": "Something else"}'
+        ]
+        
+        result = parse_email_content("Jane here. My Widget X arrived broken!")
+        
+        self.assertEqual(result, {'customer_name': 'Jane', 'product': 'Widget X', 'sentiment': 'negative',
+                                  'main_issue': 'Broken on arrival', 'priority': 'high'})
+        reask = mock_chain.run.call_args_list[1].kwargs
+        self.assertEqual(reask['fields'], 'sentiment')
+        self.assertIn('sentiment', reask['errors'])
+
+    @patch('src.processors.email_parser.LLM_MAX_REASKS', 1)
+    @patch('src.processors.email_parser.LLMChain')
+    @patch('src.processors.email_parser.OpenAI')
+    def test_parse_emails_batch_falls_back_field_by_field(self, mock_openai, mock_chain_cls):
+        """Test an answer still invalid after the re-ask keeps its valid fields and never stores raw output."""
+        mock_chain = MagicMock()
+        mock_chain_cls.return_value = mock_chain
+        mock_chain.run.return_value = json.dumps([
+            {'index': 0, 'customer_name': None, 'product': None, 'sentiment': 'neutral', 'priority': 'low'}
+        ])
+        mock_chain.apply.return_value = [{'text': 'Sorry, I cannot help with that.'}]
+        
+        result = parse_emails_batch(['What are your opening hours?'])
+        
+        mock_chain.apply.assert_called_once()
+        self.assertEqual(mock_chain.apply.call_args.args[0][0]['fields'], 'main_issue')
+        self.assertEqual(result, [{'customer_name': None, 'product': None, 'sentiment': 'neutral',
+                                   'main_issue': 'Unknown', 'priority': 'low'}])
+
+    @patch('src.processors.email_parser.LLMChain')
+    @patch('src.processors.email_parser.OpenAI')
+    def test_parse_emails_batch_empty(self, mock_openai, mock_chain_cls):
+        """Test parse_emails_batch with no emails."""
+        self.assertEqual(parse_emails_batch([]), [])
+        mock_openai.assert_not_called()
+
+    @patch('src.processors.email_parser.LLMChain')
+    @patch('src.processors.email_parser.OpenAI')
+    def test_parse_emails_batch_uses_cache(self, mock_openai, mock_chain_cls):
+        """Test parse_emails_batch only sends cache misses to the LLM."""
+        cache = ResultCache(path=':memory:')
+        cached = {
+            'customer_name': 'A',
+            'product': 'Widget X',
+            'sentiment': 'positive',
+            'main_issue': 'Praise',
+            'priority': 'low'
+        }
+        fresh = dict(cached, customer_name='B', index=0)
+        
+        mock_chain = MagicMock()
+        mock_chain_cls.return_value = mock_chain
+        mock_chain.run.return_value = json.dumps([fresh])
+        
+        with patch('src.processors.email_parser.get_result_cache', return_value=cache):
+            cache.set(make_cache_key('  Email A ', EMAIL_PROMPT_TEMPLATE, EMAIL_LLM_SETTINGS), cached)
+            result = parse_emails_batch(['email a', 'email b'])
+            
+            # Both are cached now, so a second run makes no LLM call
+            mock_chain.run.reset_mock()
+            parse_emails_batch(['email a', 'email b'])
+        
+        # Assert
+        mock_chain.run.assert_not_called()
+        self.assertEqual([r['customer_name'] for r in result], ['A', 'B'])
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    @patch('src.processors.email_parser.parse_emails_batch')
+    def test_parse_emails_skips_trivial_emails(self, mock_batch):
+        """Test parse_emails only sends emails the pre-classifier is unsure about to the LLM."""
+        mock_batch.side_effect = lambda bodies, batch_size: [{'main_issue': body} for body in bodies]
+        emails = [
+            {'sender': 'Jane <jane@example.com>', 'subject': 'Broken widget', 'body': 'My widget is broken'},
+            {'sender': 'noreply@shop.example.com', 'subject': 'Your receipt', 'body': 'Order #1'},
+            {'sender': 'Tom <tom@example.com>', 'subject': 'Refund?', 'body': 'Where is my refund?'}
+        ]
+        
+        with patch('src.processors.email_parser.get_preclassifier', return_value=EmailPreClassifier()):
+            result = parse_emails(emails)
+        
+        mock_batch.assert_called_once_with(['My widget is broken', 'Where is my refund?'], batch_size=20)
+        self.assertEqual(result[1]['main_issue'], 'Receipt or transactional notification')
+        self.assertEqual(result[2], {'main_issue': 'Where is my refund?'})
+
+    @patch('src.processors.email_parser.get_preclassifier', return_value=None)
+    @patch('src.processors.email_parser.parse_emails_batch')
+    def test_parse_emails_fans_out_near_duplicates(self, mock_batch, mock_preclassifier):
+        """Test near-duplicates are parsed once and keep their own customer name."""
+        mock_batch.side_effect = lambda bodies, batch_size: [
+            {'customer_name': 'Jane', 'main_issue': body} for body in bodies
+        ]
+        template = ("Hello, I ordered the Widget X last week and it arrived with a cracked screen. "
+                    "I would like a replacement or a refund as soon as possible. Order number {}.")
+        emails = [
+            {'sender': 'Jane <jane@example.com>', 'subject': 'Cracked', 'body': template.format(1001)},
+            {'sender': 'Ann <ann@example.com>', 'subject': 'Late', 'body': 'My order has not arrived yet.'},
+            {'sender': 'Tom <tom@example.com>', 'subject': 'Cracked', 'body': template.format(1002)}
+        ]
+        
+        result = parse_emails(emails)
+        
+        mock_batch.assert_called_once_with([emails[0]['body'], emails[1]['body']], batch_size=20)
+        self.assertEqual(result[2]['main_issue'], emails[0]['body'])
+        self.assertEqual(result[2]['customer_name'], 'Tom')
+        self.assertEqual(result[0]['customer_name'], 'Jane')
+
+    @patch('src.processors.email_parser._token_encoding', return_value=None)
+    def test_truncate_to_token_budget(self, mock_encoding):
+        """Test long bodies are cut at a sentence boundary within the budget."""
+        body = "The charger is broken. " * 20
+        
+        truncated = truncate_to_token_budget(body, max_tokens=50)
+        
+        self.assertEqual(truncate_to_token_budget("Short body.", max_tokens=50), "Short body.")
+        self.assertTrue(truncated.endswith("broken." + TRUNCATION_MARKER))
+        self.assertLessEqual(len(truncated) - len(TRUNCATION_MARKER), 200)
+        self.assertGreater(len(truncated) - len(TRUNCATION_MARKER), 160)
+
+class TestNearDuplicateClustering(unittest.TestCase):
+    """Tests for MinHash/LSH near-duplicate clustering."""
+    
+    def test_clusters_near_duplicates_only(self):
+        """Test small edits stay in one cluster and different emails do not."""
+        base = ("The discount code SPRING20 is not accepted at checkout even though the email "
+                "says it is valid until the end of the month, please help me fix this")
+        texts = [
+            base,
+            "Where can I find the size guide for the running shoes in your new collection",
+            base + " thanks",
+            base.upper(),
+            base.replace('SPRING20', 'SUMMER15').replace('month', 'week')
+        ]
+        
+        clusters = cluster_near_duplicates(texts, threshold=0.8)
+        
+        self.assertEqual(clusters, [[0, 2, 3], [1], [4]])
+    
+    def test_threshold_is_configurable(self):
+        """Test a lower threshold merges looser matches."""
+        base = ("The discount code SPRING20 is not accepted at checkout even though the email "
+                "says it is valid until the end of the month, please help me fix this")
+        texts = [base, base.replace('SPRING20', 'SUMMER15')]
+        
+        self.assertEqual(cluster_near_duplicates(texts, threshold=0.95), [[0], [1]])
+        self.assertEqual(cluster_near_duplicates(texts, threshold=0.5), [[0, 1]])
+
+class TestStructuredOutput(unittest.TestCase):
+    """Tests for JSON repair and schema validation of LLM answers."""
+
+    def test_repair_json(self):
+        """Test near-miss JSON is repaired and hopeless answers give None."""
+        expected = {'a': [1, True, None]}
+        for text in ['```json\n{"a": [1, true, null]}\n```',
+                     'Result: {"a": [1, true, null],} Hope this helps.',
+                     "{'a': [1, True, None]}",
+                     '{\u201ca\u201d: [1, true, null]}']:
+            self.assertEqual(repair_json(text), expected, text)
+        self.assertIsNone(repair_json('Not JSON'))
+
+    def test_invalid_fields_are_reported_individually(self):
+        """Test validation normalizes case and reports each bad or missing field."""
+        result, valid, errors = parse_structured(
+            '{"customer_name": "N/A", "product": "Widget", "sentiment": "POSITIVE", "priority": "urgent"}',
+            EmailExtraction
+        )
+        self.assertIsNone(result)
+        self.assertEqual(set(errors), {'main_issue', 'priority'})
+        self.assertEqual(EmailExtraction.model_validate(dict(valid, main_issue='x', priority='low')).sentiment,
+                         'positive')
+
+class TestEmailPreClassifier(unittest.TestCase):
+    """Tests for the email pre-classifier."""
+    
+    def setUp(self):
+        self.classifier = EmailPreClassifier(threshold=0.9)
+    
+    def test_trivial_emails_skip_the_llm(self):
+        """Test header and sender rules answer trivial emails."""
+        auto_reply = {'sender': 'Ann <ann@example.com>', 'subject': 'Re: Order', 'body': 'I am away.',
+                      'headers': {'auto-submitted': 'auto-replied'}}
+        bounce = {'sender': 'MAILER-DAEMON@mx.example.com', 'subject': 'Failure', 'body': '...'}
+        newsletter = {'sender': 'news@brand.example.com', 'subject': 'Spring sale', 'body': 'Save 20%',
+                      'headers': {'list-unsubscribe': '<mailto:unsubscribe@brand.example.com>'}}
+        
+        self.assertEqual(self.classifier.classify(auto_reply)['main_issue'], 'Automatic reply')
+        self.assertEqual(self.classifier.classify(auto_reply)['customer_name'], 'Ann')
+        self.assertEqual(self.classifier.classify(bounce)['main_issue'], 'Delivery failure notice')
+        self.assertEqual(self.classifier.classify(newsletter)['priority'], 'low')
+    
+    def test_short_thank_you_notes_skip_the_llm(self):
+        """Test short thank-you notes reach the threshold, while longer ones are left to the LLM."""
+        thanks = {'sender': 'Priya <priya@example.net>', 'subject': 'Thanks!', 'body': 'Thank you, works great.'}
+        long_thanks = dict(thanks, body='Thank you for the help. ' + 'The team was kind and quick. ' * 5)
+        
+        result = self.classifier.classify(thanks)
+        
+        self.assertEqual((result['main_issue'], result['sentiment'], result['priority']),
+                         ('Thank-you note', 'positive', 'low'))
+        self.assertIsNone(self.classifier.classify(long_thanks))
+        self.assertEqual(EmailPreClassifier(threshold=0.7).classify(long_thanks)['sentiment'], 'positive')
+    
+    def test_urgent_wording_sets_priority(self):
+        """Test the priority lexicon raises the priority of urgent notifications."""
+        overdue = {'sender': 'billing@shop.example.com', 'subject': 'Invoice 1042',
+                   'body': 'Payment is overdue, please pay immediately.'}
+        paid = dict(overdue, body='Payment received for order 1042.')
+        
+        self.assertEqual(self.classifier.classify(overdue)['priority'], 'high')
+        self.assertEqual(self.classifier.classify(paid)['priority'], 'low')
+    
+    def test_polite_complaints_are_not_thank_you_notes(self):
+        """Test complaints that open with thanks are never taken for thank-you notes."""
+        classifier = EmailPreClassifier(threshold=0.5)
+        complaints = [
+            'Thanks, but my order still hasn\'t arrived.',
+            'Thank you. The package came without the charger.',
+            'Thanks for the quick reply, unfortunately the size is too small.',
+            'Great, I was charged twice for one order.',
+            'Thanks! Still waiting on my tracking number.',
+            'Appreciate it, though the app keeps crashing with an error.'
+        ]
+        
+        for body in complaints:
+            email = {'sender': 'Jane <jane@example.com>', 'subject': 'Re: Order', 'body': body}
+            self.assertIsNone(classifier.classify(email), body)
+    
+    def test_ambiguous_emails_go_to_the_llm(self):
+        """Test complaints, questions and low-confidence matches are left to the LLM."""
+        emails = [
+            {'sender': 'Jane <jane@example.com>', 'subject': 'Thanks, but', 'body': 'Thanks, but it arrived damaged.'},
+            {'sender': 'Tom <tom@example.com>', 'subject': 'Re: Your order confirmation',
+             'body': 'This order never arrived, please refund it.'},
+            {'sender': 'noreply@shop.example.com', 'subject': 'Update', 'body': 'Something changed'}
+        ]
+        
+        self.assertEqual([self.classifier.classify(email) for email in emails], [None, None, None])
+        
+        stats = self.classifier.stats()
+        self.assertEqual(stats['sent_to_llm'], 3)
+        self.assertEqual(stats['avoided_fraction'], 0.0)
+    
+    def test_model_decides_when_rules_are_unsure(self):
+        """Test a trained model can push an email over the threshold."""
+        model = MagicMock()
+        model.predict.return_value = ('newsletter', 0.97)
+        classifier = EmailPreClassifier(threshold=0.9, model=model)
+        
+        result = classifier.classify({'sender': 'team@brand.example.com', 'subject': 'Our news', 'body': 'Hello'})
+        
+        self.assertEqual(result['main_issue'], 'Newsletter or marketing email')
+        self.assertEqual(classifier.stats()['avoided_fraction'], 1.0)
+
+class TestResultCache(unittest.TestCase):
+    """Tests for the parsing result cache."""
+    
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted past max_entries."""
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResultCache(path=os.path.join(tmp, 'cache.sqlite3'), max_entries=2)
+            cache.set('a', {'value': 1})
+            cache.set('b', {'value': 2})
+            cache.get('a')
+            cache.set('c', {'value': 3})
+            
+            self.assertEqual(cache.get('a'), {'value': 1})
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.stats()['entries'], 2)
+    
+    def test_ttl_expiry(self):
+        """Test expired entries are reported as misses."""
+        cache = ResultCache(path=':memory:', ttl=60)
+        cache.set('a', {'value': 1})
+        
+        with patch('src.processors.cache.time.time', return_value=10 ** 12):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+    
+    @patch('src.processors.cache.BUSY_TIMEOUT', 0.05)
+    def test_shared_file_survives_a_locked_writer(self):
+        """Test another process holding the write lock turns neither a hit nor a store into an error."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite3')
+            cache = ResultCache(path=path)
+            cache.set('a', {'value': 1})
+            other = sqlite3.connect(path)
+            other.execute("BEGIN IMMEDIATE")
+            try:
+                self.assertEqual(cache.get('a'), {'value': 1})
+                cache.set('b', {'value': 2})
+                self.assertIsNone(cache.get('b'))
+            finally:
+                other.rollback()
+                other.close()
+            cache.set('b', {'value': 2})
+            self.assertEqual(cache.get('b'), {'value': 2})
+            self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_key_normalizes_whitespace_and_case(self):
+        """Test make_cache_key ignores whitespace and case differences."""
+        settings = {'temperature': 0}
+        self.assertEqual(
+            make_cache_key('Hello   World', 'tpl', settings),
+            make_cache_key('hello world\n', 'tpl', settings)
+        )
+        self.assertNotEqual(
+            make_cache_key('hello world', 'tpl', settings),
+            make_cache_key('hello world', 'tpl', {'temperature': 1})
+        )
+
 class TestAnalyticsProcessor(unittest.TestCase):
     """Tests for analytics processor."""
     
@@ -81,5 +451,89 @@ class TestAnalyticsProcessor(unittest.TestCase):
         self.assertTrue('/contact' in result['ga:pagePath'].values)
         self.assertTrue('/product' in result['ga:pagePath'].values)
 
+    def test_identify_underperforming_pages_does_not_mutate(self):
+        """Test scores are returned without touching the caller's DataFrame."""
+        df = pd.DataFrame({
+            'ga:pagePath': ['/home', '/contact', '/product'],
+            'ga:bounceRate': [30.0, 90.0, 80.0],
+            'ga:avgSessionDuration': [120.0, 30.0, 45.0]
+        })
+        before = df.copy()
+        
+        result = identify_underperforming_pages(df, threshold=0.6)
+        
+        pd.testing.assert_frame_equal(df, before)
+        self.assertEqual(list(result['ga:pagePath']), ['/contact', '/product'])
+        self.assertAlmostEqual(result['performance_score'].iloc[0], (0.1 + 0.25) / 2)
+    
+    def test_identify_underperforming_pages_top_k_and_weights(self):
+        """Test top_k keeps the worst pages and custom metrics are weighted."""
+        df = pd.DataFrame({
+            'ga:pagePath': ['/a', '/b', '/c', '/d'],
+            'ga:bounceRate': [50.0, 95.0, 70.0, 90.0],
+            'ga:exitRate': [10.0, 0.0, 90.0, 20.0]
+        })
+        metrics = {
+            'ga:bounceRate': {'weight': 1.0, 'higher_is_better': False, 'scale': 100},
+            'ga:exitRate': {'weight': 3.0, 'higher_is_better': False, 'scale': 100,
+                            'score_column': 'exit_score'}
+        }
+        
+        result = identify_underperforming_pages(df, threshold=1.0, top_k=2, metrics=metrics)
+        
+        self.assertEqual(list(result['ga:pagePath']), ['/c', '/d'])
+        self.assertIn('exit_score', result.columns)
+        self.assertIn('bounceRate_score', result.columns)
+        self.assertTrue(identify_underperforming_pages(df, top_k=0).empty)
+
+class TestConversionFunnels(unittest.TestCase):
+    """Tests for conversion funnel calculation."""
+    
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'ga:pagePath': ['/home', '/product/a', '/product/b', '/cart', '/checkout', '/home'],
+            'ga:pageviews': [1000, 300, 200, 250, 100, 5]
+        })
+    
+    def test_calculate_conversion_funnel(self):
+        """Test a single exact-path funnel, including a missing step."""
+        result = calculate_conversion_funnel(self.df, ['/home', '/cart', '/missing', '/checkout'])
+        
+        self.assertEqual(list(result['step']), [1, 2, 4])
+        self.assertEqual(list(result['pageviews']), [1000, 250, 100])
+        self.assertEqual(list(result['conversion_rate'][:2]), [100, 25.0])
+        self.assertEqual(result['dropoff_rate'][1], 75.0)
+        self.assertTrue(pd.isna(result['conversion_rate'][2]))
+        self.assertEqual(result['previous_step'][2], '/missing')
+    
+    def test_calculate_conversion_funnels_many(self):
+        """Test several funnels come back as one tidy frame."""
+        result = calculate_conversion_funnels(self.df, {
+            'cart': ['/home', '/cart'],
+            'checkout': ['/cart', '/checkout']
+        })
+        
+        self.assertEqual(list(result['funnel']), ['cart', 'cart', 'checkout', 'checkout'])
+        self.assertEqual(list(result['conversion_rate']), [100, 25.0, 100, 40.0])
+    
+    def test_calculate_conversion_funnels_prefix_and_regex(self):
+        """Test prefix and regex steps sum the pageviews of every matching page."""
+        prefix = calculate_conversion_funnels(self.df, [['/product/', '/cart']], match='prefix')
+        regex = calculate_conversion_funnels(self.df, [[r'^/product/[ab]$', '/cart']], match='regex')
+        
+        self.assertEqual(list(prefix['pageviews']), [500, 250])
+        self.assertEqual(list(prefix['conversion_rate']), [100, 50.0])
+        self.assertEqual(list(regex['pageviews']), [500, 250])
+    
+    def test_prefix_steps_match_a_startswith_scan(self):
+        """Test overlapping, missing and exact-path prefixes sum the same pageviews as str.startswith."""
+        steps = ['/', '/product', '/product/a', '/home', '/zzz', '/cart', '/product/']
+        
+        result = calculate_conversion_funnels(self.df, [steps], match='prefix')
+        
+        expected = {step: self.df.loc[self.df['ga:pagePath'].str.startswith(step), 'ga:pageviews'].sum()
+                    for step in steps if self.df['ga:pagePath'].str.startswith(step).any()}
+        self.assertEqual(dict(zip(result['page_path'], result['pageviews'])), expected)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
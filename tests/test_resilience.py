@@ -0,0 +1,111 @@
+"""Tests for rate limiting, retries and circuit breaking."""
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+from googleapiclient.errors import HttpError
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import CIRCUIT_FAILURE_THRESHOLD
+from src.resilience import (
+    CircuitBreaker, CircuitOpenError, RetryPolicy, TokenBucket, call, is_quota_error, reset_circuit_breakers
+)
+
+def http_error(status, headers=None, content=b''):
+    """Build an HttpError with a status and response headers."""
+    resp = dict(headers or {})
+    resp = type('Response', (dict,), {'status': status, 'reason': ''})(resp)
+    return HttpError(resp, content)
+
+class TestRetries(unittest.TestCase):
+    """Tests for call."""
+
+    def setUp(self):
+        reset_circuit_breakers()
+
+    @patch('src.resilience.time.sleep')
+    def test_retry_honors_retry_after(self, mock_sleep):
+        """Test a 429 is retried after the delay its Retry-After header asks for."""
+        func = MagicMock(side_effect=[http_error(429, {'retry-after': '7'}), 'ok'])
+
+        self.assertEqual(call('test', func, policy=RetryPolicy(max_retries=3, backoff=1.0)), 'ok')
+        mock_sleep.assert_called_once_with(7.0)
+
+    @patch('src.resilience.time.sleep')
+    def test_backoff_grows_and_gives_up(self, mock_sleep):
+        """Test server errors back off exponentially and the last error is raised."""
+        func = MagicMock(side_effect=http_error(503))
+
+        with self.assertRaises(HttpError):
+            call('test', func, policy=RetryPolicy(max_retries=2, backoff=1.0))
+
+        self.assertEqual(func.call_count, 3)
+        first, second = (c.args[0] for c in mock_sleep.call_args_list)
+        self.assertTrue(1.0 <= first < 2.0 and 2.0 <= second < 3.0)
+
+    @patch('src.resilience.time.sleep')
+    def test_client_errors_are_not_retried(self, mock_sleep):
+        """Test a 404 is raised at once, and only quota 403s count as quota errors."""
+        func = MagicMock(side_effect=http_error(404))
+        with self.assertRaises(HttpError):
+            call('test', func)
+        func.assert_called_once()
+
+        quota = http_error(403, content=b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+        self.assertTrue(is_quota_error(quota))
+        self.assertFalse(is_quota_error(http_error(403, content=b'{"reason": "forbidden"}')))
+        mock_sleep.assert_not_called()
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for CircuitBreaker."""
+
+    def test_opens_fails_fast_and_recovers(self):
+        """Test the circuit opens after repeated failures, then closes on a successful probe."""
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        now[0] = 30.0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @patch('src.resilience.time.sleep')
+    def test_call_stops_retrying_once_open(self, mock_sleep):
+        """Test call raises the error that opened the circuit, then fails fast without calling."""
+        reset_circuit_breakers()
+        func = MagicMock(side_effect=http_error(500))
+
+        with self.assertRaises(HttpError):
+            call('flaky', func, policy=RetryPolicy(max_retries=CIRCUIT_FAILURE_THRESHOLD + 5, backoff=0.1))
+        self.assertEqual(func.call_count, CIRCUIT_FAILURE_THRESHOLD)
+
+        with self.assertRaises(CircuitOpenError):
+            call('flaky', func)
+        self.assertEqual(func.call_count, CIRCUIT_FAILURE_THRESHOLD)
+        reset_circuit_breakers()
+
+class TestTokenBucket(unittest.TestCase):
+    """Tests for TokenBucket."""
+
+    def test_waits_once_the_burst_is_spent(self):
+        """Test requests beyond the burst wait 1/rate seconds each."""
+        now = [0.0]
+        bucket = TokenBucket(2, burst=2, clock=lambda: now[0])
+
+        waits = [bucket.reserve() for _ in range(4)]
+
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for the job scheduler."""
+import unittest
+import threading
+import sys
+import os
+from datetime import datetime
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.scheduler import CronSchedule, Scheduler
+
+class FakeClock:
+    """Manually advanced clock for the scheduler."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestCronSchedule(unittest.TestCase):
+    """Tests for CronSchedule."""
+
+    def test_next_after(self):
+        """Test fields, steps, ranges and aliases pick the next run."""
+        start = datetime(2024, 3, 1, 7, 30)  # a Friday
+
+        self.assertEqual(CronSchedule('0 * * * *').next_after(start), datetime(2024, 3, 1, 8, 0))
+        self.assertEqual(CronSchedule('0 7 * * *').next_after(start), datetime(2024, 3, 2, 7, 0))
+        self.assertEqual(CronSchedule('*/20 * * * *').next_after(start), datetime(2024, 3, 1, 7, 40))
+        self.assertEqual(CronSchedule('0 6 * * 1-5').next_after(start), datetime(2024, 3, 4, 6, 0))
+        self.assertEqual(CronSchedule('@monthly').next_after(start), datetime(2024, 4, 1, 0, 0))
+        self.assertEqual(CronSchedule('0 0 29 2 *').next_after(start), datetime(2028, 2, 29, 0, 0))
+
+    def test_invalid_expression(self):
+        """Test malformed expressions are rejected."""
+        for expression in ('* * * *', '60 * * * *', '0 0 31 2 *'):
+            with self.assertRaises(ValueError):
+                CronSchedule(expression).next_after(datetime(2024, 1, 1))
+
+class TestScheduler(unittest.TestCase):
+    """Tests for Scheduler."""
+
+    def setUp(self):
+        self.clock = FakeClock(datetime(2024, 3, 1, 7, 59))
+        self.scheduler = Scheduler(max_workers=2, clock=self.clock)
+        self.addCleanup(self.scheduler.shutdown)
+
+    def test_jobs_run_concurrently_without_overlap(self):
+        """Test a slow job does not block others and is never started twice."""
+        release = threading.Event()
+        fast_done = threading.Event()
+        self.scheduler.add_job('slow', release.wait, '0 * * * *', run_on_start=True)
+        self.scheduler.add_job('fast', fast_done.set, '0 * * * *')
+
+        self.assertEqual(self.scheduler.run_pending(), ['slow'])
+
+        self.clock.now = datetime(2024, 3, 1, 8, 0)
+        self.assertEqual(self.scheduler.run_pending(), ['fast'])
+        self.assertTrue(fast_done.wait(5))
+
+        release.set()
+        jobs = self.scheduler.jobs
+        self.assertEqual(jobs['slow'].skipped, 1)
+        self.assertEqual(jobs['slow'].next_run, datetime(2024, 3, 1, 9, 0))
+
+    def test_missed_runs_are_coalesced(self):
+        """Test overdue runs are counted and the job runs once."""
+        calls = []
+        self.scheduler.add_job('hourly', lambda: calls.append(1), '0 * * * *')
+
+        self.clock.now = datetime(2024, 3, 1, 12, 30)
+        started = self.scheduler.run_pending()
+        self.scheduler.shutdown()
+
+        job = self.scheduler.jobs['hourly']
+        self.assertEqual(started, ['hourly'])
+        self.assertEqual(calls, [1])
+        self.assertEqual(job.missed, 4)
+        self.assertEqual(job.next_run, datetime(2024, 3, 1, 13, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+"""Tests for the local data store."""
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import tempfile
+import pandas as pd
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.storage.parquet_store import ParquetStore, export_to_sheets
+from src.storage.ingest import (
+    ingest_emails, ingest_daily_page_metrics, backfill_email_counts, ingest_orders, shopify_watermark
+)
+from src.storage.aggregates import read_email_counts, email_totals, weekly_counts, top_values, recent_emails
+from src.processors.analytics import rolling_page_metrics
+
+class TestParquetStore(unittest.TestCase):
+    """Tests for ParquetStore."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = ParquetStore(tmp.name)
+
+    def test_append_and_read_with_pushdown(self):
+        """Test rows land in date partitions and reads filter by date and column."""
+        emails = [
+            {'id': str(i), 'sender': f'{i}@example.com', 'subject': 'Hi'}
+            for i in range(3)
+        ]
+        parsed = [
+            {'sentiment': 'negative', 'main_issue': 'Refund', 'product': 'Widget X'},
+            {'sentiment': 'positive', 'main_issue': 'Praise', 'product': 'Widget X'},
+            {'sentiment': 'negative', 'main_issue': 'Late', 'product': 'Widget Y'}
+        ]
+        ingest_emails(self.store, emails[:2], parsed[:2], processed_at=pd.Timestamp('2024-03-01 10:00'))
+        ingest_emails(self.store, emails[2:], parsed[2:], processed_at=pd.Timestamp('2024-03-05 10:00'))
+
+        # Run test
+        df = self.store.read(
+            'emails',
+            columns=['message_id', 'sentiment'],
+            start_date='2024-03-01',
+            end_date='2024-03-02',
+            filters=[('sentiment', '==', 'negative')]
+        )
+
+        # Assert
+        self.assertEqual(list(df.columns), ['message_id', 'sentiment'])
+        self.assertEqual(list(df['message_id']), ['0'])
+        self.assertEqual(len(self.store.read('emails')), 3)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(self.store.read('emails')['processed_at']))
+
+    def test_read_missing_table(self):
+        """Test reading a table that was never written returns an empty frame."""
+        self.assertTrue(self.store.read('orders').empty)
+
+    def test_version_changes_on_every_append(self):
+        """Test the version token changes with each append and is read without listing the table."""
+        self.assertIsNone(self.store.version('page_daily'))
+        self.store.append('page_daily', pd.DataFrame({'ga:pagePath': ['/home'], 'date': ['2024-03-01']}),
+                          date_column='date')
+        first = self.store.version('page_daily')
+
+        with patch('os.walk') as mock_walk, patch('os.listdir') as mock_listdir:
+            self.assertEqual(self.store.version('page_daily'), first)
+        mock_walk.assert_not_called()
+        mock_listdir.assert_not_called()
+        self.assertEqual(len(self.store.read('page_daily')), 1)
+
+        self.store.append_empty('page_daily', '2024-03-02')
+        self.assertNotEqual(self.store.version('page_daily'), first)
+
+    def test_read_latest_keeps_newest_version(self):
+        """Test read_latest dedupes re-synced records by key."""
+        first = pd.DataFrame({'id': [1, 2], 'total_price': ['10.00', '20.00'], 'created_at': ['2024-03-01'] * 2})
+        second = pd.DataFrame({'id': [1], 'total_price': ['15.00'], 'created_at': ['2024-03-01']})
+        self.store.append('orders', first.assign(ingested_at=pd.Timestamp('2024-03-02', tz='UTC')), date_column='created_at')
+        self.store.append('orders', second.assign(ingested_at=pd.Timestamp('2024-03-03', tz='UTC')), date_column='created_at')
+
+        df = self.store.read_latest('orders', 'id', columns=['id', 'total_price']).sort_values('id')
+
+        self.assertEqual(list(df['total_price']), [15.0, 20.0])
+        self.assertEqual(self.store.last_ingested_at('orders'), pd.Timestamp('2024-03-03', tz='UTC'))
+
+    def test_export_to_sheets(self):
+        """Test a table can be mirrored to Sheets in one append."""
+        self.store.append('page_metrics', pd.DataFrame({'ga:pagePath': ['/a', '/b'], 'ga:sessions': [1, 2]}), date='2024-03-01')
+        service = MagicMock()
+
+        rows = export_to_sheets(self.store, 'page_metrics', service, 'test_id', 'Pages!A:B',
+                                columns=['ga:pagePath', 'ga:sessions'])
+
+        self.assertEqual(rows, 2)
+        body = service.spreadsheets().values().append.call_args.kwargs['body']
+        self.assertEqual(sorted(body['values']), [['/a', '1'], ['/b', '2']])
+
+class TestShopifySync(unittest.TestCase):
+    """Tests for incremental Shopify syncs."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = ParquetStore(tmp.name)
+
+    @patch('src.storage.ingest.iter_orders')
+    def test_orders_changed_during_a_sync_are_picked_up(self, mock_iter):
+        """Test the watermark is the start of the last sync, not the time its rows were appended."""
+        def order(order_id, updated_at):
+            return {'id': order_id, 'created_at': '2024-03-01T00:00:00Z', 'updated_at': updated_at}
+
+        sync_start = pd.Timestamp('2024-03-05 12:00', tz='UTC')
+        def slow_sync(**kwargs):
+            # Order 1 is paged first, then changes in Shopify while order 2 is still being fetched
+            yield pd.DataFrame([order(1, '2024-03-05T11:00:00Z')])
+            yield pd.DataFrame([order(2, '2024-03-05T12:30:00Z')])
+        mock_iter.side_effect = slow_sync
+
+        with patch('src.storage.ingest.pd.Timestamp.now', return_value=sync_start):
+            self.assertEqual(ingest_orders(self.store), 2)
+
+        watermark = shopify_watermark(self.store, 'orders', overlap=60)
+        self.assertEqual(watermark, sync_start - pd.Timedelta(seconds=60))
+        # Order 1's new version (updated 12:10) is after the watermark, so the next sync fetches it
+        self.assertLess(watermark, pd.Timestamp('2024-03-05T12:10:00Z'))
+
+        mock_iter.side_effect = lambda **kwargs: iter([pd.DataFrame([order(1, '2024-03-05T12:10:00Z')])])
+        ingest_orders(self.store, updated_at_min=watermark)
+        self.assertEqual(mock_iter.call_args.kwargs['updated_at_min'], watermark)
+
+        latest = self.store.read_latest('orders', 'id', columns=['id', 'updated_at']).sort_values('id')
+        self.assertEqual(list(latest['updated_at']), [pd.Timestamp('2024-03-05T12:10:00Z'),
+                                                      pd.Timestamp('2024-03-05T12:30:00Z')])
+
+    def test_empty_table_syncs_everything(self):
+        """Test there is no watermark before the first sync."""
+        self.assertIsNone(shopify_watermark(self.store, 'orders'))
+
+class TestEmailAggregates(unittest.TestCase):
+    """Tests for the email counts precomputed at ingest time."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = ParquetStore(tmp.name)
+        parsed = [
+            {'sentiment': 'negative', 'main_issue': 'Refund'},
+            {'sentiment': 'positive', 'main_issue': 'Praise'},
+            {'sentiment': 'negative', 'main_issue': 'Refund'},
+            {'sentiment': None, 'main_issue': 'Late'}
+        ]
+        emails = [{'id': str(i), 'sender': f'{i}@example.com', 'subject': 'Hi'} for i in range(4)]
+        # Two batches on Monday 2024-03-04, one the next Monday
+        ingest_emails(self.store, emails[:2], parsed[:2], processed_at=pd.Timestamp('2024-03-04 09:00'))
+        ingest_emails(self.store, emails[2:3], parsed[2:3], processed_at=pd.Timestamp('2024-03-04 17:00'))
+        ingest_emails(self.store, emails[3:], parsed[3:], processed_at=pd.Timestamp('2024-03-11 09:00'))
+
+    def test_counts_are_summed_across_batches(self):
+        """Test totals, weekly and top-value rollups of the per-batch counts."""
+        counts = read_email_counts(self.store)
+
+        self.assertEqual(email_totals(counts), {'total': 4, 'positive': 1, 'negative': 2})
+        weekly = weekly_counts(counts, 'sentiment')
+        self.assertEqual(list(weekly.index.strftime('%Y-%m-%d')), ['2024-03-04', '2024-03-11'])
+        self.assertEqual(weekly.loc['2024-03-04', 'negative'], 2)
+        self.assertEqual(weekly.loc['2024-03-11', 'unknown'], 1)
+        self.assertEqual(top_values(counts, 'main_issue', n=1).to_dict(), {'Refund': 2})
+        self.assertEqual(email_totals(read_email_counts(self.store, '2024-03-10', '2024-03-12'))['total'], 1)
+
+    def test_backfill_matches_ingest_time_counts(self):
+        """Test counts rebuilt from the emails table equal the incremental ones."""
+        expected = read_email_counts(self.store)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ParquetStore(tmp)
+            store.append('emails', self.store.read('emails'), date_column='processed_at')
+
+            self.assertGreater(backfill_email_counts(store), 0)
+            self.assertEqual(backfill_email_counts(store), 0)
+            pd.testing.assert_frame_equal(read_email_counts(store), expected)
+
+    def test_recent_emails_reads_newest_partitions(self):
+        """Test only the newest partitions are read for the recent emails."""
+        with patch.object(self.store, 'read', wraps=self.store.read) as mock_read:
+            recent = recent_emails(self.store, n=1)
+
+        self.assertEqual(list(recent['sender']), ['3@example.com'])
+        self.assertEqual(mock_read.call_count, 1)
+
+class TestDailyPageMetrics(unittest.TestCase):
+    """Tests for the daily page aggregates."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = ParquetStore(tmp.name)
+
+    @patch('src.storage.ingest.get_daily_page_metrics')
+    def test_only_missing_days_are_fetched(self, mock_fetch):
+        """Test stored days are skipped and gaps are fetched as contiguous ranges."""
+        def fetch(service, view_id, date_ranges):
+            days = [day.strftime('%Y-%m-%d') for start, end in date_ranges for day in pd.date_range(start, end)]
+            return pd.DataFrame({
+                'date': days,
+                'ga:pagePath': ['/home'] * len(days),
+                'ga:sessions': [10] * len(days),
+                'ga:pageviews': [20] * len(days),
+                'ga:bounces': [5] * len(days),
+                'ga:sessionDuration': [600.0] * len(days)
+            })
+        mock_fetch.side_effect = fetch
+
+        ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-02', '2024-03-02')
+        ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-04', '2024-03-04')
+        rows = ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-01', '2024-03-05')
+
+        self.assertEqual(rows, 3)
+        self.assertEqual(mock_fetch.call_args.args[2],
+                         [('2024-03-01', '2024-03-01'), ('2024-03-03', '2024-03-03'), ('2024-03-05', '2024-03-05')])
+        self.assertEqual(ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-01', '2024-03-05'), 0)
+        self.assertEqual(len(self.store.partitions('page_daily')), 5)
+
+    @patch('src.storage.ingest.get_daily_page_metrics')
+    def test_days_without_traffic_are_not_fetched_again(self, mock_fetch):
+        """Test days Analytics returns no rows for are recorded and skipped by later runs."""
+        mock_fetch.return_value = pd.DataFrame({
+            'date': ['2024-03-02'],
+            'ga:pagePath': ['/home'],
+            'ga:sessions': [10],
+            'ga:pageviews': [20],
+            'ga:bounces': [5],
+            'ga:sessionDuration': [600.0]
+        })
+
+        rows = ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-01', '2024-03-03')
+
+        self.assertEqual(rows, 1)
+        self.assertEqual(self.store.partitions('page_daily'), {'2024-03-01', '2024-03-02', '2024-03-03'})
+        self.assertEqual(ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-01', '2024-03-03'), 0)
+        mock_fetch.assert_called_once()
+        daily = self.store.read('page_daily', start_date='2024-03-01', end_date='2024-03-03')
+        self.assertEqual(list(daily['date']), ['2024-03-02'])
+
+        mock_fetch.return_value = mock_fetch.return_value.iloc[:0]
+        ingest_daily_page_metrics(self.store, MagicMock(), '123', '2024-03-04', '2024-03-04')
+        self.assertTrue(self.store.read('page_daily', start_date='2024-03-04').empty)
+
+    def test_rolling_page_metrics(self):
+        """Test window rates are derived from summed daily totals."""
+        daily = pd.DataFrame({
+            'ga:pagePath': ['/a', '/b', '/a'],
+            'ga:sessions': [10, 4, 30],
+            'ga:pageviews': [15, 40, 45],
+            'ga:bounces': [2, 0, 18],
+            'ga:sessionDuration': [100.0, 40.0, 300.0]
+        })
+
+        result = rolling_page_metrics(daily)
+
+        self.assertEqual(list(result['ga:pagePath']), ['/a', '/b'])
+        self.assertEqual(list(result['ga:pageviews']), [60, 40])
+        self.assertEqual(result['ga:bounceRate'][0], 50.0)
+        self.assertEqual(result['ga:avgSessionDuration'][0], 10.0)
+
+if __name__ == '__main__':
+    unittest.main()
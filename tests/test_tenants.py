@@ -0,0 +1,209 @@
+"""Tests for the tenant registry and runner."""
+import unittest
+from unittest.mock import patch, MagicMock
+import concurrent.futures
+import importlib
+import json
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.metrics import MetricsRegistry
+from src.tenants import Tenant, TenantRunner, load_tenants, run_tenant, sync_tenant_emails, DEFAULT_RATE_LIMITS
+
+class TestTenantRegistry(unittest.TestCase):
+    """Tests for loading tenants."""
+
+    def test_load_tenants(self):
+        """Test registry entries get defaults, expanded secrets and separate data directories."""
+        registry = {'tenants': [
+            {'name': 'acme', 'gmail_user': 'support@acme.example', 'rate_limits': {'gmail': 5},
+             'shopify': {'store_url': 'acme.myshopify.com', 'api_key': 'k', 'api_secret': '${ACME_SECRET}'}},
+            {'name': 'globex', 'ga_view_id': '123'}
+        ]}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'tenants.json')
+            with open(path, 'w') as f:
+                json.dump(registry, f)
+            with patch.dict(os.environ, {'ACME_SECRET': 's3cret'}):
+                acme, globex = load_tenants(path)
+
+        self.assertEqual(acme.shopify['api_secret'], 's3cret')
+        self.assertEqual(acme.rate_limits, dict(DEFAULT_RATE_LIMITS, gmail=5))
+        self.assertNotEqual(acme.checkpoint_path, globex.checkpoint_path)
+        self.assertNotEqual(acme.store_path, globex.store_path)
+        self.assertIsNone(globex.gmail_user)
+
+    def test_invalid_or_duplicate_names(self):
+        """Test tenant names must be path-safe and unique."""
+        with self.assertRaises(ValueError):
+            Tenant('../etc')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'tenants.json')
+            with open(path, 'w') as f:
+                json.dump([{'name': 'acme'}, {'name': 'acme'}], f)
+            with self.assertRaises(ValueError):
+                load_tenants(path)
+
+    def test_default_rate_limits_follow_the_environment(self):
+        """Test tenant rate limits default to the per-API settings operators set."""
+        import src.config
+        with patch.dict(os.environ, {'GMAIL_RATE_LIMIT': '5', 'TENANT_SHOPIFY_RATE_LIMIT': '1'}):
+            os.environ.pop('SHEETS_RATE_LIMIT', None)
+            os.environ.pop('TENANT_SHEETS_RATE_LIMIT', None)
+            limits = importlib.reload(src.config).TENANT_RATE_LIMITS
+        importlib.reload(src.config)
+
+        self.assertEqual(limits['gmail'], 5.0)
+        self.assertEqual(limits['shopify'], 1.0)
+        self.assertEqual(limits['sheets'], 1.0)
+
+class TestTenantJobs(unittest.TestCase):
+    """Tests for per-tenant jobs."""
+
+    @patch('src.tenants.process_email_queue')
+    @patch('src.tenants.get_gmail_credentials')
+    def test_sync_tenant_emails_uses_tenant_mailbox_and_checkpoint(self, mock_credentials, mock_process):
+        """Test the tenant's mailbox, checkpoint, queue and store are used."""
+        with tempfile.TemporaryDirectory() as tmp:
+            tenant = Tenant('acme', gmail_user='support@acme.example', data_dir=tmp)
+            mock_process.return_value = {'acked': 1}
+
+            self.assertEqual(sync_tenant_emails(tenant), 1)
+
+            self.assertTrue(os.path.exists(tenant.queue_path))
+        args, kwargs = mock_process.call_args
+        self.assertEqual(args[2].root, tenant.store_path)
+        self.assertEqual(kwargs['checkpoint_path'], tenant.checkpoint_path)
+        self.assertEqual(kwargs['user_id'], 'support@acme.example')
+
+    @patch('src.tenants.process_email_queue', return_value={'acked': 0})
+    @patch('src.tenants.get_gmail_credentials')
+    def test_sync_tenant_emails_impersonates_each_mailbox(self, mock_credentials, mock_process):
+        """Test every tenant's credentials are delegated to that tenant's mailbox."""
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('acme', 'globex'):
+                tenant = Tenant(name, gmail_user=f'support@{name}.example', google_credentials=f'{name}.json',
+                                data_dir=os.path.join(tmp, name))
+                sync_tenant_emails(tenant)
+
+        self.assertEqual(
+            [(c.args, c.kwargs) for c in mock_credentials.call_args_list],
+            [(('acme.json',), {'subject': 'support@acme.example'}),
+             (('globex.json',), {'subject': 'support@globex.example'})]
+        )
+        self.assertEqual([c.args[0] for c in mock_process.call_args_list],
+                         [mock_credentials.return_value] * 2)
+
+    @patch('src.tenants.get_registry')
+    @patch('src.tenants.set_rate_limits')
+    def test_run_tenant_isolates_job_failures(self, mock_limits, mock_registry):
+        """Test a failing job is reported without stopping the tenant's other jobs."""
+        registry = mock_registry.return_value = MetricsRegistry()
+        registry.increment('left_over_total')
+        tenant = Tenant('acme', rate_limits={'shopify': 1})
+        jobs = {'process_emails': MagicMock(side_effect=RuntimeError("quota")),
+                'sync_shop_data': MagicMock(side_effect=lambda t: registry.increment('orders_total', 7) or 7)}
+
+        with patch.dict('src.tenants.TENANT_JOBS', jobs):
+            results, snapshot = run_tenant(tenant, ['process_emails', 'sync_shop_data'])
+
+        self.assertEqual(results, {'process_emails': None, 'sync_shop_data': 7})
+        mock_limits.assert_called_once_with(tenant.rate_limits)
+        self.assertEqual([(c['name'], c['value']) for c in snapshot['counters']], [('orders_total', 7)])
+
+class TestTenantRunner(unittest.TestCase):
+    """Tests for TenantRunner."""
+
+    @patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)
+    def test_work_for_a_tenant_never_overlaps(self):
+        """Test a tenant's queued work waits for its running work, while other tenants proceed."""
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def fake_run_tenant(tenant, jobs):
+            with lock:
+                if tenant.name in running:
+                    overlaps.append(tenant.name)
+                running.add(tenant.name)
+            time.sleep(0.02)
+            with lock:
+                running.discard(tenant.name)
+            return {job: 1 for job in jobs}, MetricsRegistry().snapshot()
+
+        runner = TenantRunner([Tenant('acme'), Tenant('globex')], max_workers=4)
+        try:
+            with patch('src.tenants.run_tenant', fake_run_tenant):
+                first = [runner.submit(tenant, ['process_emails']) for tenant in runner.tenants]
+                results = runner.run(['sync_shop_data'])
+        finally:
+            runner.shutdown()
+
+        self.assertEqual(overlaps, [])
+        self.assertTrue(all(future.done() for future in first))
+        self.assertEqual(results, {'acme': {'sync_shop_data': 1}, 'globex': {'sync_shop_data': 1}})
+
+    @patch('src.tenants.get_registry')
+    @patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)
+    def test_worker_metrics_reach_the_parent(self, mock_registry):
+        """Test metrics recorded in a tenant worker are merged into the parent registry per tenant."""
+        parent = mock_registry.return_value = MetricsRegistry()
+
+        def fake_run_tenant(tenant, jobs):
+            worker = MetricsRegistry()
+            worker.increment('gmail_messages_fetched_total', 3)
+            worker.observe('llm_request_seconds', 0.2, chain='email_batch')
+            return {job: 3 for job in jobs}, worker.snapshot()
+
+        runner = TenantRunner([Tenant('acme'), Tenant('globex')], max_workers=2)
+        try:
+            with patch('src.tenants.run_tenant', fake_run_tenant):
+                runner.run(['process_emails'])
+                runner.run(['process_emails'])
+        finally:
+            runner.shutdown()
+
+        snapshot = parent.snapshot()
+        fetched = {c['labels']['tenant']: c['value'] for c in snapshot['counters']
+                   if c['name'] == 'gmail_messages_fetched_total'}
+        self.assertEqual(fetched, {'acme': 6, 'globex': 6})
+        latency = [h for h in snapshot['histograms'] if h['labels'] == {'chain': 'email_batch', 'tenant': 'acme'}]
+        self.assertEqual((latency[0]['count'], latency[0]['buckets']['0.25']), (2, 2))
+
+    @patch('src.tenants.get_registry')
+    @patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)
+    def test_failed_merge_still_settles_the_tenant(self, mock_registry):
+        """Test a metrics merge error neither loses the results nor blocks later work for the tenant."""
+        mock_registry.return_value.merge.side_effect = KeyError('buckets')
+
+        runner = TenantRunner([Tenant('acme')], max_workers=1)
+        try:
+            with patch('src.tenants.run_tenant', lambda tenant, jobs: ({job: 1 for job in jobs}, {})):
+                first = runner.run(['process_emails'])
+                second = runner.run(['sync_shop_data'])
+        finally:
+            runner.shutdown()
+
+        self.assertEqual(first, {'acme': {'process_emails': 1}})
+        self.assertEqual(second, {'acme': {'sync_shop_data': 1}})
+
+    @patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)
+    def test_malformed_worker_outcome_fails_the_tenant(self):
+        """Test an outcome that cannot be unpacked settles the tenant's future with the error."""
+        runner = TenantRunner([Tenant('acme')], max_workers=1)
+        try:
+            with patch('src.tenants.run_tenant', lambda tenant, jobs: None):
+                future = runner.submit(runner.tenants[0], ['process_emails'])
+                with self.assertRaises(TypeError):
+                    future.result(timeout=5)
+        finally:
+            runner.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Tests for the durable email work queue."""
+import unittest
+from unittest.mock import patch, MagicMock, ANY
+import sys
+import os
+import tempfile
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.work_queue import EmailWorkQueue, process_email_queue, QUEUED, FETCHED, ACKED
+from src.storage.parquet_store import ParquetStore
+
+def make_message(message_id):
+    """Build a raw Gmail message resource."""
+    return {'id': message_id, 'payload': {'headers': []}}
+
+def make_email(msg):
+    """Stand-in for parse_message."""
+    return {'id': msg['id'], 'sender': f"{msg['id']}@example.com", 'subject': 'Order', 'body': 'Where is it?'}
+
+class TestEmailWorkQueue(unittest.TestCase):
+    """Tests for EmailWorkQueue."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = [1000.0]
+        self.path = os.path.join(self.tmp.name, 'queue.sqlite3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_queue(self):
+        return EmailWorkQueue(self.path, lease=60, max_attempts=3, retry_delay=10, clock=lambda: self.now[0])
+
+    def test_leases_keep_workers_apart(self):
+        """Test claimed messages are hidden from other workers until the lease expires."""
+        first, second = self.make_queue(), self.make_queue()
+        self.assertEqual(first.enqueue(['1', '2']), 2)
+        self.assertEqual(first.enqueue(['2', '3']), 1)
+
+        claimed = first.claim(QUEUED, limit=2)
+        self.assertEqual([item['message_id'] for item in claimed], ['1', '2'])
+        self.assertEqual([item['message_id'] for item in second.claim(QUEUED)], ['3'])
+
+        # The first worker stalls; its lease runs out and the second takes over
+        self.now[0] += 61
+        self.assertEqual([item['message_id'] for item in second.claim(QUEUED, limit=2)], ['1', '2'])
+        self.assertFalse(first.advance('1', QUEUED, email={'id': '1'}))
+        self.assertTrue(second.advance('1', QUEUED, email={'id': '1'}))
+        self.assertEqual(second.claim(FETCHED)[0]['email'], {'id': '1'})
+
+    def test_failing_messages_are_parked(self):
+        """Test released messages wait for the retry delay and stop after max_attempts claims."""
+        queue = self.make_queue()
+        queue.enqueue(['1'])
+        for _ in range(3):
+            self.assertEqual(len(queue.claim(QUEUED)), 1)
+            queue.release('1', 'boom')
+            self.assertEqual(queue.claim(QUEUED), [])
+            self.now[0] += 10
+
+        self.assertEqual(queue.claim(QUEUED), [])
+        self.assertEqual(queue.counts()['parked'], 1)
+
+    def test_acked_messages_are_purged_after_retention(self):
+        """Test acked messages are ignored when listed again and deleted once retention passes."""
+        queue = EmailWorkQueue(self.path, acked_retention=100, clock=lambda: self.now[0])
+        queue.enqueue(['1', '2'])
+        for state in (QUEUED, FETCHED, 'parsed', 'written'):
+            for item in queue.claim(state, limit=1):
+                queue.advance(item['message_id'], state)
+
+        self.now[0] += 50
+        self.assertEqual(queue.purge_acked(), 0)
+        self.assertEqual(queue.enqueue(['1']), 0)
+
+        self.now[0] += 50
+        self.assertEqual(queue.purge_acked(), 1)
+        self.assertEqual(queue.counts()[ACKED], 0)
+        self.assertEqual(queue.counts()[QUEUED], 1)
+
+class TestProcessEmailQueue(unittest.TestCase):
+    """Tests for process_email_queue."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = [1000.0]
+        self.queue = EmailWorkQueue(os.path.join(self.tmp.name, 'queue.sqlite3'), retry_delay=10,
+                                    clock=lambda: self.now[0])
+        self.store = ParquetStore(os.path.join(self.tmp.name, 'store'))
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    @patch('src.work_queue.SHEETS_MIRROR_ENABLED', True)
+    @patch('src.work_queue.get_sheets_service')
+    @patch('src.work_queue.SheetsBatchWriter')
+    @patch('src.work_queue.mark_as_read')
+    @patch('src.work_queue.parse_emails')
+    @patch('src.work_queue.parse_message', side_effect=make_email)
+    @patch('src.work_queue.fetch_messages')
+    @patch('src.work_queue.get_gmail_service')
+    @patch('src.work_queue.save_history_checkpoint')
+    @patch('src.work_queue.list_new_message_ids')
+    def test_resumes_after_a_failed_write(self, mock_list, mock_save, mock_gmail, mock_fetch, mock_parse_message,
+                                          mock_parse, mock_mark, mock_writer, mock_sheets):
+        """Test a run failing at the Sheets write is resumed without re-parsing or duplicate rows."""
+        mock_list.return_value = (['1', '2'], '42')
+        mock_fetch.side_effect = lambda gmail, ids, user_id=None: [make_message(i) for i in ids]
+        mock_parse.side_effect = lambda emails: [
+            {'sentiment': 'negative', 'main_issue': 'shipping', 'product': None} for _ in emails
+        ]
+        mock_writer.return_value.__exit__.return_value = False
+        writer = mock_writer.return_value.__enter__.return_value
+        writer.add.side_effect = [RuntimeError("quota"), None, None]
+
+        progress = process_email_queue(MagicMock(), self.queue, self.store, spreadsheet_id='sheet', batch_size=10)
+
+        self.assertEqual(progress[ACKED], 0)
+        mock_save.assert_called_once_with('42', ANY)
+        mock_mark.assert_not_called()
+        self.assertEqual(len(self.store.read('emails')), 2)
+
+        # Next run: nothing new in Gmail, the stuck batch is picked up again
+        mock_list.return_value = ([], '43')
+        self.now[0] += 10
+        progress = process_email_queue(MagicMock(), self.queue, self.store, spreadsheet_id='sheet', batch_size=10)
+
+        self.assertEqual(progress[ACKED], 2)
+        mock_parse.assert_called_once()
+        self.assertEqual(sorted(self.store.read('emails')['message_id']), ['1', '2'])
+        self.assertEqual(writer.add.call_count, 3)
+        mock_mark.assert_called_once_with(ANY, ['1', '2'], user_id=None)
+        self.assertEqual(self.queue.counts()[ACKED], 2)
+
+if __name__ == '__main__':
+    unittest.main()